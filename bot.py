@@ -1,36 +1,48 @@
 import sys
+import time
+
+# Everything in the startup timeline is measured from here
+STARTUP_START = time.perf_counter()
+startup_timeline: list[tuple[str, float]] = []
+
+def mark_startup(step: str):
+    """Records how long into startup `step` was reached, for the timeline logged once the bot is ready"""
+    startup_timeline.append((step, time.perf_counter() - STARTUP_START))
 
 print('Getting ready...')
 print('Python ' + sys.version)
 
 import asyncio
 import glob
+import hashlib
 import itertools
+import json
 import logging
 import math
 import os
 import random
-import subprocess
+import sqlite3
 import sys
 import time
 import traceback
 import urllib.request
 from inspect import currentframe
 from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Iterator
 
 import aioconsole
 import colorama
 import discord
-import pytube
 import regex as re
 import requests
-import yaml
 import yt_dlp
-from benedict import benedict
 from colorama import Back, Fore, Style
+from discord import app_commands
 from discord.ext import commands
 from pretty_help import PrettyHelp
 
+mark_startup('imports')
+
 print('Checking for config file...')
 
 if not Path('config_default.yml').is_file():
@@ -42,19 +54,31 @@ if not Path('config.yml').is_file():
     with open('config.yml', 'w') as f:
         f.write('')
 
-with open('config_default.yml','r') as f:
-    config_default = benedict(yaml.safe_load(f))
+import settings
 
-with open('config.yml','r') as f:
-    config = benedict(yaml.safe_load(f) or {})
+mark_startup('config')
 
 print('Importing local packages...')
 
 # Import local files after main packages, and after validating config
 import customlog
+import diagnostics
+import looplag
+import loudness
+import messages
+import metrics
+import negcache
+import resolverservice
+import scheduler
+import sharding
 import spoofy
 import update
 import palette
+import probe
+import queuestore
+import workerpool
+
+mark_startup('local packages')
 
 _here = Path(__file__).name
 
@@ -63,7 +87,8 @@ with open('version.txt','r') as f:
     VERSION = f.read().strip()
 
 # Setup discord logging
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
+# Named like customlog's file, so each process started by launcher.py has its own
+handler = logging.FileHandler(filename=customlog.log_name.replace('vimusbot', 'discord', 1)+'.log', encoding='utf-8', mode='w')
 discord.utils.setup_logging(handler=handler, level=logging.INFO, root=False)
 
 # Setup bot logging
@@ -85,62 +110,167 @@ def log_line():
     cf = currentframe()
     print('@ LINE ', cf.f_back.f_lineno)
 
-if __name__ == '__main__':
-    log(f'Running on version {VERSION}; checking for updates...')
-
-    update_check_result = update.check()
+def log_update_check():
+    """Checks for a newer release and logs the result; runs in the background so startup doesn't wait on GitHub"""
+    try:
+        is_latest, versions = update.check_cached()
+    except Exception as e:
+        log(f'{plt.warn}Couldn\'t check for updates: {e}')
+        return
 
-    # Check for an outdated version.txt
-    if update_check_result[0] == False and update_check_result[1] == True:
+    if VERSION.startswith('dev.'):
+        log(f'{plt.yellow}NOTICE: You are running a development version.')
+    elif not is_latest:
+        # Check for an outdated version.txt
         log(f'{plt.warn}There is a new release available.')
-        current_tag = update_check_result[1]['current']
-        latest_tag = update_check_result[1]['latest']['tag_name']
+        current_tag = versions['current']
+        latest_tag = versions['latest']['tag_name']
         log(f'Current: {plt.gold}{current_tag}{plt.reset} | Latest: {plt.lime}{latest_tag}')
         log('Use "update.py" to update.')
     else:
-        if VERSION.startswith('dev.'):
-            log(f'{plt.yellow}NOTICE: You are running a development version.')
-        else:
-            log(f'{plt.lime}You are up to date.')
+        log(f'{plt.lime}You are up to date.')
 
     log('Changelog: https://github.com/svioletg/viMusBot/blob/master/docs/changelog.md')
 
 log('Parsing config...')
 
 #region CONFIGURATION FROM YAML
-PUBLIC             : bool = config.get('public', config_default['public'])
-TOKEN_FILE_PATH    : str  = config.get('token-file', config_default['token-file'])
-PUBLIC_PREFIX      : str  = config.get('prefixes.public', config_default['prefixes.public'])
-DEV_PREFIX         : str  = config.get('prefixes.developer', config_default['prefixes.developer'])
-EMBED_COLOR        : int  = int(config.get('embed-color', config_default['embed-color']), 16)
-INACTIVITY_TIMEOUT : int  = config.get('inactivity-timeout', config_default['inactivity-timeout'])
-CLEANUP_EXTENSIONS : list = config.get('auto-remove', config_default['auto-remove'])
-DISABLED_COMMANDS  : list = config.get('command-blacklist', config_default['command-blacklist'])
-
-SHOW_USERS_IN_QUEUE      : bool = config.get('show-users-in-queue', config_default['show-users-in-queue'])
-ALLOW_SPOTIFY_PLAYLISTS  : bool = config.get('allow-spotify-playlists', config_default['allow-spotify-playlists'])
-USE_TOP_MATCH            : bool = config.get('use-top-match', config_default['use-top-match'])
-USE_URL_CACHE            : bool = config.get('use-url-cache', config_default['use-url-cache'])
-SPOTIFY_PLAYLIST_LIMIT   : int  = config.get('spotify-playlist-limit', config_default['spotify-playlist-limit'])
-DURATION_LIMIT           : int  = config.get('duration-limit', config_default['duration-limit'])
-MAXIMUM_CONSECUTIVE_URLS : int  = config.get('maximum-urls', config_default['maximum-urls'])
-
-VOTE_TO_SKIP          : bool = config.get('vote-to-skip.enabled', config_default['vote-to-skip.enabled'])
-SKIP_VOTES_TYPE       : str  = config.get('vote-to-skip.threshold-type', config_default['vote-to-skip.threshold-type'])
-SKIP_VOTES_EXACT      : int  = config.get('vote-to-skip.threshold-exact', config_default['vote-to-skip.threshold-exact'])
-SKIP_VOTES_PERCENTAGE : int  = config.get('vote-to-skip.threshold-percentage', config_default['vote-to-skip.threshold-percentage'])
+# Only read at startup; changing these needs a restart
+PUBLIC           : bool = settings.current().public
+TOKEN_FILE_PATH  : str  = settings.current().token_file
+PUBLIC_PREFIX    : str  = settings.current().public_prefix
+DEV_PREFIX       : str  = settings.current().dev_prefix
+RESOLVER_WORKERS : int  = settings.current().resolver_workers
+RESOLVER_SERVICE : str|None = settings.current().resolver_service_address if settings.current().resolver_service_enabled else None
+EXECUTION_MODE   : str  = settings.current().execution_mode
+EXECUTION_WORKERS: int  = settings.current().execution_workers
+PREFIX_COMMANDS  : bool = settings.current().prefix_commands
+LEAN_MODE        : bool = settings.current().lean_mode
+MESSAGE_CACHE    : int  = settings.current().message_cache_size
+METRICS_ADDRESS  : str|None = settings.current().metrics_address if settings.current().metrics_enabled else None
+PERSISTENT_QUEUES: bool = settings.current().persistent_queues
+
+# launcher.py passes each process its shards on the command line, which take priority over the config
+SHARD_IDS   : list[int] = sharding.parse_range(sharding.options.shards or settings.current().shard_range)
+SHARD_COUNT : int       = sharding.options.shard_count or settings.current().shard_count
+SHARDING    : bool      = settings.current().sharding_enabled or bool(SHARD_IDS)
+# Files shared by every process on a host (slash command hash, leftover media) are only handled by the one running shard 0
+PRIMARY_PROCESS : bool  = not SHARD_IDS or 0 in SHARD_IDS
+
+# Set by apply_config() below, and again whenever the config is reloaded
+EMBED_COLOR        : int
+INACTIVITY_TIMEOUT : int
+CLEANUP_EXTENSIONS : tuple
+DISABLED_COMMANDS  : tuple
+
+SHOW_USERS_IN_QUEUE      : bool
+ALLOW_SPOTIFY_PLAYLISTS  : bool
+USE_TOP_MATCH            : bool
+USE_URL_CACHE            : bool
+SPOTIFY_PLAYLIST_LIMIT   : int
+DURATION_LIMIT           : int
+MAXIMUM_CONSECUTIVE_URLS : int
+URL_CONCURRENCY          : int
+PROGRESSIVE_QUEUEING     : bool
+PLAYLIST_WINDOW          : int
+PLAYLIST_LOOKAHEAD       : int
+
+VOTE_TO_SKIP          : bool
+SKIP_VOTES_TYPE       : str
+SKIP_VOTES_EXACT      : int
+SKIP_VOTES_PERCENTAGE : int
+
+RESOLVER_GUILD_CONCURRENCY : int
+RESOLVER_MAX_GUILD_BACKLOG : int
+RESOLVER_RESERVED_WORKERS  : int
+RESOLVER_MAX_BACKLOG       : int
+
+RESOLVER_SERVICE_TIMEOUT : float
+EXECUTION_TIMEOUT        : float
+
+STARTUP_BUDGET_READY   : float
+STATUS_UPDATE_INTERVAL : float
+LOOP_LAG_THRESHOLD     : float
+PREWARM_SECONDS        : float
+
+LOUDNESS_NORMALIZATION : bool
+LOUDNESS_TARGET        : float
+NEGATIVE_CACHE_TTLS    : dict[str, float]
+
+def apply_config(cfg: settings.Config):
+    """Sets the constants above from a config snapshot"""
+    global EMBED_COLOR, INACTIVITY_TIMEOUT, CLEANUP_EXTENSIONS, DISABLED_COMMANDS
+    global SHOW_USERS_IN_QUEUE, ALLOW_SPOTIFY_PLAYLISTS, USE_TOP_MATCH, USE_URL_CACHE, SPOTIFY_PLAYLIST_LIMIT, DURATION_LIMIT
+    global MAXIMUM_CONSECUTIVE_URLS, URL_CONCURRENCY, PROGRESSIVE_QUEUEING, PLAYLIST_WINDOW, PLAYLIST_LOOKAHEAD
+    global VOTE_TO_SKIP, SKIP_VOTES_TYPE, SKIP_VOTES_EXACT, SKIP_VOTES_PERCENTAGE
+    global RESOLVER_GUILD_CONCURRENCY, RESOLVER_MAX_GUILD_BACKLOG, RESOLVER_RESERVED_WORKERS, RESOLVER_MAX_BACKLOG, RESOLVER_SERVICE_TIMEOUT
+    global EXECUTION_TIMEOUT
+    global STARTUP_BUDGET_READY, STATUS_UPDATE_INTERVAL, LOOP_LAG_THRESHOLD, PREWARM_SECONDS
+    global LOUDNESS_NORMALIZATION, LOUDNESS_TARGET, NEGATIVE_CACHE_TTLS
+
+    EMBED_COLOR        = int(cfg.embed_color, 16)
+    INACTIVITY_TIMEOUT = cfg.inactivity_timeout
+    CLEANUP_EXTENSIONS = cfg.cleanup_extensions
+    DISABLED_COMMANDS  = cfg.disabled_commands
+
+    SHOW_USERS_IN_QUEUE      = cfg.show_users_in_queue
+    ALLOW_SPOTIFY_PLAYLISTS  = cfg.allow_spotify_playlists
+    USE_TOP_MATCH            = cfg.use_top_match
+    USE_URL_CACHE            = cfg.use_url_cache
+    SPOTIFY_PLAYLIST_LIMIT   = cfg.spotify_playlist_limit
+    DURATION_LIMIT           = cfg.duration_limit
+    MAXIMUM_CONSECUTIVE_URLS = cfg.maximum_urls
+    URL_CONCURRENCY          = cfg.url_concurrency
+    PROGRESSIVE_QUEUEING     = cfg.progressive_queueing
+    PLAYLIST_WINDOW          = cfg.playlist_window
+    PLAYLIST_LOOKAHEAD       = cfg.playlist_lookahead
+
+    VOTE_TO_SKIP          = cfg.vote_to_skip
+    SKIP_VOTES_TYPE       = cfg.skip_votes_type
+    SKIP_VOTES_EXACT      = cfg.skip_votes_exact
+    SKIP_VOTES_PERCENTAGE = cfg.skip_votes_percentage
+
+    RESOLVER_GUILD_CONCURRENCY = cfg.resolver_guild_concurrency
+    RESOLVER_RESERVED_WORKERS  = cfg.resolver_reserved_workers
+    RESOLVER_MAX_GUILD_BACKLOG = cfg.resolver_max_guild_backlog
+    RESOLVER_MAX_BACKLOG       = cfg.resolver_max_backlog
+    RESOLVER_SERVICE_TIMEOUT   = cfg.resolver_service_timeout
+    EXECUTION_TIMEOUT          = cfg.execution_timeout
+
+    STARTUP_BUDGET_READY   = cfg.startup_budget_ready
+    STATUS_UPDATE_INTERVAL = cfg.status_update_interval
+    LOOP_LAG_THRESHOLD     = cfg.loop_lag_threshold
+    PREWARM_SECONDS        = cfg.prewarm_seconds
+
+    LOUDNESS_NORMALIZATION = cfg.loudness_enabled
+    LOUDNESS_TARGET        = cfg.loudness_target
+    NEGATIVE_CACHE_TTLS    = {
+        negcache.PERMANENT: cfg.negative_cache_permanent,
+        negcache.RESTRICTED: cfg.negative_cache_restricted,
+        negcache.NO_MATCH: cfg.negative_cache_no_match,
+        negcache.TRANSIENT: cfg.negative_cache_transient,
+    } if cfg.negative_cache_enabled else {}
+
+apply_config(settings.current())
 #endregion
 
 skip_votes_remaining = 0
-skip_votes = []
+# IDs of the members who have voted
+skip_votes: list[int] = []
 
-# Clear out downloaded files
-log('Removing previously downloaded media files...')
-files = glob.glob('*.*')
-to_remove = [f for f in files if Path(f).suffix in CLEANUP_EXTENSIONS]
-for t in to_remove:
-    os.remove(t)
-del files, to_remove
+def find_leftover_media() -> list[str]:
+    """Lists downloaded media files left over from the last run, apart from any that will be resumed"""
+    keep = {os.path.basename(playing.filename) for playing in queue_store.playing() if playing.filename} if queue_store is not None else set()
+    with os.scandir('.') as entries:
+        return [entry.name for entry in entries if entry.is_file() and Path(entry.name).suffix in CLEANUP_EXTENSIONS and entry.name not in keep]
+
+def remove_files(files: list[str]):
+    for file in files:
+        try:
+            os.remove(file)
+        except OSError as e:
+            log(f'{plt.warn}Couldn\'t remove {file}: {e}')
+    log(f'Removed {len(files)} leftover media file(s).', verbose=True)
 
 def embedq(*args: str) -> discord.Embed:
     """Shortcut for making new embeds"""
@@ -186,27 +316,50 @@ ytdl_format_options = {
     'source_address': '0.0.0.0',  # bind to ipv4 since ipv6 addresses cause issues sometimes
 }
 
-ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
+ytdl = spoofy.LazyClient('yt-dlp (playback)', lambda: yt_dlp.YoutubeDL(ytdl_format_options))
 
 ffmpeg_options = {
     'options': '-vn',
 }
 
+# Measures each downloaded track's loudness in the background, for it to be evened out whenever it's played
+loudness_analyzer = loudness.Analyzer(loudness.LoudnessStore())
+
+def playback_options(key: str, offset: float=0) -> dict[str, str]:
+    """FFmpeg options for playing the track `key` from `offset` seconds in"""
+    options = dict(ffmpeg_options)
+    if offset > 0:
+        # As an input option, FFmpeg jumps straight to the offset instead of decoding everything before it,
+        # which for a stream URL means a range request starting there
+        options['before_options'] = f'-ss {offset:.3f} {options.get("before_options", "")}'.strip()
+    if LOUDNESS_NORMALIZATION:
+        options['options'] = f'{options.get("options", "")} -af {loudness_analyzer.audio_filter(key, LOUDNESS_TARGET)}'.strip()
+    return options
+
 class YTDLSource(discord.PCMVolumeTransformer):
     def __init__(self, source, *, data, volume=0.5):
         super().__init__(source, volume)
 
         self.data = data
+        # Set by from_url(); the downloaded file, or the stream URL if streaming
+        self.filename: str|None = None
+        # Where in the track this source started, and how many 20ms frames it's played since
+        self.offset: float = 0
+        self.frames: int = 0
 
         self.title = data.get('title')
         self.url = data.get('url')
         self.ID = data.get('id')
         self.src = data.get('extractor')
+        # What its loudness measurement is stored under
+        self.key = f'{self.src}-{self.ID}'
 
     @classmethod
-    async def from_url(cls, url, *, loop=None, stream=False):
+    async def from_url(cls, url, *, loop=None, stream=False, bitrate: int=0):
         loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
+        # Always run on this machine, even with a resolver service, since the file needs to end up here
+        with download_seconds.time():
+            data = await loop.run_in_executor(None, lambda: lookups.local('playback_info', url, not stream, bitrate))
 
         try:
             if 'entries' in data:
@@ -216,17 +369,141 @@ class YTDLSource(discord.PCMVolumeTransformer):
             raise e
 
         filename = data['url'] if stream else ytdl.prepare_filename(data)
+        if not stream:
+            try:
+                downloaded_bytes.inc(os.path.getsize(filename))
+            except OSError:
+                pass
         src = filename.split('-#-')[0]
         ID = filename.split('-#-')[1]
-        return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data)
+        key = f'{data.get("extractor")}-{data.get("id")}'
+        source = cls(discord.FFmpegPCMAudio(filename, **playback_options(key)), data=data)
+        source.filename = filename
+        if LOUDNESS_NORMALIZATION and not stream:
+            loudness_analyzer.submit(source.key, filename)
+        return source
+
+    def read(self) -> bytes:
+        data = super().read()
+        if data:
+            self.frames += 1
+        return data
+
+    @property
+    def position(self) -> float:
+        """Seconds into the track that have been played; frames aren't read while paused, so pauses aren't counted"""
+        return self.offset + self.frames * discord.opus.Encoder.FRAME_LENGTH / 1000
+
+    def replay(self, offset: float=0) -> 'YTDLSource':
+        """Returns a new source that plays the same file from `offset` seconds in, without downloading it again"""
+        source = YTDLSource(discord.FFmpegPCMAudio(self.filename, **playback_options(self.key, offset)), data=self.data, volume=self.volume)
+        source.filename = self.filename
+        source.offset = offset
+        # Set by play_item() on whatever's playing
+        for name in ('weburl', 'user', 'duration', 'duration_stamp'):
+            if hasattr(self, name):
+                setattr(source, name, getattr(self, name))
+        return source
+
+    @property
+    def replayable(self) -> bool:
+        return self.filename is not None and (os.path.isfile(self.filename) or self.filename.startswith(('http://', 'https://')))
+
+# Shared between guilds so that one guild's playlists can't take up every lookup
+resolver = scheduler.ResolutionScheduler(
+    workers=RESOLVER_WORKERS,
+    guild_concurrency=RESOLVER_GUILD_CONCURRENCY,
+    reserved_interactive=RESOLVER_RESERVED_WORKERS,
+    max_guild_backlog=RESOLVER_MAX_GUILD_BACKLOG,
+    max_backlog=RESOLVER_MAX_BACKLOG
+)
+
+# yt-dlp parsing and match scoring hold the GIL, so in "process" mode they run in worker processes
+# instead of threads, where they can't hold up the event loop or voice playback
+if EXECUTION_MODE not in ['thread', 'process']:
+    log(f'{plt.warn}Unknown execution mode "{EXECUTION_MODE}"; using "thread" instead.')
+    EXECUTION_MODE = 'thread'
+worker_pool = workerpool.WorkerPool(EXECUTION_WORKERS, EXECUTION_TIMEOUT) if EXECUTION_MODE == 'process' else None
+
+# The lookups themselves, which run in a resolver service's worker processes if one is set up,
+# so matching and metadata parsing don't compete with voice playback for this process's time
+# Failed lookups, so the same broken link or search isn't run again every time it's asked for
+negative_cache = negcache.NegativeCache(NEGATIVE_CACHE_TTLS)
+lookups = resolverservice.ResolverClient(RESOLVER_SERVICE, timeout=RESOLVER_SERVICE_TIMEOUT, pool=worker_pool, negative_cache=negative_cache)
+
+# Debounces status message edits and holds back deletes so commands stay under each channel's rate limits
+message_manager = messages.MessageManager(edit_interval=STATUS_UPDATE_INTERVAL)
+
+# Finds out which synchronous calls are holding up the event loop; started in main() once the loop is running
+loop_watchdog = looplag.LoopWatchdog(threshold=LOOP_LAG_THRESHOLD)
+
+# Used by the "profile" and "snapshot" console commands
+profiler = diagnostics.Profiler()
+memory_snapshots = diagnostics.MemorySnapshots()
+
+# Served by metrics.serve() if enabled; lookup metrics are defined in spoofy.py
+commands_run = metrics.registry.counter('vimusbot_commands_total', 'Commands run, by whether they finished or raised an error', ['command', 'result'])
+url_cache_lookups = metrics.registry.counter('vimusbot_url_cache_lookups_total', 'URL info cache lookups, by key and whether it was a hit', ['key', 'result'])
+downloaded_bytes = metrics.registry.counter('vimusbot_downloaded_bytes_total', 'Bytes of media downloaded for playback')
+download_seconds = metrics.registry.histogram('vimusbot_download_seconds', 'Time taken to download each track (or get its stream URL)')
+track_start_seconds = metrics.registry.histogram('vimusbot_track_start_seconds', 'Time from a track reaching the front of the queue to it playing')
+queue_advances = metrics.registry.counter('vimusbot_queue_advances_total', 'Times the queue moved on, by whether a track finished or was skipped', ['reason'])
+metrics.registry.gauge('vimusbot_voice_clients', 'Connected voice clients', function=lambda: len(bot.voice_clients))
+metrics.registry.gauge('vimusbot_queue_length', 'Items queued in each server', ['guild'],
+    function=lambda: {(str(guild_id),): len(queue) for guild_id, queue in media_queue.queues.items()})
+metrics.registry.gauge('vimusbot_url_cache_entries', 'URLs in the URL info cache', function=lambda: len(url_info_cache))
+if SHARD_IDS:
+    metrics.registry.constant_labels['shards'] = sharding.format_range(SHARD_IDS)
+
+def on_config_reload(old: settings.Config, new: settings.Config, changed: set[str]):
+    apply_config(new)
+    resolver.set_limits(RESOLVER_GUILD_CONCURRENCY, RESOLVER_RESERVED_WORKERS, RESOLVER_MAX_GUILD_BACKLOG, RESOLVER_MAX_BACKLOG)
+    message_manager.edit_interval = STATUS_UPDATE_INTERVAL
+    loop_watchdog.threshold = LOOP_LAG_THRESHOLD
+    lookups.timeout = RESOLVER_SERVICE_TIMEOUT
+    negative_cache.ttls = NEGATIVE_CACHE_TTLS
+    if not NEGATIVE_CACHE_TTLS:
+        negative_cache.clear()
+    if worker_pool is not None:
+        worker_pool.timeout = EXECUTION_TIMEOUT
+
+settings.subscribe(on_config_reload)
+
+def reload_config():
+    """Reloads the config files and logs what changed; an invalid config is reported and ignored"""
+    try:
+        changed = settings.reload()
+    except Exception as e:
+        log(f'{plt.error}Couldn\'t reload config, keeping the current one: {e}')
+        return
+
+    if not changed:
+        log('Config reloaded; nothing changed.')
+        return
+    log('Config reloaded; changed ' + ', '.join(settings.keypaths(changed)))
+    needs_restart = settings.needs_restart(changed)
+    if needs_restart:
+        log(f'{plt.warn}These changes will only take effect after a restart: ' + ', '.join(needs_restart))
+
+async def watch_config(interval: float):
+    """Reloads the config whenever config.yml is saved"""
+    while True:
+        await asyncio.sleep(interval)
+        if settings.config_file_changed():
+            reload_config()
 
 # Start bot-related events
 
+async def defer(ctx: commands.Context):
+    """Acknowledges a slash command so it has time to finish; replies then arrive as follow-ups. Does nothing for prefix commands"""
+    if ctx.interaction is not None and not ctx.interaction.response.is_done():
+        await ctx.defer()
+
 def is_command_enabled(ctx: commands.Context):
     return not ctx.command.name in DISABLED_COMMANDS
 
 def command_aliases(command: str):
-    return config.get(f'aliases.{command}', config_default.get(f'aliases.{command}', []))
+    return list(settings.current().aliases.get(command, []))
 
 #
 #
@@ -256,18 +533,20 @@ class General(commands.Cog):
                 timeout_counter += 1
                 if voice.is_playing() and not voice.is_paused():
                     timeout_counter = 0
-                    global audio_time_elapsed
-                    audio_time_elapsed += 1
                     
                 if timeout_counter == INACTIVITY_TIMEOUT*60:
                     log('Leaving voice due to inactivity.')
+                    forget_position()
                     await voice.disconnect()
                 if not voice.is_connected():
                     log('Voice doesn\'t look connected, waiting three seconds...', verbose=True)
                     await asyncio.sleep(3)
                     if not voice.is_connected():
                         log('Still disconnected. Setting `voice` to None...', verbose=True)
+                        channel = voice.channel
                         voice = None
+                        if resume_point is not None:
+                            asyncio.create_task(reconnect(channel))
                         break
                     else:
                         log('Voice looks connected again. Continuing as normal.', verbose=True)
@@ -283,7 +562,7 @@ class General(commands.Cog):
         log(f'Stored into debugctx. {ctx}')
     #endregion
 
-    @commands.command(aliases=command_aliases('changelog'))
+    @commands.hybrid_command(aliases=command_aliases('changelog'))
     @commands.check(is_command_enabled)
     async def changelog(self, ctx: commands.Context):
         """Returns a link to the changelog, and displays most recent version."""
@@ -293,7 +572,7 @@ class General(commands.Cog):
             color=EMBED_COLOR
             ))
 
-    @commands.command(aliases=command_aliases('ping'))
+    @commands.hybrid_command(aliases=command_aliases('ping'))
     @commands.check(is_command_enabled)
     async def ping(self, ctx: commands.Context):
         """Test command."""
@@ -302,7 +581,7 @@ class General(commands.Cog):
         await ctx.send(embed=embed)
         await ctx.send(embed=embedq('this is a test for', 'the extended embed function'))
 
-    @commands.command(aliases=command_aliases('repository'))
+    @commands.hybrid_command(aliases=command_aliases('repository'))
     @commands.check(is_command_enabled)
     async def repository(self, ctx: commands.Context):
         """Returns the link to the viMusBot GitHub repository."""
@@ -318,14 +597,15 @@ class Music(commands.Cog):
         self.bot = bot
 
     # Playing music / Voice-related
-    @commands.command(aliases=command_aliases('analyze'))
+    @commands.hybrid_command(aliases=command_aliases('analyze'))
     @commands.check(is_command_enabled)
     async def analyze(self, ctx: commands.Context, spotifyurl: str):
         """Returns spotify API information regarding a track."""
-        info = spoofy.spotify_track(spotifyurl)
+        await defer(ctx)
+        info = await resolver.run(ctx.guild.id, lookups.spotify_track, spotifyurl, interactive=True)
         title = info['title']
         artist = info['artist']
-        result = spoofy.analyze_track(spotifyurl)
+        result = await resolver.run(ctx.guild.id, lookups.analyze_track, spotifyurl, interactive=True)
         data = result[0]
         skip = result[1]
         # Assemble embed object
@@ -354,15 +634,17 @@ class Music(commands.Cog):
             embed.add_field(name=i.title(),value=value)
         await ctx.send(embed=embed)
 
-    @commands.command(aliases=command_aliases('clear'))
+    @commands.hybrid_command(aliases=command_aliases('clear'))
     @commands.check(is_command_enabled)
     async def clear(self, ctx: commands.Context):
         """Clears the entire queue."""
         global media_queue
         media_queue.clear(ctx)
+        cancel_ingestion(ctx)
+        discard_prewarmed()
         await ctx.send(embed=embedq('Queue cleared.'))
 
-    @commands.command(aliases=command_aliases('join'))
+    @commands.hybrid_command(aliases=command_aliases('join'))
     @commands.check(is_command_enabled)
     async def join(self, ctx):
         """Joins the voice channel of the user."""
@@ -370,13 +652,16 @@ class Music(commands.Cog):
         # this is only defined so that there's a command in Discord for it
         pass
 
-    @commands.command(aliases=command_aliases('leave'))
+    @commands.hybrid_command(aliases=command_aliases('leave'))
     @commands.check(is_command_enabled)
     async def leave(self, ctx: commands.Context):
         """Disconnects the bot from voice."""
         global voice
         global media_queue
         media_queue.clear(ctx)
+        cancel_ingestion(ctx)
+        discard_prewarmed()
+        forget_position()
         log(f'Leaving voice channel: {ctx.author.voice.channel}')
         try:
             await voice.disconnect()
@@ -384,7 +669,7 @@ class Music(commands.Cog):
             await ctx.send(embed=embedq('Not connected to voice.'))
         voice = None
 
-    @commands.command(aliases=command_aliases('loop'))
+    @commands.hybrid_command(aliases=command_aliases('loop'))
     @commands.check(is_command_enabled)
     async def loop(self, ctx: commands.Context):
         """Toggles looping for the current track."""
@@ -394,7 +679,7 @@ class Music(commands.Cog):
         log(f'Looping {["disabled", "enabled"][loop_this]}.', verbose=True)
         await ctx.send(embed=embedq(f'{get_loop_icon()}Looping {["disabled", "enabled"][loop_this]}.'))
 
-    @commands.command(aliases=command_aliases('move'))
+    @commands.hybrid_command(aliases=command_aliases('move'))
     @commands.check(is_command_enabled)
     async def move(self, ctx: commands.Context, old: int, new: int):
         """Moves a queue item from <old> to <new>."""
@@ -408,7 +693,7 @@ class Music(commands.Cog):
             await ctx.send(embed=embedq('An unexpected error occurred.'))
             log_traceback(e)
 
-    @commands.command(aliases=command_aliases('nowplaying'))
+    @commands.hybrid_command(aliases=command_aliases('nowplaying'))
     @commands.check(is_command_enabled)
     async def nowplaying(self, ctx: commands.Context):
         """Shows the currently playing track."""
@@ -419,13 +704,13 @@ class Music(commands.Cog):
         if not voice.is_playing() and not voice.is_paused():
             embed = discord.Embed(title=f'Nothing is playing.',color=EMBED_COLOR)
         else:
-            elapsed = timestamp_from_seconds(audio_time_elapsed)
+            elapsed = timestamp_from_seconds(now_playing.position)
             submitter_text = get_queued_by_text(now_playing.user)
-            embed = discord.Embed(title=f'{get_loop_icon()}Now playing: {now_playing.title} [{elapsed} / {now_playing.duration_stamp}]',description=f'Link: {now_playing.weburl}{submitter_text}\nElapsed time may not be precisely accurate, due to minor network hiccups.',color=EMBED_COLOR)
+            embed = discord.Embed(title=f'{get_loop_icon()}Now playing: {now_playing.title} [{elapsed} / {now_playing.duration_stamp}]',description=f'Link: {now_playing.weburl}{submitter_text}',color=EMBED_COLOR)
 
         await ctx.send(embed=embed)
 
-    @commands.command(aliases=command_aliases('pause'))
+    @commands.hybrid_command(aliases=command_aliases('pause'))
     @commands.check(is_command_enabled)
     async def pause(self, ctx: commands.Context):
         """Pauses the player."""
@@ -440,10 +725,12 @@ class Music(commands.Cog):
         else:
             await ctx.send(embed=embedq('Nothing to pause.'))
     
-    @commands.command(aliases=command_aliases('play'))
+    @commands.hybrid_command(aliases=command_aliases('play'))
     @commands.check(is_command_enabled)
-    async def play(self, ctx: commands.Context, *queries: str):
+    @app_commands.describe(query='One or more URLs separated by spaces, or text to search for')
+    async def play(self, ctx: commands.Context, *, query: str=''):
         """Adds a link to the queue. Plays immediately if the queue is empty."""
+        queries = query.split()
         if len(queries) == 0:
             if voice.is_paused():
                 voice.resume()
@@ -454,8 +741,10 @@ class Music(commands.Cog):
                 await ctx.send(embed=embedq('No URL or search terms given.'))
             return
 
-        global qmessage
-        qmessage = await ctx.send(embed=embedq('Trying to queue...'))
+        status = await message_manager.status(ctx, embedq('Trying to queue...'))
+        # Deleted by play_item() once something starts playing, unless a playlist takes it over for its progress
+        queue_statuses[ctx.guild.id] = status
+        submitter = Submitter.from_member(ctx.author)
 
         multiple_urls = False
 
@@ -464,13 +753,13 @@ class Music(commands.Cog):
             if q.startswith('https://'):
                 url_count += 1
                 if url_count > 1 and re.search(r'(/sets/|playlist\?list=|/album/|/playlist/)', q) is not None:
-                    await qmessage.edit(embed=embedq('Cannot queue multiple albums or playlists at once.'))
+                    status.update(embedq('Cannot queue multiple albums or playlists at once.'))
                     return
             else:
                 text_count += 1
         
         if url_count > 0 and text_count > 0:
-            await qmessage.edit(embed=embedq('Queries must be either all URLs or a single text query.'))
+            status.update(embedq('Queries must be either all URLs or a single text query.'))
             return
         
         query_type = 'link' if url_count > 0 else 'text'
@@ -488,35 +777,41 @@ class Music(commands.Cog):
         async with ctx.typing():
             if multiple_urls:
                 if len(queries) > MAXIMUM_CONSECUTIVE_URLS:
-                    await qmessage.edit(embed=embedq('Too many URLs were given.', f'Current limit is {MAXIMUM_CONSECUTIVE_URLS}.'+
+                    status.update(embedq('Too many URLs were given.', f'Current limit is {MAXIMUM_CONSECUTIVE_URLS}.'+
                         'Edit `maximum-urls` in `config.yml` to change this.'))
                     return
+                async def report_progress(done: int, total: int):
+                    # Coalesced by the status message, so this can be called as often as it likes
+                    status.update(embedq(f'Retrieving URLs... ({done}/{total})'))
+
                 try:
-                    objlist = QueueItem.generate_from_list(queries, ctx.author)
+                    objlist = await QueueItem.generate_from_list(queries, submitter, progress=report_progress)
                     if objlist[0] != []:
                         queue_batch(ctx, objlist[0])
-                        await qmessage.edit(embed=embedq(f'Queued {len(objlist[0])} items.'))
+                        status.update(embedq(f'Queued {len(objlist[0])} items.'))
                         if objlist[1] != []:
-                            await qmessage.edit(embed=embedq(f'Failed to retrieve {len(objlist[1])} URL{'s' if len(objlist[1]) > 1 else ''}:', f'{'\n'.join(objlist[1])}'))
+                            status.update(embedq(f'Failed to retrieve {len(objlist[1])} URL{'s' if len(objlist[1]) > 1 else ''}:', f'{'\n'.join(objlist[1])}'))
                         if not voice.is_playing():
                             log('Voice client is not playing; starting...')
                             await advance_queue(ctx)
                     else:
-                        await qmessage.edit(embed=embedq('Failed to retrieve all URLs; nothing added to the queue.'))
+                        status.update(embedq('Failed to retrieve all URLs; nothing added to the queue.'))
                     return
+                except scheduler.SchedulerBusy:
+                    raise
                 except Exception as e:
                     log_traceback(e)
             
             # Search with text if no url is provided
             if query_type == 'text':
-                await qmessage.edit(embed=embedq('Searching by text...'))
+                status.update(embedq('Searching by text...'))
                 log('Link not detected, searching by text', verbose=True)
                 log(f'Searching: "{query}"')
 
-                top_song, top_video = spoofy.search_ytmusic_text(query)
+                top_song, top_video = await resolver.run(ctx.guild.id, lookups.search_ytmusic_text, query, interactive=True)
 
                 if (top_song is None) and (top_video is None):
-                    await qmessage.edit(embed=embedq('No song or video match could be found for your query.'))
+                    status.update(embedq('No song or video match could be found for your query.'))
                     return
 
                 if top_song is not None:
@@ -539,13 +834,12 @@ class Music(commands.Cog):
                     embed.add_field(name=f'Top song result: {top_song["title"]}', value=top_song['url'], inline=False)
                     embed.add_field(name=f'Top video result: {top_video["title"]}', value=top_video['url'], inline=False)
 
-                    prompt = await ctx.send(embed=embed)
-                    choice = await prompt_for_choice(ctx, prompt, 2)
+                    choice = await prompt_for_choice(ctx, embed, 2)
                     if choice is None:
-                        await qmessage.delete()
+                        status.delete()
                         return
                     else:
-                        await qmessage.edit(embed=embedq('Queueing choice...'))
+                        status.update(embedq('Queueing choice...'))
                     url = (top_song['url'], top_video['url'])[choice-1]
 
             # Locate youtube equivalent if spotify link given
@@ -553,12 +847,12 @@ class Music(commands.Cog):
                 # Resolve mobile share link to a usable URL
                 log(f'Resolving spotify.link URL... ({url})')
                 try:
-                    url = requests.get(url).url
+                    url = (await resolver.run(ctx.guild.id, requests.get, url, interactive=True)).url
                     log(f'Resolved to {url}')
                 except Exception as e:
                     log(f'Failed; aborting play command and showing traceback...')
                     log_traceback(e)
-                    await qmessage.edit(embed=embedq('Failed to resolve Spotify link. Please use an "open.spotify.com" link instead of "spotify.link" if possible.'))
+                    status.update(embedq('Failed to resolve Spotify link. Please use an "open.spotify.com" link instead of "spotify.link" if possible.'))
                     return
 
             if 'https://open.spotify.com' in url:
@@ -566,33 +860,37 @@ class Music(commands.Cog):
                 log('Checking for playlist...', verbose=True)
                 if '/playlist/' in url and ALLOW_SPOTIFY_PLAYLISTS:
                     log('Spotify playlist detected.', verbose=True)
-                    await qmessage.edit(embed=embedq('Trying to queue Spotify playlist...'))
-                    playlist_result = spoofy.spotify_playlist(url)
+                    status.update(embedq('Trying to queue Spotify playlist...'))
+                    playlist_result = await resolver.run(ctx.guild.id, lookups.spotify_playlist, url)
 
                     if isinstance(playlist_result, tuple):
                         code = playlist_result[1].http_status
                         match code:
                             case 400:
                                 log('Could not retrieve playlist; the URL seems invalid.')
-                                await qmessage.edit(embed=embedq('Could not retrieve playlist; the URL seems invalid. (HTTP 400)'))
+                                status.update(embedq('Could not retrieve playlist; the URL seems invalid. (HTTP 400)'))
                                 return
                             case 404:
                                 log('Could not retrieve playlist; the playlist is likely private.')
-                                await qmessage.edit(embed=embedq('Could not retrieve playlist; the playlist is likely private. (HTTP 404)'))
+                                status.update(embedq('Could not retrieve playlist; the playlist is likely private. (HTTP 404)'))
                                 return
                             case _:
                                 log(f'Could not retrieve playlist; an unknown error occurred: HTTP {code}')
-                                await qmessage.edit(embed=embedq(f'Could not retrieve playlist; HTTP {code}'))
+                                status.update(embedq(f'Could not retrieve playlist; HTTP {code}'))
                                 return
 
-                    objlist = QueueItem.generate_from_list(playlist_result, ctx.author)[0]
-                    if len(objlist) > SPOTIFY_PLAYLIST_LIMIT:
-                        await qmessage.edit(embed=embedq('Spotify playlist limit exceeded.'))
+                    if len(playlist_result) > SPOTIFY_PLAYLIST_LIMIT:
+                        status.update(embedq('Spotify playlist limit exceeded.'))
                         return
-                    
+
+                    list_name = (await resolver.run(ctx.guild.id, spoofy.sp.playlist, url, interactive=True))['name']
+                    if PROGRESSIVE_QUEUEING:
+                        await queue_progressively(ctx, QueueItem.stream_playlist(playlist_result, submitter), status, list_name)
+                        return
+
+                    objlist = (await QueueItem.generate_from_list(playlist_result, submitter))[0]
                     queue_batch(ctx, objlist)
-                    list_name = spoofy.sp.playlist(url)['name']
-                    await qmessage.edit(embed=embedq(f'Queued {len(objlist)} items from {list_name}.'))
+                    status.update(embedq(f'Queued {len(objlist)} items from {list_name}.'))
                     if not voice.is_playing():
                         log('Voice client is not playing; starting...')
                         await advance_queue(ctx)
@@ -608,24 +906,43 @@ class Music(commands.Cog):
                 log('Checking for album...', verbose=True)
                 if 'https://open.spotify.com/album/' in url:
                     log('Spotify album detected.', verbose=True)
-                    album_info = spoofy.spotify_album(url)
+                    album_info = await resolver.run(ctx.guild.id, lookups.spotify_album, url, interactive=True)
 
                     if isinstance(album_info, tuple):
-                        await qmessage.edit(embed=embedq('Could not retrieve album; the URL seems invalid.'))
+                        status.update(embedq('Could not retrieve album; the URL seems invalid.'))
                         return
 
-                    url = spoofy.search_ytmusic_album(album_info['title'], album_info['artist'], album_info['year'])
-                    if url is None:
-                        await qmessage.edit(embed=embedq('No match could be found.'))
+                    album = await resolver.run(ctx.guild.id, lookups.search_ytmusic_album,
+                        album_info['title'], album_info['artist'], album_info['year'], album_info['upc'])
+                    if album is None:
+                        status.update(embedq('No match could be found.'))
                         return
+                    await queue_album(ctx, album)
+                    return
+
+            if spoofy.is_ytmusic_album_url(url):
+                log('URL is a YouTube Music album.', verbose=True)
+                album = await resolver.run(ctx.guild.id, lookups.ytmusic_album_from_url, url, interactive=True)
+                if album is not None:
+                    await queue_album(ctx, album)
+                    return
+                log('Couldn\'t retrieve album; treating it as a regular playlist.', verbose=True)
             
             # Determines if the input was a playlist or album; any Spotify links should have already been handled
             valid = ['playlist?list=', '/sets/', '/album/']
             if any(item in url for item in valid):
                 log('URL is a non-Spotify playlist.', verbose=True)
-                objlist = QueueItem.generate_from_list(url, ctx.author)
+                if PLAYLIST_WINDOW > 0 and 'soundcloud.com' not in url:
+                    await queue_windowed(ctx, url, status)
+                    return
+
+                if PROGRESSIVE_QUEUEING:
+                    await queue_progressively(ctx, QueueItem.stream_playlist(url, submitter), status)
+                    return
+
+                objlist = await QueueItem.generate_from_list(url, submitter)
                 if isinstance(objlist, tuple):
-                    await qmessage.edit(embed=embedq('Could not retrieve playlist.'))
+                    status.update(embedq('Could not retrieve playlist.'))
                     return
                 queue_batch(ctx, objlist)
                 await ctx.send(embed=embedq(f'Queued {len(objlist)} items.'))
@@ -636,33 +953,42 @@ class Music(commands.Cog):
                 # Runs if the input given was not a playlist
                 log('URL is not a playlist.', verbose=True)
                 log('Checking duration...', verbose=True)
-                duration = duration_from_url(url)
+                direct_item = None
+                if probe.is_direct_file(url):
+                    # Only the file's header needs reading, so it doesn't need a resolution worker either
+                    direct_item = await QueueItem.from_direct_file(url, submitter)
+                    duration = (None, 'the file couldn\'t be reached') if direct_item is None else direct_item.duration
+                else:
+                    duration = await resolver.run(ctx.guild.id, duration_from_url, url, interactive=True)
 
                 if isinstance(duration, tuple):
                     log(f'Couldn\'t retrieve duration; aborting play command: {duration[1]}', verbose=True)
-                    await qmessage.edit(embed=embedq('Could not retrieve URL; the content may be unavailable, or the URL may be invalid.'))
+                    status.update(embedq('Could not retrieve URL; the content may be unavailable, or the URL may be invalid.'))
                     return
 
                 if duration > DURATION_LIMIT*60*60:
                     log('Item over duration limit; not queueing.')
-                    await qmessage.edit(embed=embedq(f'Cannot queue items longer than {DURATION_LIMIT} hours.'))
+                    status.update(embedq(f'Cannot queue items longer than {DURATION_LIMIT} hours.'))
                     return
 
             # Queue or start the player
             try:
                 log('Appending to queue...', verbose=True)
+                item = direct_item or await resolver.run(ctx.guild.id, QueueItem, url, submitter, interactive=True)
                 if not voice.is_playing() and media_queue.get(ctx) == []:
-                    media_queue.get(ctx).append(QueueItem(url, ctx.author))
+                    media_queue.get(ctx).append(item)
                     log('Voice client is not playing; starting...')
                     await advance_queue(ctx)
                 else:
-                    media_queue.get(ctx).append(QueueItem(url, ctx.author))
+                    media_queue.get(ctx).append(item)
                     title = media_queue.get(ctx)[-1].title
-                    await qmessage.edit(embed=embedq(f'Added {title} to the queue at spot #{len(media_queue.get(ctx))}'))
+                    status.update(embedq(f'Added {title} to the queue at spot #{len(media_queue.get(ctx))}'))
+            except scheduler.SchedulerBusy:
+                raise
             except Exception as e:
                 log_traceback(e)
 
-    @commands.command(aliases=command_aliases('queue'))
+    @commands.hybrid_command(aliases=command_aliases('queue'))
     @commands.check(is_command_enabled)
     async def queue(self, ctx: commands.Context, page: int=1):
         """Displays the current queue, up to 10 items per page."""
@@ -680,7 +1006,7 @@ class Music(commands.Cog):
         for item in media_queue.get(ctx):
             queue_time += item.duration
         
-        queue_time += now_playing.duration - audio_time_elapsed
+        queue_time += max(now_playing.duration - now_playing.position, 0)
         
         queue_time = timestamp_from_seconds(queue_time)
 
@@ -701,20 +1027,50 @@ class Music(commands.Cog):
             log_traceback(e)
         await ctx.send(embed=embed)
 
-    @commands.command(aliases=command_aliases('remove'))
+    @commands.hybrid_command(aliases=command_aliases('remove'))
     @commands.check(is_command_enabled)
     async def remove(self, ctx: commands.Context, spot: int):
         """Removes an item from the queue. Use -q to get its number."""
         await ctx.send(embed=embedq(f'Removed {media_queue.get(ctx).pop(spot-1).title} from the queue.'))
 
-    @commands.command(aliases=command_aliases('shuffle'))
+    @commands.hybrid_command(aliases=command_aliases('shuffle'))
     @commands.check(is_command_enabled)
     async def shuffle(self, ctx: commands.Context):
         """Randomizes the order of the queue."""
-        random.shuffle(media_queue.get(ctx))
+        queue = media_queue.get(ctx)
+        # Replaced in one go, so it's saved as a single change rather than one for every swap
+        queue[:] = random.sample(queue, len(queue))
         await ctx.send(embed=embedq('Queue has been shuffled.'))
 
-    @commands.command(aliases=command_aliases('skip'))
+    @commands.hybrid_command(aliases=command_aliases('seek'))
+    @commands.check(is_command_enabled)
+    @app_commands.describe(position='A timestamp like 1:30 or 90, or +/- that many seconds from here')
+    async def seek(self, ctx: commands.Context, position: str):
+        """Jumps to a point in the currently playing track."""
+        if voice is None or now_playing is None or not (voice.is_playing() or voice.is_paused()):
+            await ctx.send(embed=embedq('Nothing is playing.'))
+            return
+        try:
+            offset = seconds_from_timestamp(position.lstrip('+-'))
+        except ValueError:
+            await ctx.send(embed=embedq('Give a timestamp like 1:30, or a number of seconds.'))
+            return
+        if position.startswith('+'):
+            offset = now_playing.position + offset
+        elif position.startswith('-'):
+            offset = now_playing.position - offset
+        offset = max(offset, 0)
+
+        if now_playing.duration and offset >= now_playing.duration:
+            await ctx.send(embed=embedq(f'That\'s past the end of the track ({now_playing.duration_stamp}).'))
+            return
+        if not now_playing.replayable:
+            await ctx.send(embed=embedq('This track can\'t be seeked; its file is gone.'))
+            return
+        seek_to(offset, ctx)
+        await ctx.send(embed=embedq(f'Jumped to {timestamp_from_seconds(offset)}.'))
+
+    @commands.hybrid_command(aliases=command_aliases('skip'))
     @commands.check(is_command_enabled)
     async def skip(self, ctx: commands.Context):
         """Skips the currently playing media."""
@@ -732,8 +1088,8 @@ class Music(commands.Cog):
         skip_votes_remaining = int((len(voice.channel.members)) * (SKIP_VOTES_PERCENTAGE/100)) if SKIP_VOTES_TYPE == "percentage" else SKIP_VOTES_EXACT
 
         if VOTE_TO_SKIP:
-            if ctx.author not in skip_votes:
-                skip_votes.append(ctx.author)
+            if ctx.author.id not in skip_votes:
+                skip_votes.append(ctx.author.id)
             else:
                 await ctx.send(embed=embedq('You have already voted to skip.'))
                 return
@@ -748,24 +1104,27 @@ class Music(commands.Cog):
         await ctx.send(embed=embedq('Skipping...'))
         await advance_queue(ctx, skip=True)
 
-    @commands.command(aliases=command_aliases('stop'))
+    @commands.hybrid_command(aliases=command_aliases('stop'))
     @commands.check(is_command_enabled)
     async def stop(self, ctx: commands.Context):
         """Stops the player and clears the queue."""
         global media_queue
         media_queue.clear(ctx)
+        cancel_ingestion(ctx)
+        discard_prewarmed()
         if voice.is_playing() or voice.is_paused():
             voice.stop()
             await ctx.send(embed=embedq('Player has been stopped.'))
         else:
             await ctx.send(embed=embedq('Nothing is playing.'))
     
-    @commands.command(aliases=command_aliases('clearcache'))
+    @commands.hybrid_command(aliases=command_aliases('clearcache'))
     @commands.check(is_command_enabled)
     async def clearcache(self, ctx: commands.Context):
         """Removes all information from the current URL cache"""
         global url_info_cache
         url_info_cache = {}
+        negative_cache.clear()
         log(f'URL cache was cleared: {url_info_cache}', verbose=True)
         await ctx.send(embed=embedq('URL cache has been emptied.', '' if USE_URL_CACHE else f'{emoji["info"]} URL cache is currently disabled.'))
 
@@ -774,11 +1133,15 @@ class Music(commands.Cog):
     @pause.before_invoke
     @stop.before_invoke
     async def ensure_voice(self, ctx: commands.Context):
+        # Connecting and everything after it can take longer than a slash command is allowed to go unanswered
+        await defer(ctx)
         if ctx.voice_client is None:
             if ctx.author.voice:
                 log(f'Joining voice channel: {ctx.author.voice.channel}')
                 global voice
                 voice = await ctx.author.voice.channel.connect()
+                # Whatever was cut off by a dropped connection carries on before anything new is queued
+                await resume_playback()
             else:
                 await ctx.send(embed=embedq("You are not connected to a voice channel."))
 
@@ -790,9 +1153,8 @@ class Music(commands.Cog):
 
 url_info_cache = {}
 
-def get_queued_by_text(user_object: discord.Member) -> str:
-    username = user_object.nick if user_object.nick else user_object.name
-    return f'\nQueued by {username}' if SHOW_USERS_IN_QUEUE else ''
+def get_queued_by_text(submitter: 'Submitter') -> str:
+    return f'\nQueued by {submitter.name}' if SHOW_USERS_IN_QUEUE else ''
 
 def cache_if_succeeded(key: str):
     """
@@ -814,142 +1176,140 @@ def cache_if_succeeded(key: str):
             
                 if url_info_cache[url].get(key, None) not in ['', None]:
                     # Return stored info
+                    url_cache_lookups.inc(key=key, result='hit')
                     result = url_info_cache[url][key]
                     log(f'{key} of \'{url}\' already stored: {result}', verbose=True)
                     return result
                 else:
                     # Retrieve info normally
+                    url_cache_lookups.inc(key=key, result='miss')
                     result = func(*args, **kwargs)
-                    url_info_cache[url][key] = result
+                    # Failures are left to the negative cache, which only keeps them for a while
+                    if not (isinstance(result, tuple) and result[0] is None):
+                        url_info_cache[url][key] = result
                     return result
             except Exception as e:
                 log_traceback(e)
         return cache_check
     return decorator
 
-# TODO: Maybe try and make duration and title from URL into a single function, lot of copied code
-
 @cache_if_succeeded(key='duration')
 def duration_from_url(url: str) -> int|float:
     """Automatically detects the source of a given URL, and returns its extracted duration."""
-    log(f'Getting length of \'{url}\'...', verbose=True)
-    if 'youtube.com' in url:
-        try:
-            return pytube.YouTube(url).length
-        except Exception as e:
-            log(f'pytube couldn\'t retrieve video length: "{traceback.format_exception(e)[-1]}"; Trying yt-dlp...', verbose=True)
-            # Continues after this block so this isn't duplicated
-    elif 'soundcloud.com' in url:
-        try:
-            result = spoofy.sc.resolve(url).duration
-        except TypeError as e:
-            log(f'Failed to retrieve Soundcloud track: {e}')
-            return None, e
-        return round(result / 1000)
-    elif 'open.spotify.com' in url:
-        result = spoofy.spotify_track(url)
-        if isinstance(result, tuple):
-            log(f'Failed to retrieve Spotify track: {result[1]}')
-            return None, result[1]
-        return result['duration']
-
-    # yt-dlp should handle most other URLs
-    try:
-        info_dict = ytdl.extract_info(url, download=False)
-    except yt_dlp.utils.DownloadError as e:
-        log(f'Failed to retrieve video length: {e}')
-        return None, e
-    return info_dict.get('duration', 0)
+    return lookups.duration_from_url(url)
 
 @cache_if_succeeded(key='title')
 def title_from_url(url: str) -> str:
     """Automatically detects the source of a given URL, and returns its extracted title."""
-    log(f'Getting title of \'{url}\'...', verbose=True)
-    if 'youtube.com' in url:
-        try:
-            return pytube.YouTube(url).title
-        except Exception as e:
-            log(f'pytube encountered "{traceback.format_exception(e)[-1]}" during title retrieval. Falling back on yt-dlp.', verbose=True)
-            # Continues after this block so this isn't duplicated
-    elif 'soundcloud.com' in url:
-        return spoofy.sc.resolve(url).title
-    elif 'open.spotify.com' in url:
-        return spoofy.spotify_track(url)['title']
-    
-    # yt-dlp should handle most other URLs
-    try:
-        info_dict = ytdl.extract_info(url, download=False)
-    except yt_dlp.utils.DownloadError as e:
-        log(f'Failed to retrieve title: {e}')
-        return None, e
-    return info_dict.get('title', None)
+    return lookups.title_from_url(url)
+
+def seconds_from_timestamp(timestamp: str) -> float:
+    """Returns the number of seconds in a timestamp like HH:MM:SS, MM:SS, or just SS; raises ValueError if it isn't one"""
+    parts = timestamp.strip().split(':')
+    if len(parts) > 3 or any(re.fullmatch(r'\d+(\.\d+)?', part) is None for part in parts):
+        raise ValueError(f'Not a timestamp: {timestamp}')
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds*60 + float(part)
+    return seconds
 
 def timestamp_from_seconds(seconds: int|float) -> str:
     """Returns a formatted string in either MM:SS or HH:MM:SS from the given time in seconds."""
     # Omit the hour place if not >=60 minutes
     return time.strftime('%M:%S', time.gmtime(seconds)) if seconds < 3600 else time.strftime('%H:%M:%S', time.gmtime(seconds))
 
-async def prompt_for_choice(ctx: commands.Context, prompt_msg: discord.Message, choices: int, timeout: int=30) -> int|None:
-    """Adds reactions to a given Message (prompt_msg) and returns the outcome
-    
-    msg -- Message to be edited based on the outcome
+# Futures of choice prompts still waiting for an answer, by prompt message ID
+choice_prompts: dict[int, asyncio.Future] = {}
+
+class ChoiceView(discord.ui.View):
+    """Numbered buttons plus a cancel button, sent with the prompt itself so it's usable straight away"""
+    def __init__(self, user_id: int, choices: int, timeout: float):
+        super().__init__(timeout=timeout)
+        self.user_id = user_id
+        for n in range(1, choices + 1):
+            self.add_item(ChoiceButton(n, label=str(n), style=discord.ButtonStyle.primary))
+        self.add_item(ChoiceButton(None, emoji=emoji['cancel'], style=discord.ButtonStyle.secondary))
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.user_id:
+            await interaction.response.send_message(embed=embedq('Only the person who queued this can choose.'), ephemeral=True)
+            return False
+        return True
+
+class ChoiceButton(discord.ui.Button):
+    def __init__(self, choice: int|None, **kwargs):
+        super().__init__(**kwargs)
+        self.choice = choice
+
+    async def callback(self, interaction: discord.Interaction):
+        future = choice_prompts.get(interaction.message.id)
+        if future is None or future.done():
+            await interaction.response.defer()
+            return
+        future.set_result(self.choice)
+        self.view.stop()
+        # Acknowledging and removing the buttons is a single call; the message itself is deleted later
+        await interaction.response.edit_message(view=None)
 
-    prompt -- Message to add the reaction choices to
+async def prompt_for_choice(ctx: commands.Context, embed: discord.Embed, choices: int, timeout: int=30) -> int|None:
+    """Sends `embed` with a button for each choice and a cancel button, and waits for the command's author to press one
 
-    Returns None if the prompt failed in some way or was cancelled, returns an integer if a choice was made successfully
+    Returns the chosen number (starting from 1), or None if the prompt was cancelled or timed out
     """
-    # Get reaction menu ready
-    log('Adding reactions...', verbose=True)
-
-    if choices > len(emoji['num']):
-        log('Choices out of range for emoji number list.'); return
-
-    for i in list(range(0, choices)):
-        await prompt_msg.add_reaction(emoji['num'][i+1])
-
-    await prompt_msg.add_reaction(emoji['cancel'])
-
-    def check(reaction: discord.Reaction, user: discord.Member) -> bool:
-        log('Reaction check is being called...', verbose=True)
-        return user == ctx.message.author and (str(reaction.emoji) in emoji['num'] or str(reaction.emoji) == emoji['cancel'])
-
-    log('Waiting for reaction...', verbose=True)
+    view = ChoiceView(ctx.author.id, choices, timeout)
+    # Sent to the channel rather than as a follow-up, since this can come long after a slash command was used
+    prompt_msg = await ctx.channel.send(embed=embed, view=view)
 
+    future = asyncio.get_running_loop().create_future()
+    choice_prompts[prompt_msg.id] = future
+    log('Waiting for choice...', verbose=True)
     try:
-        reaction, user = await bot.wait_for('reaction_add', timeout=timeout, check=check)
-    except asyncio.TimeoutError as e:
-        log('Choice prompt timeout reached.')
-        await prompt_msg.delete()
-        return
-    except Exception as e:
-        log_traceback(e)
-        await prompt_msg.edit(embed=embedq('An unexpected error occurred.'))
-        return
+        choice = await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        choice = None
+    finally:
+        del choice_prompts[prompt_msg.id]
+        view.stop()
+        message_manager.delete_later(prompt_msg)
+
+    if choice is None:
+        log('Choice prompt cancelled or timed out.', verbose=True)
     else:
-        # If a valid reaction was received.
-        log('Received a valid reaction.', verbose=True)
-
-        if str(reaction) == emoji['cancel']:
-            log('Selection cancelled.', verbose=True)
-            await prompt_msg.delete()
-            return
-        else:
-            choice = emoji['num'].index(str(reaction))
-            log(f'{choice} selected.', verbose=True)
-            await prompt_msg.delete()
-            return choice
+        log(f'{choice} selected.', verbose=True)
+    return choice
 
 # Queue system
 
 class MediaQueue:
-    def __init__(self):
+    """Every guild's queue; with a `store`, changes are saved as they're made, and queues are restored from it
+    the first time they're used after a restart"""
+    def __init__(self, store: queuestore.QueueStore|None=None):
         self.queues = {}
+        self.store = store
+
+    def _new_queue(self, guild_id: int, entries: list) -> list:
+        if self.store is None:
+            return list(entries)
+        return queuestore.JournaledList(entries, self.store, guild_id, lambda entry: entry.to_dict())
 
     # Run in every function to automatically determine
     # which queue we're working with
     def ensure_queue_exists(self, ctx: commands.Context):
         if ctx.author.guild.id not in self.queues:
-            self.queues[ctx.author.guild.id] = []
+            self.queues[ctx.author.guild.id] = self._new_queue(ctx.author.guild.id, self._restore(ctx.author.guild.id))
+
+    def _restore(self, guild_id: int) -> list:
+        if self.store is None:
+            return []
+        entries = []
+        for data in self.store.load(guild_id):
+            try:
+                entries.append(queue_entry_from_dict(data))
+            except (KeyError, TypeError) as e:
+                log(f'{plt.warn}Couldn\'t restore a queue entry ({e}); leaving it out: {data}')
+        if entries:
+            log(f'Restored {len(entries)} queued item(s) for guild {guild_id}.')
+        return entries
 
     def get(self, ctx: commands.Context) -> list:
         self.ensure_queue_exists(ctx)
@@ -957,124 +1317,679 @@ class MediaQueue:
 
     def set(self, ctx: commands.Context, new_list: list):
         self.ensure_queue_exists(ctx)
-        self.queues[ctx.author.guild.id] = new_list
+        self.queues[ctx.author.guild.id][:] = new_list
 
     def clear(self, ctx: commands.Context):
         self.ensure_queue_exists(ctx)
-        self.queues[ctx.author.guild.id] = []
+        self.queues[ctx.author.guild.id].clear()
+
+class Submitter:
+    """Who queued an item, saved when it's queued
+
+    Queue items keep this instead of the `discord.Member`, so members don't have to stay cached
+    (or be kept alive by the queue) just to show who queued something.
+    """
+    __slots__ = ('id', 'guild_id', 'name')
+
+    def __init__(self, id: int, guild_id: int, name: str):
+        self.id = id
+        self.guild_id = guild_id
+        self.name = name
+
+    @classmethod
+    def from_member(cls, member: discord.Member) -> 'Submitter':
+        return cls(member.id, member.guild.id, member.nick if member.nick else member.name)
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'guild_id': self.guild_id, 'name': self.name}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Submitter':
+        return cls(data['id'], data['guild_id'], data['name'])
 
 class QueueItem:
-    def __init__(self, url: str, user: discord.Member, title: str=None, duration: int|float=None):
+    __slots__ = ('url', 'user', 'duration', 'title')
+
+    def __init__(self, url: str, user: Submitter, title: str=None, duration: int|float=None):
         self.url = url
         self.user = user
         self.duration = duration if duration is not None else duration_from_url(url)
         self.title = title if title is not None else title_from_url(url)
 
+    def to_dict(self) -> dict:
+        return {'url': self.url, 'user': self.user.to_dict(), 'title': self.title, 'duration': self.duration}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'QueueItem':
+        # The title and duration are always given, so nothing is looked up again
+        return cls(data['url'], Submitter.from_dict(data['user']),
+            title=data['title'] if data['title'] is not None else data['url'], duration=data['duration'] or 0)
+
+    @staticmethod
+    def from_list_item(item: str|dict, user: Submitter) -> 'QueueItem|None':
+        """Creates a QueueItem from a single entry of a URL list, returns None if it couldn't be retrieved
+
+        - `item` (str, dict): Either a URL, or a Spotify track dictionary from `spoofy`
+        - `user`: The `Submitter` who queued the item
+        """
+        if isinstance(item, str) and 'open.spotify.com' in item:
+            item = lookups.spotify_track(item)
+            if isinstance(item, tuple):
+                log(f'Failed to retrieve Spotify track: {item[1]}')
+                return None
+
+        if isinstance(item, dict) and 'open.spotify.com' in item['url']:
+            return QueueItem(item['url'], user, title=item['title'], duration=item.get('duration', 0))
+
+        # Having the list part of the URL causes issues with getting info back
+        item = item.split('&list=')[0]
+        try:
+            info = lookups.video_info(item)
+        except yt_dlp.utils.DownloadError as e:
+            log(f'Failed to download video: {e}')
+            return None
+        return QueueItem(info['url'], user, title=info['title'], duration=info['duration'])
+
+    @staticmethod
+    async def from_direct_file(url: str, user: Submitter) -> 'QueueItem|None':
+        """Creates a QueueItem from a direct link to an audio file, by reading only its header; returns None if it can't be reached"""
+        probed = await probe.probe(url)
+        if probed is None:
+            return None
+        # 0 has play_item() work it out from the downloaded file instead
+        return QueueItem(url, user, title=probed.title, duration=probed.duration or 0)
+
+    @staticmethod
+    def from_playlist_url(playlist: str, user: Submitter) -> list | tuple[None, Exception]:
+        """Creates a list of QueueItem instances from a SoundCloud or ytdl-compatible playlist URL"""
+        # SoundCloud sets are read differently, but come back in the same form
+        try:
+            playlist_entries = lookups.playlist_entries(playlist)
+        except (TypeError, yt_dlp.utils.DownloadError) as e:
+            log(f'Failed to retrieve playlist: {e}')
+            return None, e
+        return [QueueItem(item['url'], user, title=item['title'], duration=item['duration']) for item in playlist_entries]
+
+    @staticmethod
+    def iter_playlist_url(playlist: str, user: Submitter) -> Iterator['QueueItem']:
+        """Like `from_playlist_url()`, but yields each item as soon as its entry has been read"""
+        if 'soundcloud.com' in playlist:
+            for item in spoofy.soundcloud_playlist_reader(playlist):
+                yield QueueItem(item.permalink_url, user, title=item.title, duration=round(item.duration/1000))
+            return
+
+        # Without processing, entries come back as a generator that reads pages only as they're needed
+        info = ytdl.extract_info(playlist, download=False, process=False)
+        while info.get('_type') in ['url', 'url_transparent']:
+            info = ytdl.extract_info(info['url'], download=False, process=False)
+        for item in info.get('entries') or []:
+            if item is None:
+                # Unavailable entries can be left empty
+                continue
+            yield QueueItem(item['url'], user, title=item.get('title'), duration=item.get('duration', 0))
+
+    @staticmethod
+    async def stream_playlist(playlist: str|list, user: Submitter) -> AsyncIterator['QueueItem']:
+        """Yields QueueItem instances from a valid playlist as they're read, see `generate_from_list()` for arguments
+
+        Entries are read one at a time through `resolver`, so a long playlist takes turns with other guilds' lookups
+        """
+        # Spotify tracks from a playlist already have everything needed
+        if isinstance(playlist, (list, tuple)):
+            for item in playlist:
+                yield QueueItem.from_list_item(item, user)
+            return
+
+        entries = QueueItem.iter_playlist_url(playlist, user)
+        # The first entry decides how long it takes to start playing, so it gets interactive priority
+        first = True
+        while (item := await resolver.run(user.guild_id, next, entries, None, interactive=first)) is not None:
+            first = False
+            yield item
+
     @staticmethod
-    def generate_from_list(playlist: str|list|tuple, user: discord.Member) -> list | tuple[None, Exception]:
+    async def generate_from_list(playlist: str|list|tuple, user: Submitter,
+        progress: Callable[[int, int], Awaitable]|None=None) -> list | tuple[list, list] | tuple[None, Exception]:
         """Creates a list of QueueItem instances from a valid playlist
 
         - `playlist` (str, list, tuple): Either a URL to a SoundCloud or ytdl-compatible playlist, or a list of Spotify tracks
-        - `user`: A discord Member object of the user who queued the playlist
+        - `user`: The `Submitter` who queued the playlist
+        - `progress`: Awaited with the number of finished and total items each time a list item finishes
+
+        List items are retrieved up to `url-concurrency` at a time, and returned in their original order
+        along with a list of any URLs that failed.
         """
-        objlist = []
+        # A playlist URL is retrieved in one go
+        if not isinstance(playlist, (list, tuple)):
+            return await resolver.run(user.guild_id, QueueItem.from_playlist_url, playlist, user)
+
         # Will be a list if origin is Spotify, or if multiple URLs were sent with the command
-        if isinstance(playlist, (list, tuple)):
-            failures = []
-            for item in playlist:
-                if isinstance(item, str) and 'open.spotify.com' in item:
-                    url = item
-                    item = spoofy.spotify_track(item)
-                    if isinstance(item, tuple):
-                        log(f'Failed to download video: {item[1]}')
-                        failures.append(url)
-                        continue
-                
-                if isinstance(item, dict) and 'open.spotify.com' in item['url']:
-                    objlist.append(QueueItem(item['url'], user, title=item['title'], duration=item.get('duration', 0)))
+        semaphore = asyncio.Semaphore(URL_CONCURRENCY)
+        done = 0
+
+        async def resolve(item: str|dict) -> QueueItem|None:
+            nonlocal done
+            try:
+                # Spotify tracks from a playlist already have everything needed
+                if isinstance(item, dict):
+                    result = QueueItem.from_list_item(item, user)
+                elif probe.is_direct_file(item):
+                    async with semaphore:
+                        result = await QueueItem.from_direct_file(item, user)
                 else:
-                    # Having the list part of the URL causes issues with getting info back
-                    item = item.split('&list=')[0]
-                    
-                    try:
-                        info = ytdl.extract_info(item, download=False)
-                    except yt_dlp.utils.DownloadError as e:
-                        log(f'Failed to download video: {e}')
-                        failures.append(item)
-                        continue
-                    objlist.append(QueueItem(info['webpage_url'], user, title=info['title'], duration=info.get('duration', 0)))
-            return objlist, failures
-        else:
-            # Anything youtube-dl natively supports is probably a link
-            if 'soundcloud.com' in playlist:
-                # SoundCloud playlists have to be processed differently
-                try:
-                    playlist_entries = spoofy.soundcloud_playlist(playlist)
-                except TypeError as e:
-                    log(f'Failed to retrieve SoundCloud playlist: {e}')
-                    return None, e
-                objlist = [QueueItem(item.permalink_url, user, title=item.title, duration=round(item.duration/1000)) for item in playlist_entries]
+                    async with semaphore:
+                        result = await resolver.run(user.guild_id, QueueItem.from_list_item, item, user)
+            except scheduler.SchedulerBusy:
+                raise
+            except Exception as e:
+                # One broken item shouldn't cancel the rest, so it's just counted as a failure
+                log(f'Failed to retrieve {item if isinstance(item, str) else item["url"]}: {type(e).__name__}: {e}')
+                result = None
+            done += 1
+            if progress is not None:
+                await progress(done, len(playlist))
+            return result
+
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tasks = [tg.create_task(resolve(item)) for item in playlist]
+        except ExceptionGroup as group:
+            # Only SchedulerBusy gets this far; the remaining items are cancelled when it does, so just pass it on
+            raise group.exceptions[0]
+
+        objlist = []
+        failures = []
+        for item, task in zip(playlist, tasks):
+            if task.result() is not None:
+                objlist.append(task.result())
             else:
-                try:
-                    playlist_entries = ytdl.extract_info(playlist, download=False)
-                except yt_dlp.utils.DownloadError as e:
-                    log(f'Failed to download playlist: {e}')
-                    return None, e
-                objlist = [QueueItem(item['url'], user, title=item['title'], duration=item.get('duration', 0)) for item in playlist_entries['entries']]
-            return objlist
+                failures.append(item if isinstance(item, str) else item['url'])
+        return objlist, failures
+
+class PlaylistCursor:
+    """Stands in for the unread remainder of a ytdl-compatible playlist in the queue
 
-media_queue = MediaQueue()
+    Entries are read `window` at a time, and only turned into QueueItems once the cursor gets close
+    to the front of the queue (see `expand_cursors()`), so very large playlists don't have to be read
+    or kept in memory up front. Has the same `title`, `url`, `duration`, and `user` attributes as a
+    QueueItem so it can be shown in the queue like one.
+    """
+    def __init__(self, url: str, user: Submitter, window: int):
+        self.url = url
+        self.user = user
+        self.window = window
+        self.playlist_title: str = ''
+        # Only known if the extractor provides them
+        self.total: int|None = None
+        self.total_duration: int|None = None
+        self.read = 0
+        self.read_duration = 0
+        self.exhausted = False
+        self.lock = asyncio.Lock()
+        self._entries: Iterator|list|yt_dlp.utils.PagedList|None = None
+
+    def to_dict(self) -> dict:
+        return {'cursor': self.url, 'user': self.user.to_dict(), 'window': self.window, 'playlist_title': self.playlist_title,
+            'total': self.total, 'total_duration': self.total_duration, 'read': self.read, 'read_duration': self.read_duration}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'PlaylistCursor':
+        """Restores a cursor as it was; its playlist is read again from where it left off once it's expanded"""
+        cursor = cls(data['cursor'], Submitter.from_dict(data['user']), data['window'])
+        cursor.playlist_title = data['playlist_title']
+        cursor.total = data['total']
+        cursor.total_duration = data['total_duration']
+        cursor.read = data['read']
+        cursor.read_duration = data['read_duration']
+        return cursor
+
+    @property
+    def remaining(self) -> int|None:
+        return self.total - self.read if self.total is not None else None
+
+    @property
+    def title(self) -> str:
+        count = f'{self.remaining} more items' if self.remaining is not None else 'More items'
+        return f'{count} from {self.playlist_title or "playlist"}'
+
+    @property
+    def duration(self) -> int|float:
+        return max(self.total_duration - self.read_duration, 0) if self.total_duration is not None else 0
+
+    def read_window(self) -> list[QueueItem]:
+        """Reads the next window of entries; sets `exhausted` once the end of the playlist is reached"""
+        if self._entries is None:
+            # Without processing, entries are left as either a paged list or a generator, which only
+            # request the pages that are actually read from them
+            info = ytdl.extract_info(self.url, download=False, process=False)
+            while info.get('_type') in ['url', 'url_transparent']:
+                info = ytdl.extract_info(info['url'], download=False, process=False)
+            self.playlist_title = info.get('title') or ''
+            self.total = info.get('playlist_count')
+            self.total_duration = info.get('duration')
+            entries = info.get('entries') or []
+            if isinstance(entries, (list, tuple, yt_dlp.utils.PagedList)):
+                self._entries = entries
+                if self.total is None and isinstance(entries, (list, tuple)):
+                    self.total = len(entries)
+            else:
+                # Skipping whatever was read before a restart
+                self._entries = itertools.islice(entries, self.read, None)
+
+        if isinstance(self._entries, yt_dlp.utils.PagedList):
+            batch = self._entries.getslice(self.read, self.read + self.window)
+        elif isinstance(self._entries, (list, tuple)):
+            batch = self._entries[self.read:self.read + self.window]
+        else:
+            batch = list(itertools.islice(self._entries, self.window))
+
+        self.read += len(batch)
+        if len(batch) < self.window or self.read == self.total:
+            self.exhausted = True
+            self.total = self.read
+            # Nothing left to hold on to
+            self._entries = []
+
+        items = []
+        for entry in batch:
+            if entry is None:
+                # Unavailable entries can be left empty
+                continue
+            self.read_duration += entry.get('duration') or 0
+            items.append(QueueItem(entry['url'], self.user, title=entry.get('title'), duration=entry.get('duration', 0)))
+        return items
+
+def queue_entry_from_dict(data: dict) -> 'QueueItem|PlaylistCursor':
+    return PlaylistCursor.from_dict(data) if 'cursor' in data else QueueItem.from_dict(data)
+
+# Where queues and what's playing are saved, so they survive a restart
+queue_store = queuestore.QueueStore() if PERSISTENT_QUEUES else None
+
+media_queue = MediaQueue(queue_store)
 
 def queue_batch(ctx: commands.Context, batch: list[QueueItem]):
     global media_queue
     for item in batch:
         media_queue.get(ctx).append(item)
 
+async def queue_album(ctx: commands.Context, album: dict):
+    """Queues every track of an album from `spoofy.get_ytmusic_album()`"""
+    queue_batch(ctx, [QueueItem(track['url'], Submitter.from_member(ctx.author), title=track['title'], duration=track['duration']) for track in album['tracks']])
+    await ctx.send(embed=embedq(f'Queued {len(album["tracks"])} items from {album["title"]}.'))
+    if not voice.is_playing():
+        await advance_queue(ctx)
+
+async def queue_windowed(ctx: commands.Context, url: str, status: messages.StatusMessage):
+    """Queues the first window of a ytdl-compatible playlist, followed by a PlaylistCursor for the rest of it"""
+    cursor = PlaylistCursor(url, Submitter.from_member(ctx.author), PLAYLIST_WINDOW)
+    try:
+        items = await resolver.run(ctx.guild.id, cursor.read_window, interactive=True)
+    except yt_dlp.utils.DownloadError as e:
+        log(f'Failed to download playlist: {e}')
+        status.update(embedq('Could not retrieve playlist.'))
+        return
+
+    queue_batch(ctx, items + ([] if cursor.exhausted else [cursor]))
+    total_text = f'{cursor.total} items' if cursor.total is not None else f'{len(items)}+ items'
+    duration_text = f' [{timestamp_from_seconds(cursor.total_duration)}]' if cursor.total_duration else ''
+    await ctx.send(embed=embedq(f'Queued {total_text} from {cursor.playlist_title or "playlist"}.{duration_text}'))
+    if not voice.is_playing():
+        await advance_queue(ctx)
+
+async def expand_cursors(ctx: commands.Context):
+    """Reads the next window of any playlist within `playlist-lookahead` spots of the front of the queue"""
+    while True:
+        queue = media_queue.get(ctx)
+        cursor = next((entry for entry in queue[:PLAYLIST_LOOKAHEAD + 1] if isinstance(entry, PlaylistCursor)), None)
+        if cursor is None:
+            return
+
+        async with cursor.lock:
+            if cursor not in media_queue.get(ctx):
+                # Removed or already expanded while waiting
+                continue
+            try:
+                items = await resolver.run(ctx.guild.id, cursor.read_window, interactive=media_queue.get(ctx)[0] is cursor)
+            except scheduler.SchedulerBusy:
+                # Try again on the next advance
+                return
+            except Exception as e:
+                log(f'Failed to read the next window of {cursor.url}; dropping the rest of the playlist.')
+                log_traceback(e)
+                cursor.exhausted = True
+                items = []
+
+            # The queue may have changed while reading
+            queue = media_queue.get(ctx)
+            if cursor in queue:
+                index = queue.index(cursor)
+                queue[index:index + 1] = items + ([] if cursor.exhausted else [cursor])
+            log(f'Read {len(items)} more items from {cursor.playlist_title}; {cursor.remaining} remaining.', verbose=True)
+
+# Playlists still being added to the queue, by guild ID
+ingest_tasks: dict[int, set[asyncio.Task]] = {}
+ingest_locks: dict[int, asyncio.Lock] = {}
+
+async def queue_progressively(ctx: commands.Context, items: AsyncIterator[QueueItem], status: messages.StatusMessage, list_name: str=''):
+    """Adds items to the queue as they arrive, starting the player as soon as the first one is queued
+
+    Returns once the first item is queued, or right away if another playlist is still being added;
+    the rest are added in order by a background task, which updates `status` with a running count.
+    """
+    # The status message belongs to this playlist from here on, so play_item() shouldn't delete it
+    if queue_statuses.get(ctx.guild.id) is status:
+        del queue_statuses[ctx.guild.id]
+
+    # Playlists are added one after another, so they don't end up mixed together
+    lock = ingest_locks.setdefault(ctx.guild.id, asyncio.Lock())
+    waiting = lock.locked()
+
+    first_queued = asyncio.get_running_loop().create_future()
+    task = asyncio.create_task(ingest_playlist(ctx, items, status, list_name, lock, first_queued))
+    ingest_tasks.setdefault(ctx.guild.id, set()).add(task)
+    task.add_done_callback(ingest_tasks[ctx.guild.id].discard)
+
+    if waiting:
+        status.update(embedq('Another playlist is still being queued; this one will follow it.'))
+        return
+    await asyncio.wait([first_queued, task], return_when=asyncio.FIRST_COMPLETED)
+
+async def ingest_playlist(ctx: commands.Context, items: AsyncIterator[QueueItem], status: messages.StatusMessage,
+    list_name: str, lock: asyncio.Lock, first_queued: asyncio.Future):
+    from_text = f' from {list_name}' if list_name else ''
+    count = 0
+    async with lock:
+        try:
+            async for item in items:
+                media_queue.get(ctx).append(item)
+                count += 1
+                if count == 1:
+                    first_queued.set_result(None)
+                    if not voice.is_playing():
+                        log('Voice client is not playing; starting...')
+                        await advance_queue(ctx)
+                status.update(embedq(f'Queueing{from_text}... {count} items so far.'))
+        except scheduler.SchedulerBusy:
+            log(f'Stopped queueing playlist after {count} items; the resolution backlog is full.')
+            status.update(embedq(f'Queued {count} items{from_text}; the bot is too busy to queue the rest right now.'))
+            return
+        except Exception as e:
+            log(f'Failed to retrieve playlist after {count} items.')
+            log_traceback(e)
+            status.update(embedq('Could not retrieve playlist.' if count == 0 else f'Queued {count} items{from_text}; the rest could not be retrieved.'))
+            return
+
+        log(f'Finished queueing {count} items{from_text}.', verbose=True)
+        status.update(embedq(f'Queued {count} items{from_text}.' if count > 0 else 'The playlist is empty.'))
+
+def cancel_ingestion(ctx: commands.Context):
+    """Stops adding any playlists that are still being queued"""
+    for task in ingest_tasks.get(ctx.guild.id, set()).copy():
+        task.cancel()
+
 now_playing: YTDLSource = None
 last_played: YTDLSource = None
 
 current_item: QueueItem = None
 
 npmessage: discord.Message = None
-qmessage: discord.Message = None
+# The latest "Trying to queue..." message of each guild, by guild ID
+queue_statuses: dict[int, messages.StatusMessage] = {}
 
 audio_start_time: int = 0
-audio_time_elapsed: int = 0
 paused_at: int = 0
 paused_for: int = 0
 
 loop_this: bool = False
 
-async def play_item(item: QueueItem, ctx: commands.Context):
-    global audio_start_time, audio_time_elapsed, paused_at, paused_for
+# The next track's player, prepared shortly before the current one ends so it can start straight away
+prewarmed: tuple[QueueItem, YTDLSource]|None = None
+prewarm_task: asyncio.Task|None = None
+# What prewarm_task is preparing, once it's started on it
+prewarm_item: QueueItem|None = None
+
+# What was playing when the voice connection dropped, how far in, and where it was played from
+resume_point: tuple[QueueItem, float, commands.Context]|None = None
+
+def seek_to(offset: float, ctx: commands.Context):
+    """Restarts whatever's playing from `offset` seconds in, using the file it already has"""
+    global now_playing
+    paused = voice.is_paused()
+    previous, now_playing = now_playing, now_playing.replay(offset)
+    # Swapping the source, rather than stopping and playing again, doesn't trigger the queue advancing
+    voice.source = now_playing
+    if paused:
+        voice.pause()
+    # The player thread could still be partway through reading a frame from it, and an empty read would end the track
+    asyncio.get_running_loop().call_later(1, previous.cleanup)
+    log(f'Seeked to {round(offset, 1)}s.', verbose=True)
+    if PREWARM_SECONDS > 0 and now_playing.duration:
+        schedule_prewarm(ctx, max(now_playing.duration - offset - PREWARM_SECONDS, 0))
+    if queue_store is not None:
+        queue_store.update_position(ctx.guild.id, offset)
+
+def remember_position(ctx: commands.Context):
+    global resume_point
+    if current_item is not None and now_playing is not None:
+        resume_point = (current_item, now_playing.position, ctx)
+        log(f'Voice disconnected {round(now_playing.position, 1)}s into {now_playing.title}; it\'ll resume from there.')
+
+def forget_position():
+    """Stops whatever was playing from resuming later, for when the bot leaves on purpose"""
+    global resume_point, current_item
+    resume_point = None
+    current_item = None
+    if queue_store is not None and voice is not None:
+        queue_store.clear_playing(voice.guild.id)
+
+def save_playing(item: QueueItem, ctx: commands.Context):
+    """Saves what's now playing, so it can carry on after a restart; its position is kept up to date by keep_queues()"""
+    if queue_store is None:
+        return
+    info = {key: now_playing.data.get(key) for key in ('id', 'title', 'extractor', 'duration')}
+    queue_store.set_playing(queuestore.Playing(ctx.guild.id, item.to_dict(), now_playing.offset, voice.channel.id,
+        ctx.channel.id, now_playing.filename if now_playing.replayable else None, info))
+
+async def keep_queues(interval: float=5.0):
+    """Saves how far into its track the player is every `interval` seconds, and compacts the queue journal when it's grown"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if voice is not None and voice.is_connected() and now_playing is not None and current_item is not None:
+                queue_store.update_position(voice.guild.id, now_playing.position)
+            if queue_store.journaled >= queuestore.COMPACT_AFTER:
+                queue_store.compact()
+        except sqlite3.Error as e:
+            log(f'{plt.warn}Couldn\'t save queues: {e}')
+
+class RestoredContext:
+    """Stands in for the command that started whatever was playing before a restart, for `play_item()` and the queue
+
+    - `author`: Who queued what was playing, so they can answer any prompt to choose a match, as they could before
+    """
+    def __init__(self, channel: discord.abc.Messageable, author: discord.Member):
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+
+    async def send(self, *args, **kwargs) -> discord.Message:
+        return await self.channel.send(*args, **kwargs)
+
+async def restore_playback():
+    """Rejoins the voice channel the bot was playing in before it restarted, and carries on from where it was"""
+    global voice, prewarmed
+    for playing in queue_store.playing():
+        voice_channel = bot.get_channel(playing.voice_channel_id)
+        text_channel = bot.get_channel(playing.text_channel_id)
+        # Servers on other shards are left to the process running them
+        if voice_channel is None or text_channel is None or voice is not None:
+            continue
+        if not any(not member.bot for member in voice_channel.members):
+            log(f'Nobody is left in {voice_channel} to resume playing for.')
+            queue_store.clear_playing(playing.guild_id)
+            continue
+        try:
+            item = QueueItem.from_dict(playing.entry)
+            log(f'Rejoining {voice_channel} to resume {item.title} from {round(playing.position)}s...')
+            voice = await voice_channel.connect()
+        except (KeyError, TypeError, discord.ClientException, asyncio.TimeoutError) as e:
+            log(f'{plt.warn}Couldn\'t resume playback in {voice_channel}: {e}')
+            continue
+        try:
+            # Members aren't cached without the members intent, so it's asked for
+            author = voice_channel.guild.get_member(item.user.id) or await voice_channel.guild.fetch_member(item.user.id)
+        except discord.HTTPException:
+            # They've left the server; any prompt to choose a match goes unanswered and times out
+            author = voice_channel.guild.me
+        ctx = RestoredContext(text_channel, author)
+        if playing.filename is not None and os.path.isfile(playing.filename) and playing.info is not None:
+            # Still downloaded, so it starts straight from the file
+            player = YTDLSource(discord.FFmpegPCMAudio(playing.filename,
+                **playback_options(f'{playing.info["extractor"]}-{playing.info["id"]}', playing.position)), data=playing.info)
+            player.filename = playing.filename
+            player.offset = playing.position
+            prewarmed = (item, player)
+            await play_item(item, ctx)
+        else:
+            await play_item(item, ctx, offset=playing.position)
+
+async def resume_playback():
+    """Carries on with whatever a dropped connection cut off, from where it was"""
+    global resume_point
+    if resume_point is None or voice is None:
+        return
+    item, position, ctx = resume_point
+    resume_point = None
+    await play_item(item, ctx, offset=position)
+
+async def reconnect(channel: discord.VoiceChannel):
+    """Rejoins `channel` after the connection to it dropped, and resumes playback"""
+    global voice
+    log(f'Reconnecting to {channel}...')
+    try:
+        voice = await channel.connect()
+    except (discord.ClientException, asyncio.TimeoutError) as e:
+        # Left for the next command that joins, which resumes it too
+        log(f'Couldn\'t reconnect: {e}')
+        return
+    await resume_playback()
+
+def channel_bitrate() -> int:
+    """The bitrate of the voice channel the bot is in, in kbps; nothing better than this is downloaded"""
+    return voice.channel.bitrate // 1000 if voice is not None else 0
+
+def schedule_prewarm(ctx: commands.Context, delay: float):
+    global prewarm_task, prewarm_item
+    if prewarm_task is not None:
+        prewarm_task.cancel()
+    prewarm_item = None
+    prewarm_task = asyncio.create_task(prewarm(ctx, delay))
+
+async def prewarm(ctx: commands.Context, delay: float):
+    """Prepares a player for whatever's going to play next, `delay` seconds from now"""
+    global prewarmed, prewarm_item
+    await asyncio.sleep(delay)
+    try:
+        if loop_this and current_item is not None and now_playing is not None and now_playing.replayable:
+            prewarm_item = current_item
+            player = now_playing.replay()
+        else:
+            queue = media_queue.get(ctx)
+            if not queue or not isinstance(queue[0], QueueItem):
+                return
+            item = prewarm_item = queue[0]
+            if 'open.spotify.com' in item.url:
+                # Matched now only if nobody needs to be asked to choose; otherwise that happens once it's playing
+                match = await resolver.run(ctx.guild.id, lookups.spyt, item.url, interactive=True)
+                if isinstance(match, tuple) and match[0] == 'unsure' and USE_TOP_MATCH:
+                    match = match[1][0]
+                if not isinstance(match, dict):
+                    return
+                item.url = match['url']
+            player = await YTDLSource.from_url(item.url, loop=bot.loop, stream=False, bitrate=channel_bitrate())
+    except Exception as e:
+        # play_item() will try again, and report it properly if it still fails
+        log(f'Couldn\'t prepare the next track ahead of time: {e}', verbose=True)
+        return
+    if prewarmed is not None:
+        close_prewarmed(prewarmed[1])
+    prewarmed = (prewarm_item, player)
+    log(f'Prepared {player.title} ahead of time.', verbose=True)
+
+async def take_prewarmed(item: QueueItem) -> YTDLSource|None:
+    """Returns a player already prepared for `item` if there is one, and discards any prepared for something else"""
+    global prewarmed
+    if prewarm_task is not None and not prewarm_task.done() and prewarm_item is item:
+        # It's most likely partway through downloading, which is quicker to wait for than to start over
+        await asyncio.wait([prewarm_task])
+    prepared, prewarmed = prewarmed, None
+    discard_prewarmed()
+    if prepared is not None:
+        if prepared[0] is item:
+            return prepared[1]
+        close_prewarmed(prepared[1])
+    # Looping, but it wasn't prepared in time (like when looping was turned on right at the end)
+    if item is current_item and now_playing is not None and now_playing.replayable:
+        return now_playing.replay()
+    return None
+
+def discard_prewarmed():
+    """Stops preparing the next track, and closes its player if it's ready"""
+    global prewarmed, prewarm_task, prewarm_item
+    if prewarm_task is not None:
+        prewarm_task.cancel()
+        prewarm_task = None
+    prewarm_item = None
+    if prewarmed is not None:
+        close_prewarmed(prewarmed[1])
+        prewarmed = None
+
+def close_prewarmed(player: YTDLSource):
+    """Closes a player that was prepared but won't be played, and deletes its file like a played one would be"""
+    player.cleanup()
+    # A replay for looping shares its file with what's playing now
+    if now_playing is not None and player.ID == now_playing.ID:
+        return
+    for i in glob.glob(f'*-#-{player.ID}-#-*'):
+        try:
+            log(f'Removing file: {i}', verbose=True)
+            os.remove(i)
+        except PermissionError:
+            log('Cannot remove; the file is likely in use.', verbose=True)
+
+async def play_item(item: QueueItem, ctx: commands.Context, offset: float=0):
+    global audio_start_time, paused_at, paused_for
     global now_playing
     global last_played
     global current_item
     global npmessage
-    global qmessage
     global skip_votes
 
     skip_votes = []
+    started_at = time.perf_counter()
 
-    audio_time_elapsed = paused_at = paused_for = 0
+    paused_at = paused_for = 0
 
     last_played = now_playing
 
-    try:
-        if npmessage is not None:
-            await npmessage.delete()
-    except discord.errors.NotFound:
-        log('Now-playing message wasn\'t found, ignoring and continuing...', verbose=True)
-    
+    message_manager.delete_later(npmessage)
+    npmessage = None
+    search_status: messages.StatusMessage|None = None
+
     log('Trying to start playing...')
 
+    # If it was prepared ahead of time, any Spotify match has been made already too
+    player = await take_prewarmed(item)
+
     # Check if we need to match a Spotify link
     if 'open.spotify.com' not in item.url:
         url = item.url
     else:
         log('Trying to match Spotify track...')
-        npmessage = await ctx.send(embed=embedq(f'Spotify link detected, searching YouTube...','Please wait, this may take a while!\nIf you think the bot\'s become stuck, use the skip command.'))
-        spyt = spoofy.spyt(item.url)
+        search_status = await message_manager.status(ctx.channel, embedq(f'Spotify link detected, searching YouTube...','Please wait, this may take a while!\nIf you think the bot\'s become stuck, use the skip command.'))
+        # So it's cleaned up with the now-playing message if this track never starts
+        npmessage = search_status.message
+        spyt = await resolver.run(ctx.guild.id, lookups.spyt, item.url, interactive=True)
 
         log('Checking if unsure...', verbose=True)
         if isinstance(spyt, tuple) and spyt[0] == 'unsure':
@@ -1090,7 +2005,7 @@ async def play_item(item: QueueItem, ctx: commands.Context):
                 spyt = spyt[0]
             else:
                 # Otherwise, prompt the user with choice
-                embed = discord.Embed(title='No exact match found; please choose an option.',description=f'Select the number with reactions or use {emoji["cancel"]} to cancel.',color=EMBED_COLOR)
+                embed = discord.Embed(title='No exact match found; please choose an option.',description=f'Select a number below, or {emoji["cancel"]} to cancel.',color=EMBED_COLOR)
                 
                 for i in spyt:
                     title = spyt[i]['title']
@@ -1100,71 +2015,74 @@ async def play_item(item: QueueItem, ctx: commands.Context):
                     if artist=='': embed.add_field(name=f'{i+1}. {title}',value=url,inline=False)
                     else: embed.add_field(name=f'{i+1}. {title}\nby {artist} - {album}',value=url,inline=False)
 
-                prompt = await ctx.send(embed=embed)
-                choice = await prompt_for_choice(ctx, prompt, len(spyt))
+                choice = await prompt_for_choice(ctx, embed, len(spyt))
                 if choice is None:
                     await advance_queue(ctx)
                     return
                 spyt = spyt[choice-1]
         url = spyt['url']
         item.url = url
-        await npmessage.edit(embed=embedq('Match found! Playing...'))
+        search_status.update(embedq('Match found! Playing...'))
 
     current_item = item
 
     # Start the player with retrieved URL
-    try:
-        player = await YTDLSource.from_url(item.url, loop=bot.loop, stream=False)
-    except yt_dlp.utils.DownloadError as e:
-        log(f'Failed to download video: {e}')
-        await ctx.send(embed=embedq('This video is unavailable.', url))
-        await advance_queue(ctx)
-        return
+    if player is None:
+        try:
+            player = await YTDLSource.from_url(item.url, loop=bot.loop, stream=False, bitrate=channel_bitrate())
+        except yt_dlp.utils.DownloadError as e:
+            log(f'Failed to download video: {e}')
+            await ctx.channel.send(embed=embedq('This video is unavailable.', url))
+            await advance_queue(ctx)
+            return
+
+    if offset > 0 and player.replayable:
+        # Resuming after a reconnect; the file's still here, so it just starts further in
+        resumed = player.replay(offset)
+        player.cleanup()
+        player = resumed
 
     now_playing = player
     now_playing.weburl = url
     now_playing.user = item.user
 
-    if item.duration is not None:
-        if item.duration == 0:
-            item.duration = duration_from_url(item.url)
-        now_playing.duration = item.duration
-    else:
-        try:
-            now_playing.duration = pytube.YouTube(now_playing.weburl).length
-        except Exception as e:
-            log(f'Falling back on yt-dlp. (Cause: {traceback.format_exception(e)[-1]})', verbose=True)
-            try:
-                now_playing.duration = ytdl.extract_info(now_playing.weburl, download=False)['duration']
-            except Exception as e:
-                log(f'ytdl duration extraction failed, likely a direct file link. (Cause: {traceback.format_exception(e)[-1]})', verbose=True)
-                log(f'Attempting to retrieve URL through FFprobe...', verbose=True)
-                ffprobe_command = f'ffprobe {url} -v quiet -show_entries format=duration -of csv=p=0'.split(' ')
-                now_playing.duration = float(subprocess.check_output(ffprobe_command).decode('utf-8').split('.')[0])
-    
-    now_playing.duration_stamp = timestamp_from_seconds(now_playing.duration)
-    
+    # Started before anything else, since everything below can wait until it's playing
     voice.stop()
     voice.play(now_playing, after=lambda e: asyncio.run_coroutine_threadsafe(advance_queue(ctx), bot.loop))
     audio_start_time = time.time()
-    if npmessage is not None:
-        try:
-            await npmessage.delete()
-        except:
-            # Sometimes this causes a 404 error and prevents a new "Now playing" message to show
-            # Just ignoring the error sends a message properly so, sure
-            pass
+    save_playing(item, ctx)
+    # Includes waiting for a Spotify match to be chosen, same as what whoever queued it waits through
+    track_start_seconds.observe(time.perf_counter() - started_at)
 
-    try:
-        await qmessage.delete()
-    except Exception as e:
-        pass
+    if not item.duration:
+        # The file's already been downloaded, so it's quickest to ask that
+        probed = await probe.ffprobe(player.filename) if player.replayable else None
+        item.duration = player.data.get('duration') or (probed.duration if probed is not None else None) or 0
+    now_playing.duration = item.duration
+
+    now_playing.duration_stamp = timestamp_from_seconds(now_playing.duration)
+
+    if PREWARM_SECONDS > 0:
+        schedule_prewarm(ctx, max(now_playing.duration - player.offset - PREWARM_SECONDS, 0))
+
+    if search_status is not None:
+        search_status.delete()
+
+    queue_status = queue_statuses.pop(ctx.guild.id, None)
+    if queue_status is not None:
+        queue_status.delete()
 
     submitter_text = get_queued_by_text(item.user)
-    embed = discord.Embed(title=f'{get_loop_icon()}Now playing: {now_playing.title} [{now_playing.duration_stamp}]',description=f'Link: {url}{submitter_text}',color=EMBED_COLOR)
-    npmessage = await ctx.send(embed=embed)
+    if player.offset > 0:
+        embed = discord.Embed(title=f'{get_loop_icon()}Resuming: {now_playing.title} [{timestamp_from_seconds(player.offset)} / {now_playing.duration_stamp}]',description=f'Link: {url}{submitter_text}',color=EMBED_COLOR)
+    else:
+        embed = discord.Embed(title=f'{get_loop_icon()}Now playing: {now_playing.title} [{now_playing.duration_stamp}]',description=f'Link: {url}{submitter_text}',color=EMBED_COLOR)
+    # This can come long after the command that queued the item, when a slash command's follow-ups
+    # have stopped working, so messages from here are sent to the channel directly
+    npmessage = await ctx.channel.send(embed=embed)
 
-    if last_played is not None:
+    # Looping (or the same video twice in a row) plays the same file again, so it's kept
+    if last_played is not None and last_played.ID != now_playing.ID:
         for i in glob.glob(f'*-#-{last_played.ID}-#-*'):
             # Delete last played file
             try:
@@ -1180,19 +2098,35 @@ async def advance_queue(ctx: commands.Context, skip: bool=False):
     """Attempts to advance forward in the queue, if the bot is clear to do so."""
     # Triggers every time the player finishes
     global advance_lock
+    if voice is None or not voice.is_connected():
+        # Playback stopped because the connection dropped, not because the track ended
+        if not skip:
+            remember_position(ctx)
+        return
     if not advance_lock and (skip or not voice.is_playing()):
         log('Locking...', verbose=True)
         advance_lock = True
 
+        queue_advances.inc(reason='skip' if skip else 'finished')
         try:
             if not skip and loop_this and current_item is not None:
                 media_queue.get(ctx).insert(0, current_item)
 
+            # Make sure the next item isn't the unread part of a playlist
+            await expand_cursors(ctx)
+            while media_queue.get(ctx) and isinstance(media_queue.get(ctx)[0], PlaylistCursor):
+                log(f'Couldn\'t read the rest of {media_queue.get(ctx)[0].url} in time; skipping it.')
+                media_queue.get(ctx).pop(0)
+
             if media_queue.get(ctx) == []:
                 voice.stop()
+                if queue_store is not None:
+                    queue_store.clear_playing(ctx.guild.id)
             else:
                 next_item = media_queue.get(ctx).pop(0)
                 await play_item(next_item, ctx)
+                # Read ahead in the background so the next window is ready before it's needed
+                asyncio.create_task(expand_cursors(ctx))
             
             log('Tasks finished; unlocking...', verbose=True)
             advance_lock = False
@@ -1209,27 +2143,76 @@ def get_loop_icon() -> str:
     else: return ''
 
 # Establish bot user
-intents = discord.Intents.default()
-intents.messages = True
-intents.message_content = True
-intents.voice_states = True
-intents.reactions = True
-intents.guilds = True
-intents.members = True
+if LEAN_MODE:
+    # Only what the bot actually uses: servers and their channels, voice states, and commands
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.voice_states = True
+    # This is also how record_sent_message() sees the bot's own messages, so without it
+    # the rate limit estimates leave out plain ctx.send() calls
+    intents.guild_messages = PREFIX_COMMANDS
+    intents.message_content = PREFIX_COMMANDS
+    # Vote-skip only needs to count who's in the bot's voice channel
+    member_cache_flags = discord.MemberCacheFlags.none()
+    member_cache_flags.voice = True
+else:
+    intents = discord.Intents.default()
+    # Without prefix commands, the bot doesn't need to receive every message sent in every server
+    intents.messages = PREFIX_COMMANDS
+    intents.message_content = PREFIX_COMMANDS
+    intents.voice_states = True
+    # Choices are made with buttons, so reactions aren't needed
+    intents.reactions = False
+    intents.guilds = True
+    intents.members = True
+    member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
 
 # Set prefix
 command_prefix = PUBLIC_PREFIX if PUBLIC else DEV_PREFIX
 
-bot = commands.Bot(
+if SHARDING:
+    if SHARD_IDS and not SHARD_COUNT:
+        log(f'{plt.error}A shard range was given without a shard count; set sharding.shard-count, or start the bot with launcher.py.')
+        raise SystemExit(1)
+    log(f'Sharding is on; running shards {sharding.format_range(SHARD_IDS) if SHARD_IDS else 'all'} '+
+        f'of {SHARD_COUNT or 'the recommended number'}.')
+    bot_class = commands.AutoShardedBot
+    # Left as None, discord.py asks Discord for the recommended count and runs every shard
+    shard_options = {'shard_count': SHARD_COUNT or None, 'shard_ids': SHARD_IDS or None}
+else:
+    bot_class = commands.Bot
+    shard_options = {}
+
+bot = bot_class(
     command_prefix=commands.when_mentioned_or(command_prefix),
     description='',
     intents=intents,
-    help_command = PrettyHelp(False, color=EMBED_COLOR)
+    member_cache_flags=member_cache_flags,
+    chunk_guilds_at_startup=not LEAN_MODE,
+    # 0 turns the message cache off, which discord.py expects as None
+    max_messages=MESSAGE_CACHE or None,
+    help_command = PrettyHelp(False, color=EMBED_COLOR),
+    **shard_options
 )
 
+@bot.event
+async def on_command_completion(ctx: commands.Context):
+    commands_run.inc(command=ctx.command.qualified_name, result='ok')
+
 # Command error handling
+def unwrap_command_error(error: Exception) -> Exception:
+    """Returns what a command actually raised, from inside the errors discord.py wraps it in
+
+    Slash invocations of hybrid commands wrap it twice, in a `HybridCommandError` around an `app_commands.CommandInvokeError`.
+    """
+    while isinstance(error, (commands.HybridCommandError, commands.CommandInvokeError, app_commands.CommandInvokeError)):
+        error = error.original
+    return error
+
 @bot.event
 async def on_command_error(ctx: commands.Context, error):
+    if ctx.command is not None:
+        commands_run.inc(command=ctx.command.qualified_name, result='error')
     if isinstance(error, commands.errors.MissingRequiredArgument):
         match ctx.command.name:
             case 'volume':
@@ -1243,6 +2226,9 @@ async def on_command_error(ctx: commands.Context, error):
         pass
     elif isinstance(error, yt_dlp.utils.DownloadError):
         await ctx.send(embed=embedq('Could not queue; this video may be private or otherwise unavailable.', error))
+    elif isinstance(unwrap_command_error(error), scheduler.SchedulerBusy):
+        log(f'Refused `{ctx.command}` in guild {ctx.guild.id}; the resolution backlog is full.')
+        await ctx.send(embed=embedq('The bot is busy right now, please try again later.', 'Too many tracks are being looked up at the moment.'))
     else:
         log(f'Error encountered in command `{ctx.command}`.')
         log(error)
@@ -1253,10 +2239,97 @@ async def on_command_error(ctx: commands.Context, error):
 
 @bot.event
 async def on_ready():
+    global startup_reported
     log(f'Logged in as {bot.user} (ID: {bot.user.id})')
     print('-----')
     log('Ready!')
 
+    # on_ready is called again after reconnecting, but the timeline only means anything the first time
+    if not startup_reported:
+        startup_reported = True
+        report_startup()
+        # Every process shares the same command tree, so one sync is enough
+        if PRIMARY_PROCESS:
+            asyncio.create_task(sync_commands())
+        # Create the API clients now instead of during whoever's command comes first
+        run_in_background(spoofy.warm_clients, ytdl)
+        if queue_store is not None:
+            asyncio.create_task(restore_playback())
+
+startup_reported = False
+
+# Only dispatched by AutoShardedBot; on_ready above waits for every shard this process runs
+@bot.event
+async def on_shard_ready(shard_id: int):
+    log(f'Shard {shard_id} is ready, with {sum(1 for guild in bot.guilds if guild.shard_id == shard_id)} server(s).')
+
+@bot.event
+async def on_shard_disconnect(shard_id: int):
+    log(f'{plt.warn}Shard {shard_id} has disconnected.')
+
+@bot.event
+async def on_shard_resumed(shard_id: int):
+    log(f'Shard {shard_id} has resumed its session.')
+
+# Hash of the slash commands as they were last synced, so they're only synced again when something changes
+COMMAND_HASH_FILE = 'command_hash.txt'
+
+async def sync_commands(force: bool=False):
+    """Registers the bot's slash commands with Discord if they've changed since the last sync, or if `force` is set"""
+    payload = json.dumps([command.to_dict() for command in bot.tree.get_commands()], sort_keys=True)
+    command_hash = hashlib.sha1(payload.encode()).hexdigest()
+    try:
+        with open(COMMAND_HASH_FILE, 'r') as f:
+            last_hash = f.read().strip()
+    except FileNotFoundError:
+        last_hash = None
+
+    if command_hash == last_hash and not force:
+        log('Slash commands are unchanged since the last sync.', verbose=True)
+        return
+
+    try:
+        synced = await bot.tree.sync()
+    except discord.HTTPException as e:
+        log(f'{plt.warn}Failed to sync slash commands: {e}')
+        return
+    with open(COMMAND_HASH_FILE, 'w') as f:
+        f.write(command_hash)
+    log(f'Synced {len(synced)} slash commands.')
+
+@bot.listen('on_message')
+async def record_sent_message(message: discord.Message):
+    # Everything the bot sends counts towards its channel's rate limit, not just what goes through message_manager
+    if message.author == bot.user:
+        message_manager.record(message.channel.id)
+
+# Strong references to fire-and-forget tasks, so they aren't garbage collected before they finish
+background_tasks: set[asyncio.Task] = set()
+
+def run_in_background(func: Callable, *args):
+    """Runs a blocking function in a thread without waiting for it"""
+    task = asyncio.create_task(asyncio.to_thread(func, *args))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+def report_startup():
+    """Logs how long each step of startup took, and warns if getting ready took longer than the configured budget"""
+    mark_startup('ready')
+    steps = []
+    previous = 0.0
+    for step, elapsed in startup_timeline:
+        steps.append((step, elapsed - previous))
+        previous = elapsed
+    log('Startup timeline: ' + ' | '.join(f'{step} +{round(took, 2)}s' for step, took in steps))
+
+    total = startup_timeline[-1][1]
+    if STARTUP_BUDGET_READY and total > STARTUP_BUDGET_READY:
+        slowest, took = max(steps, key=lambda s: s[1])
+        log(f'{plt.warn}Startup took {round(total, 2)}s, over the budget of {STARTUP_BUDGET_READY}s; '+
+            f'the slowest step was "{slowest}" ({round(took, 2)}s).')
+    else:
+        log(f'Ready in {round(total, 2)}s.')
+
 # Retrieve bot token
 log(f'Retrieving token from {plt.blue}{TOKEN_FILE_PATH}')
 
@@ -1356,7 +2429,7 @@ class Tests:
 
         await Music.ensure_voice(Music, debugctx)
         if not multiple_urls:
-            await Music.play(Music, debugctx, random.choice(self.test_urls[url_type][valid][src]))
+            await Music.play(Music, debugctx, query=random.choice(self.test_urls[url_type][valid][src]))
             if voice.is_playing():
                 conclusion = f'voice client is playing. Test likely {plt.green}passed.'
                 log(conclusion); passed = True
@@ -1375,7 +2448,7 @@ class Tests:
             else:
                 urls = self.test_urls[url_type][valid][src]
             
-            await Music.play(Music, debugctx, *urls)
+            await Music.play(Music, debugctx, query=' '.join(urls))
             if voice.is_playing() and media_queue.get(debugctx) != []:
                 conclusion = f'Voice client is playing and the queue is not empty. Test likely {plt.green}passed.'
                 log(conclusion); passed = True
@@ -1394,17 +2467,139 @@ class Tests:
                     log(conclusion)
         
         log(f'Waiting 2 seconds...')
-        time.sleep(2)
+        await asyncio.sleep(2)
         log(f'Clearing media queue and stopping voice client...')
         media_queue.clear(debugctx)
+        cancel_ingestion(debugctx)
         voice.stop()
         log(f'Waiting 2 seconds...')
-        time.sleep(2)
+        await asyncio.sleep(2)
         log(f'{plt.gold}### END TEST!')
         return {'passed': passed, 'arguments': arguments, 'conclusion': conclusion}
 
 # Begin main thread
 
+def format_latency(latency: float) -> str:
+    # discord.py gives NaN until the first heartbeat has been acknowledged
+    return 'unknown' if math.isnan(latency) else f'{round(latency*1000)}ms'
+
+def print_shard_report():
+    """Prints the connection state of each shard this process runs"""
+    if not SHARDING:
+        print(f'Sharding is off | {'connected' if bot.is_ready() and not bot.is_closed() else 'not connected'} | '+
+            f'latency: {format_latency(bot.latency)} | servers: {len(bot.guilds)}')
+        return
+
+    print(f'Running shards {sharding.format_range(list(bot.shards)) or 'none yet'} of {bot.shard_count}')
+    for shard_id, shard in sorted(bot.shards.items()):
+        if shard.is_closed():
+            state = f'{plt.red}closed'
+        elif shard.is_ws_ratelimited():
+            state = f'{plt.warn}rate limited'
+        else:
+            state = f'{plt.green}connected'
+        print(f'{plt.blue}{shard_id}{plt.reset} | {state}{plt.reset} | latency: {format_latency(shard.latency)} | '+
+            f'servers: {sum(1 for guild in bot.guilds if guild.shard_id == shard_id)}')
+
+def print_blockers(count: int=10):
+    """Prints the call sites that have held up the event loop the longest"""
+    if loop_watchdog.threshold <= 0:
+        print('The loop lag watchdog is off; set loop-lag-threshold to turn it on.')
+        return
+    print(f'{loop_watchdog.stalls} stall(s) over {loop_watchdog.threshold}s | worst lag: {round(loop_watchdog.worst_lag, 3)}s | '+
+        f'last lag: {round(loop_watchdog.last_lag, 3)}s')
+    for blocker in loop_watchdog.top(count):
+        print(f'{plt.magenta}{round(blocker.total, 2)}s{plt.reset} total | {blocker.count}x | longest {round(blocker.longest, 2)}s | '+
+            f'{plt.gold}{blocker.site}')
+
+def print_cache_summary():
+    """Prints how much the URL and lookup caches, downloaded media files, and each server's queue are holding"""
+    url_entries = sum(len(values) for values in url_info_cache.values())
+    print(f'URL cache: {len(url_info_cache)} URL(s), {url_entries} value(s) | '+
+        f'SoundCloud track cache: {len(spoofy.soundcloud_track_cache)} | '+
+        f'YouTube Music album cache: {len(spoofy.ytmusic_album_cache)}')
+    media_files = find_leftover_media()
+    media_size = 0
+    for file in media_files:
+        try:
+            media_size += os.path.getsize(file)
+        except OSError:
+            # Removed since it was listed
+            pass
+    print(f'Media files on disk: {len(media_files)} ({diagnostics.format_bytes(media_size)})')
+    queues = {guild_id: queue for guild_id, queue in media_queue.queues.items() if queue}
+    print(f'Queues: {sum(len(queue) for queue in queues.values())} item(s) across {len(queues)} server(s)')
+    for guild_id, queue in sorted(queues.items(), key=lambda pair: len(pair[1]), reverse=True):
+        guild = bot.get_guild(guild_id)
+        print(f'    {plt.blue}{guild_id}{plt.reset} {guild.name if guild else "(unknown)"} | {len(queue)} item(s)')
+
+def print_object_counts():
+    """Prints how many queue items, players, and cache entries are alive, to spot anything that isn't being let go of"""
+    for name, count in diagnostics.count_instances(QueueItem, PlaylistCursor, Submitter, YTDLSource).items():
+        print(f'{name}: {plt.magenta}{count}')
+    print_cache_summary()
+
+def profile_command(action: str):
+    if action == 'start':
+        if profiler.running:
+            print('A profile is already running; use "profile stop" to save it.')
+            return
+        # Started from the event loop's thread, so it sees every command, event, and callback
+        profiler.start()
+        print('Profiling; use "profile stop" to save the profile.')
+    elif action == 'stop':
+        if not profiler.running:
+            print('No profile is running; use "profile start" to start one.')
+            return
+        path, summary = profiler.stop()
+        print(summary)
+        print(f'Saved profile to {plt.gold}{path}')
+    print_cache_summary()
+
+def snapshot_command(action: str):
+    if action == 'stop':
+        memory_snapshots.stop()
+        print('Stopped tracing memory allocations.')
+        return
+    diffs = memory_snapshots.take()
+    if diffs is None:
+        print('Started tracing memory allocations and took a first snapshot; run "snapshot" again to see what has changed.')
+    else:
+        traced, peak = memory_snapshots.traced()
+        print(f'Traced memory: {diagnostics.format_bytes(traced)} (peak {diagnostics.format_bytes(peak)}) | '+
+            'biggest changes since the last snapshot:')
+        for diff in diffs:
+            print(f'{plt.magenta}{'+' if diff.size_diff >= 0 else '-'}{diagnostics.format_bytes(abs(diff.size_diff))}{plt.reset} '+
+                f'({diff.count_diff:+} blocks) {diff.traceback}')
+    print_cache_summary()
+
+def print_memory_report():
+    """Prints the process's resident memory, and what each guild has cached or queued"""
+    resident = diagnostics.resident_memory()
+    guild_count = len(bot.guilds)
+    if resident is None:
+        print('Resident memory: unknown on this platform')
+    else:
+        per_guild = f', ~{diagnostics.format_bytes(resident / guild_count)} per server' if guild_count else ''
+        print(f'Resident memory: {plt.magenta}{diagnostics.format_bytes(resident)}{plt.reset} across {guild_count} server(s){per_guild}')
+    print(f'Lean mode: {'on' if LEAN_MODE else 'off'} | '+
+        f'cached members: {sum(len(guild.members) for guild in bot.guilds)} | '+
+        f'cached messages: {len(bot.cached_messages)}/{MESSAGE_CACHE or 0}')
+
+    messages_by_guild: dict[int, list[discord.Message]] = {}
+    for message in bot.cached_messages:
+        if message.guild is not None:
+            messages_by_guild.setdefault(message.guild.id, []).append(message)
+
+    for guild in bot.guilds:
+        queue = media_queue.queues.get(guild.id, [])
+        guild_messages = messages_by_guild.get(guild.id, [])
+        estimate = diagnostics.total_size(guild.members) + diagnostics.total_size(guild_messages) + diagnostics.total_size(queue)
+        print(f'{plt.blue}{guild.id}{plt.reset} {guild.name} | '+
+            f'members cached: {len(guild.members)}/{guild.member_count} | '+
+            f'messages cached: {len(guild_messages)} | '+
+            f'queue: {len(queue)} items | ~{diagnostics.format_bytes(estimate)}')
+
 async def console():
     log('Console is active.')
     while True:
@@ -1494,6 +2689,47 @@ async def console():
                 match user_input:
                     case 'colors':
                         plt.preview(); print()
+                    case 'reload config':
+                        reload_config()
+                    case 'messages':
+                        for channel_id, stats in message_manager.stats().items():
+                            print(f'{plt.blue}{channel_id}{plt.reset} | '+
+                                f'headroom: {stats['headroom']}/{messages.CHANNEL_LIMIT} | '+
+                                f'pending deletes: {stats['pending_deletes']} | '+
+                                f'calls: {stats['total_calls']} | coalesced edits: {stats['coalesced']}')
+                    case 'sync':
+                        await sync_commands(force=True)
+                    case 'memory':
+                        print_memory_report()
+                    case 'blockers':
+                        print_blockers()
+                    case 'blockers clear':
+                        loop_watchdog.reset()
+                        print('Cleared recorded blockers.')
+                    case 'objects':
+                        print_object_counts()
+                    case 'profile start' | 'profile stop':
+                        profile_command(user_input.split()[1])
+                    case 'snapshot' | 'snapshot stop':
+                        snapshot_command('stop' if user_input == 'snapshot stop' else 'take')
+                    case 'shards':
+                        print_shard_report()
+                    case 'scheduler':
+                        print(f'{resolver.running}/{resolver.workers} resolution workers busy, {resolver.backlog} jobs waiting.')
+                        if lookups.address is None:
+                            print('Lookups run in this process.')
+                        else:
+                            print(f'Lookups run by the resolver service at {lookups.address[0]}:{lookups.address[1]}'+
+                                f'{'' if lookups.remote else f' {plt.warn}(unreachable; running them in this process for now){plt.reset}'} | '+
+                                f'sent: {lookups.remote_calls} | run here: {lookups.local_calls}')
+                        if worker_pool is not None:
+                            stats = worker_pool.stats()
+                            print(f'Worker processes: {stats['idle']}/{stats['workers']} idle | '+
+                                f'replaced: {stats['replaced']} (timed out: {stats['timeouts']})')
+                        for guild_id, stats in resolver.stats().items():
+                            print(f'{plt.blue}{guild_id}{plt.reset} | '+
+                                f'interactive: {stats['running_interactive']} running, {stats['queued_interactive']} queued | '+
+                                f'bulk: {stats['running_bulk']} running, {stats['queued_bulk']} queued | weight: {stats['weight']}')
                     case 'stop':
                         log('Leaving voice if connected...')
                         try:
@@ -1516,14 +2752,57 @@ async def bot_thread():
         await bot.add_cog(General(bot))
         await bot.add_cog(Music(bot))
         log('Logging in with token...')
+        mark_startup('login')
         await bot.start(token)
 
 async def main():
-    global bot_task, console_task
+    global bot_task, console_task, metrics_runner
+
+    log(f'Running on version {VERSION}; checking for updates in the background...')
+    run_in_background(log_update_check)
+
+    # Listed now so nothing downloaded after startup gets caught, but deleting them can happen in the background
+    # Other processes could already be downloading into the same folder, so only one of them cleans up
+    leftover_media = find_leftover_media() if PRIMARY_PROCESS else []
+    if leftover_media:
+        log(f'Removing {len(leftover_media)} previously downloaded media file(s)...')
+        run_in_background(remove_files, leftover_media)
+
+    if LOOP_LAG_THRESHOLD > 0:
+        loop_watchdog.start()
+
+    if METRICS_ADDRESS is not None:
+        host, _, port = METRICS_ADDRESS.rpartition(':')
+        # Every process on a host reads the same config, so each one moves over by its first shard
+        port = int(port) + (SHARD_IDS[0] if SHARD_IDS else 0)
+        try:
+            metrics_runner = await metrics.serve(host, port)
+        except OSError as e:
+            log(f'{plt.warn}Couldn\'t serve metrics on {host}:{port}: {e}')
+
+    # Workers take a moment to import everything, so get that out of the way before anyone queues something
+    if worker_pool is not None:
+        run_in_background(worker_pool.start)
+
+    if queue_store is not None:
+        # Restoring only has to replay what was journaled since
+        queue_store.compact()
+        background_tasks.add(asyncio.create_task(keep_queues()))
+
+    if settings.current().config_watch_interval > 0:
+        watch_task = asyncio.create_task(watch_config(settings.current().config_watch_interval))
+        background_tasks.add(watch_task)
 
     bot_task = asyncio.create_task(bot_thread())
+    # Started by launcher.py, which keeps stdin for its own console
+    if sharding.options.no_console:
+        console_task = None
+        await bot_task
+        return
     console_task = asyncio.create_task(console())
     await asyncio.gather(bot_task, console_task)
 
+mark_startup('loaded')
+
 if __name__ == '__main__':
     asyncio.run(main())
@@ -1,30 +1,31 @@
 import inspect
+import multiprocessing
 import os
 import re
 import time
 from datetime import datetime
 
-import yaml
-from benedict import benedict
-
 from palette import Palette
+import settings
+import sharding
 
 plt = Palette()
 
-try:
-    os.replace('vimusbot.log', 'vimusbot-old.log')
-except FileNotFoundError:
-    pass
-
-logfile = open('vimusbot.log', 'w', encoding='utf-8')
-
-with open('config_default.yml', 'r') as f:
-    config_default = benedict(yaml.safe_load(f))
-
-with open('config.yml', 'r') as f:
-    config = benedict(yaml.safe_load(f))
-
-LOG_BLACKLIST: list = config.get('logging-options.ignore-logs-from', config_default['logging-options.ignore-logs-from'])
+# Processes started by launcher.py each get their own log, and mark their lines with the shards they run;
+# other entry points (like resolverservice.py) can set this variable to do the same
+LOG_TAG_VARIABLE = 'VIMUSBOT_LOG_TAG'
+tag = os.environ.get(LOG_TAG_VARIABLE) or sharding.log_tag()
+log_name = 'vimusbot-' + tag.replace(' ', '-') if tag else 'vimusbot'
+
+# Worker processes add to the log of the process that started them instead of starting it over
+if multiprocessing.parent_process() is None:
+    try:
+        os.replace(f'{log_name}.log', f'{log_name}-old.log')
+    except FileNotFoundError:
+        pass
+    logfile = open(f'{log_name}.log', 'w', encoding='utf-8')
+else:
+    logfile = open(f'{log_name}.log', 'a', encoding='utf-8')
 
 def newlog(msg: str='', last_logtime: int|float=time.time(), called_from: str='', verbose: bool=False):
     for frame in inspect.stack()[1:]:
@@ -34,14 +35,18 @@ def newlog(msg: str='', last_logtime: int|float=time.time(), called_from: str=''
 
     elapsed = time.time()-last_logtime
     timestamp = datetime.now().strftime('%H:%M:%S')
-    logstring = f'[{timestamp}] {plt.file[source]}[{source}]{plt.reset}{plt.func} {called_from}:{plt.reset} {msg}{plt.reset} {plt.timer} {round(elapsed,3)}s'
+    tag_text = f'[{tag}] ' if tag else ''
+    logstring = f'[{timestamp}] {tag_text}{plt.file.get(source, plt.reset)}[{source}]{plt.reset}{plt.func} {called_from}:{plt.reset} {msg}{plt.reset} {plt.timer} {round(elapsed,3)}s'
     logfile.write(plt.strip_color(logstring)+'\n')
     blacklist_exceptions = [plt.warn, plt.error]
-    if not config.get('logging-options.show-console-logs', config_default['logging-options.show-console-logs']):
+    # Read fresh each time so a reloaded config applies straight away
+    cfg = settings.current()
+    # Toggled per file, e.g. "bot-py" for bot.py
+    if not cfg.show_console_logs.get(source.replace('.', '-'), True):
         return
-    elif called_from in LOG_BLACKLIST and not any(i in logstring for i in blacklist_exceptions):
+    elif called_from in cfg.log_blacklist and not any(i in logstring for i in blacklist_exceptions):
         return
-    elif verbose and not config.get('logging-options.show-verbose-logs', config_default['logging-options.show-verbose-logs']):
+    elif verbose and not cfg.show_verbose_logs:
         return
     else:
         print(logstring)
\ No newline at end of file
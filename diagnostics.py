@@ -0,0 +1,158 @@
+import cProfile
+import gc
+import io
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from typing import Any, Iterable
+
+def resident_memory() -> int|None:
+    """Returns the process's current resident set size in bytes, or None if it can't be read on this platform"""
+    # Linux
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ('cb', wintypes.DWORD),
+                ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t),
+            ]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+
+    # macOS and other Unixes only expose the peak, which is still useful for comparing runs
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def shallow_size(obj: Any) -> int:
+    """Estimates an object's size as itself plus its attribute values, without following anything further
+
+    Good enough for comparing how much queue items, members, or messages hold on to; a full recursive
+    size would wander into the shared client state they all reference.
+    """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        values = list(vars(obj).values())
+        size += sys.getsizeof(vars(obj))
+    else:
+        values = [getattr(obj, name) for name in getattr(type(obj), '__slots__', ()) if hasattr(obj, name)]
+    for value in values:
+        if isinstance(value, (str, bytes, int, float)):
+            size += sys.getsizeof(value)
+    return size
+
+def total_size(objects: Iterable[Any]) -> int:
+    return sum(shallow_size(obj) for obj in objects)
+
+def format_bytes(size: int|float) -> str:
+    for unit in ['B', 'KiB', 'MiB']:
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
+    return f'{size:.1f} GiB'
+
+def count_instances(*types: type) -> dict[str, int]:
+    """Counts the live objects of each given type (subclasses included) that the garbage collector knows about"""
+    counts = {t.__name__: 0 for t in types}
+    for obj in gc.get_objects():
+        for t in types:
+            if isinstance(obj, t):
+                counts[t.__name__] += 1
+    return counts
+
+class Profiler:
+    """Profiles everything that runs on the thread it was started from (for the bot, the event loop) until it's stopped
+
+    - `folder` (str): Where finished profiles are saved, as `.prof` files that `pstats` or `snakeviz` can read
+    """
+    def __init__(self, folder: str='profiles'):
+        self.folder = folder
+        self.started_at: float|None = None
+        self._profile: cProfile.Profile|None = None
+
+    @property
+    def running(self) -> bool:
+        return self._profile is not None
+
+    def start(self):
+        if self._profile is not None:
+            return
+        self._profile = cProfile.Profile()
+        self.started_at = time.time()
+        self._profile.enable()
+
+    def stop(self, lines: int=15) -> tuple[str, str]:
+        """Stops profiling and saves the profile; returns where it was saved, and its slowest functions by cumulative time"""
+        profile, self._profile = self._profile, None
+        if profile is None:
+            raise RuntimeError('No profile is running.')
+        profile.disable()
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f'profile-{time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started_at))}.prof')
+        profile.dump_stats(path)
+
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).strip_dirs().sort_stats('cumulative').print_stats(lines)
+        return path, summary.getvalue()
+
+class MemorySnapshots:
+    """Takes tracemalloc snapshots, each compared against the one before it
+
+    Tracing is only switched on by the first snapshot, since it slows down every allocation while it's on.
+    """
+    def __init__(self, frames: int=5):
+        self.frames = frames
+        self.last: tracemalloc.Snapshot|None = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def take(self, lines: int=10) -> list[tracemalloc.StatisticDiff]|None:
+        """Takes a snapshot and returns the biggest changes since the last one, or None if this is the first one"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.last = None
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            # Leaves out the memory used by tracemalloc's own bookkeeping
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+        previous, self.last = self.last, snapshot
+        if previous is None:
+            return None
+        return snapshot.compare_to(previous, 'lineno')[:lines]
+
+    def traced(self) -> tuple[int, int]:
+        """Returns the memory currently traced and its peak, in bytes"""
+        return tracemalloc.get_traced_memory()
+
+    def stop(self):
+        tracemalloc.stop()
+        self.last = None
@@ -0,0 +1,144 @@
+"""Runs the bot as several processes, each with its own range of shards
+
+Shard settings are read from the `sharding` section of config.yml. To run across several hosts, give every host
+the same `shard-count` and a different `shard-range`, then start this on each of them.
+"""
+import asyncio
+import subprocess
+import sys
+import time
+
+import aioconsole
+import colorama
+
+# Local files
+import customlog
+import settings
+import sharding
+from palette import Palette
+
+colorama.init(autoreset=True)
+plt = Palette()
+
+last_logtime = time.time()
+
+def log(msg: str, verbose=False):
+    global last_logtime
+    customlog.newlog(msg=msg, last_logtime=last_logtime,
+                     called_from=sys._getframe().f_back.f_code.co_name, verbose=verbose)
+    last_logtime = time.time()
+
+# Crashed processes are restarted after this many seconds, doubling each time up to RESTART_DELAY_MAX...
+RESTART_DELAY = 5.0
+RESTART_DELAY_MAX = 120.0
+# ...and the delay starts over once a process has stayed up this long
+STABLE_AFTER = 300.0
+# How long a process gets to exit after being told to stop before it's killed
+STOP_TIMEOUT = 10.0
+
+class Cluster:
+    """One bot.py process and the shards it runs"""
+    def __init__(self, shard_ids: list[int], shard_count: int):
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.shards = sharding.format_range(shard_ids)
+        self.process: asyncio.subprocess.Process|None = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.stopping = False
+
+    async def run(self):
+        """Starts the process, and starts it again whenever it exits with an error"""
+        delay = RESTART_DELAY
+        while not self.stopping:
+            log(f'Starting process for shards {self.shards}...')
+            self.started_at = time.time()
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, 'bot.py', '--shards', self.shards, '--shard-count', str(self.shard_count), '--no-console',
+                stdin=subprocess.DEVNULL)
+            code = await self.process.wait()
+            if self.stopping or code == 0:
+                log(f'Process for shards {self.shards} has exited.')
+                return
+
+            if time.time() - self.started_at > STABLE_AFTER:
+                delay = RESTART_DELAY
+            log(f'{plt.warn}Process for shards {self.shards} exited with code {code}; restarting in {delay}s...')
+            await asyncio.sleep(delay)
+            delay = min(delay*2, RESTART_DELAY_MAX)
+            self.restarts += 1
+
+    async def stop(self):
+        self.stopping = True
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), STOP_TIMEOUT)
+        except TimeoutError:
+            log(f'{plt.warn}Process for shards {self.shards} didn\'t stop in time; killing it.')
+            self.process.kill()
+            await self.process.wait()
+
+    @property
+    def state(self) -> str:
+        if self.process is None:
+            return 'starting'
+        elif self.process.returncode is None:
+            return f'{plt.green}running{plt.reset} (PID {self.process.pid}, up {round(time.time() - self.started_at)}s)'
+        elif self.stopping or self.process.returncode == 0:
+            return 'stopped'
+        return f'{plt.red}restarting{plt.reset} (exited with {self.process.returncode})'
+
+def plan_clusters(cfg: settings.Config) -> list[Cluster]:
+    """Works out which shards this host runs, and splits them between `sharding.processes` clusters"""
+    shard_count = cfg.shard_count
+    if shard_count == 0:
+        with open(cfg.token_file, 'r') as f:
+            token = f.read().strip()
+        shard_count = sharding.recommended_shard_count(token)
+        log(f'Discord recommends {shard_count} shard(s).')
+
+    shard_ids = sharding.parse_range(cfg.shard_range) or list(range(shard_count))
+    if shard_ids[-1] >= shard_count:
+        raise ValueError(f'Shard range "{cfg.shard_range}" goes past the shard count ({shard_count}).')
+    return [Cluster(group, shard_count) for group in sharding.split(shard_ids, cfg.shard_processes)]
+
+async def console(clusters: list[Cluster]):
+    log('Console is active; use "shards" to see every process, or "stop" to stop them all.')
+    while True:
+        try:
+            user_input: str = (await aioconsole.ainput('')).lower().strip()
+        except EOFError:
+            # Nothing to read from, e.g. when run as a service; keep the processes going regardless
+            log('No console input available; stop the launcher to stop every process.', verbose=True)
+            await asyncio.Future()
+        match user_input:
+            case '':
+                continue
+            case 'shards':
+                for cluster in clusters:
+                    print(f'{plt.blue}{cluster.shards}{plt.reset} | {cluster.state} | restarts: {cluster.restarts}')
+            case 'stop':
+                log('Stopping every process...')
+                await asyncio.gather(*(cluster.stop() for cluster in clusters))
+                return
+            case _:
+                log(f'Unrecognized command "{user_input}"')
+
+async def main():
+    cfg = settings.current()
+    clusters = plan_clusters(cfg)
+    log(f'Running shards {sharding.format_range([i for c in clusters for i in c.shard_ids])} of {clusters[0].shard_count} '+
+        f'in {len(clusters)} process(es).')
+
+    runners = asyncio.gather(*(cluster.run() for cluster in clusters))
+    console_task = asyncio.create_task(console(clusters))
+    try:
+        await asyncio.wait([runners, console_task], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        console_task.cancel()
+        await asyncio.gather(*(cluster.stop() for cluster in clusters))
+
+if __name__ == '__main__':
+    asyncio.run(main())
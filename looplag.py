@@ -0,0 +1,126 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+
+# Local files
+import customlog
+from palette import Palette
+
+plt = Palette()
+
+last_logtime = time.time()
+
+def log(msg: str, verbose=False):
+    global last_logtime
+    customlog.newlog(msg=msg, last_logtime=last_logtime,
+                     called_from=sys._getframe().f_back.f_code.co_name, verbose=verbose)
+    last_logtime = time.time()
+
+# Frames from files in this folder are what a stall gets blamed on, rather than whatever library call it was stuck in
+_here = os.path.dirname(os.path.abspath(__file__))
+
+class Blocker:
+    """A call site that has held up the event loop, and how often and for how long"""
+    def __init__(self, site: str, stack: list[str]):
+        self.site = site
+        self.stack = stack
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+
+    def record(self, lag: float, stack: list[str]):
+        self.count += 1
+        self.total += lag
+        if lag > self.longest:
+            self.longest = lag
+            self.stack = stack
+
+def blame(frame) -> tuple[str, list[str]]:
+    """Returns the innermost call site in this folder's files from a stack, and a short form of the whole stack"""
+    summary = traceback.extract_stack(frame)
+    stack = [f'{os.path.basename(entry.filename)}:{entry.lineno} in {entry.name}' for entry in summary]
+    for entry in reversed(summary):
+        if os.path.dirname(os.path.abspath(entry.filename)) == _here and os.path.abspath(entry.filename) != os.path.abspath(__file__):
+            # Naming the library call too makes it much easier to tell what was slow
+            innermost = summary[-1]
+            site = f'{os.path.basename(entry.filename)}:{entry.lineno} in {entry.name}'
+            if innermost is not entry:
+                site += f' -> {os.path.basename(innermost.filename)}:{innermost.lineno} in {innermost.name}'
+            return site, stack
+    return stack[-1] if stack else 'unknown', stack
+
+class LoopWatchdog:
+    """Measures how late a heartbeat task wakes up, and finds out what was blocking the event loop when it's late
+
+    A helper thread watches the heartbeat; once it's `threshold` seconds overdue, the loop thread's stack is captured
+    while it's still stuck, and the stall is counted against that call site once the loop gets going again.
+
+    - `threshold` (float): Seconds of lag that count as a stall; 0 turns the watchdog off
+    - `interval` (float): Seconds between heartbeats
+    """
+    def __init__(self, threshold: float=0.25, interval: float=0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self.blockers: dict[str, Blocker] = {}
+        self.stalls = 0
+        self.worst_lag = 0.0
+        self.last_lag = 0.0
+        self._last_beat = time.monotonic()
+        self._captured: tuple[str, list[str]]|None = None
+        self._loop_thread: int|None = None
+        self._task: asyncio.Task|None = None
+
+    def start(self):
+        """Starts watching the running event loop"""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name='loop-watchdog', daemon=True).start()
+
+    async def _heartbeat(self):
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - self._last_beat - self.interval
+            self.last_lag = lag
+            self.worst_lag = max(self.worst_lag, lag)
+            captured, self._captured = self._captured, None
+            if self.threshold > 0 and lag >= self.threshold:
+                self._record(lag, captured)
+
+    def _watch(self):
+        beat = None
+        while True:
+            time.sleep(min(self.interval, self.threshold or self.interval) / 2)
+            if self.threshold <= 0:
+                continue
+            overdue = time.monotonic() - self._last_beat - self.interval
+            # Only one capture per stall, taken as soon as it's clearly a stall, while the culprit is still running
+            if overdue >= self.threshold and beat != self._last_beat:
+                beat = self._last_beat
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self._captured = blame(frame)
+
+    def _record(self, lag: float, captured: tuple[str, list[str]]|None):
+        self.stalls += 1
+        # Stalls shorter than the helper thread's polling can end before it gets a look
+        site, stack = captured if captured is not None else ('unknown (ended before it could be captured)', [])
+        if site not in self.blockers:
+            self.blockers[site] = Blocker(site, stack)
+        self.blockers[site].record(lag, stack)
+        log(f'{plt.warn}The event loop was blocked for {round(lag, 3)}s by {site}', verbose=lag < self.threshold*4)
+
+    def top(self, count: int=10) -> list[Blocker]:
+        """The call sites that have blocked the loop for the longest in total"""
+        return sorted(self.blockers.values(), key=lambda blocker: blocker.total, reverse=True)[:count]
+
+    def reset(self):
+        self.blockers.clear()
+        self.stalls = 0
+        self.worst_lag = 0.0
@@ -0,0 +1,165 @@
+"""Measures how loud each track is once, in the background, so every track can play at the same level
+
+Measurements (integrated loudness and true peak, from FFmpeg's `loudnorm` filter) are stored by track in
+`STORE_FILE`, and turned into a fixed gain for a single `volume` filter whenever that track plays. A track that
+hasn't been measured yet gets a cheap dynamic filter instead, which needs nothing worked out beforehand.
+"""
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# Local files
+import customlog
+
+last_logtime = time.time()
+
+def log(msg: str, verbose=False):
+    global last_logtime
+    customlog.newlog(msg=msg, last_logtime=last_logtime,
+                     called_from=sys._getframe().f_back.f_code.co_name, verbose=verbose)
+    last_logtime = time.time()
+
+STORE_FILE = 'loudness.json'
+# Oldest measurements are forgotten past this many
+STORE_SIZE = 10000
+# Seconds one measurement can take before it's given up on
+TIMEOUT = 120.0
+# Quiet tracks aren't brought up by more than this many dB, and no track's peaks are brought above PEAK_CEILING dBTP
+MAX_GAIN = 12.0
+PEAK_CEILING = -1.0
+# Evens out the level over a few seconds as it plays; used until a track has been measured
+FALLBACK_FILTER = 'dynaudnorm=f=250:g=7:m=10'
+
+@dataclass(frozen=True)
+class Measurement:
+    # In LUFS; None for a silent track
+    integrated: float|None
+    # In dBTP
+    true_peak: float|None
+
+    def gain(self, target: float) -> float:
+        """dB to bring this track to `target` LUFS by, without its peaks clipping"""
+        if self.integrated is None:
+            return 0.0
+        gain = min(target - self.integrated, MAX_GAIN)
+        if self.true_peak is not None:
+            gain = min(gain, PEAK_CEILING - self.true_peak)
+        return gain
+
+def parse_loudnorm(output: str) -> Measurement|None:
+    """Reads the JSON summary `loudnorm` prints at the end of its output"""
+    start, end = output.rfind('{'), output.rfind('}')
+    if start == -1 or end < start:
+        return None
+    try:
+        summary = json.loads(output[start:end+1])
+        integrated, true_peak = float(summary['input_i']), float(summary['input_tp'])
+    except (json.JSONDecodeError, KeyError, ValueError):
+        return None
+    return Measurement(integrated if math.isfinite(integrated) else None, true_peak if math.isfinite(true_peak) else None)
+
+async def measure(filename: str, timeout: float=TIMEOUT) -> Measurement|None:
+    """Runs a file through `loudnorm` without writing anything out; returns None if that didn't work"""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-hide_banner', '-nostats', '-threads', '1', '-i', filename,
+            '-vn', '-af', 'loudnorm=print_format=json', '-f', 'null', '-',
+            stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    except FileNotFoundError:
+        log('ffmpeg was not found; make sure FFmpeg is installed and on PATH.')
+        return None
+    try:
+        _, output = await asyncio.wait_for(process.communicate(), timeout)
+    except TimeoutError:
+        process.kill()
+        await process.wait()
+        log(f'Measuring {filename} took more than {timeout}s; giving up.', verbose=True)
+        return None
+    if process.returncode != 0:
+        return None
+    return parse_loudnorm(output.decode(errors='replace'))
+
+class LoudnessStore:
+    """Measurements by track, kept in a JSON file so they outlast restarts"""
+    def __init__(self, path: str=STORE_FILE):
+        self.path = path
+        self.measurements: OrderedDict[str, Measurement] = OrderedDict()
+        try:
+            with open(path, 'r') as f:
+                for key, values in json.load(f).items():
+                    self.measurements[key] = Measurement(values.get('integrated'), values.get('true_peak'))
+        except FileNotFoundError:
+            pass
+        except (OSError, json.JSONDecodeError, AttributeError) as e:
+            log(f'Couldn\'t read {path}, starting without any measurements: {e}')
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.measurements
+
+    def __len__(self) -> int:
+        return len(self.measurements)
+
+    def get(self, key: str) -> Measurement|None:
+        return self.measurements.get(key)
+
+    def set(self, key: str, measurement: Measurement):
+        self.measurements[key] = measurement
+        self.measurements.move_to_end(key)
+        while len(self.measurements) > STORE_SIZE:
+            self.measurements.popitem(last=False)
+
+    def save(self):
+        contents = {key: {'integrated': m.integrated, 'true_peak': m.true_peak} for key, m in self.measurements.items()}
+        # Written to a separate file first, so stopping the bot partway through can't leave it half-written
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(contents, f)
+        os.replace(self.path + '.tmp', self.path)
+
+class Analyzer:
+    """Measures files one at a time in the background, in the order they were downloaded"""
+    def __init__(self, store: LoudnessStore, timeout: float=TIMEOUT):
+        self.store = store
+        self.timeout = timeout
+        self._pending: dict[str, str] = {}
+        self._task: asyncio.Task|None = None
+
+    def submit(self, key: str, filename: str):
+        """Queues a downloaded file to be measured, unless its track has been already"""
+        if key in self.store or key in self._pending:
+            return
+        self._pending[key] = filename
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            key, filename = next(iter(self._pending.items()))
+            try:
+                # Played files are deleted, so one that was skipped straight away may already be gone
+                measurement = await measure(filename, self.timeout) if os.path.isfile(filename) else None
+            finally:
+                del self._pending[key]
+            if measurement is None:
+                continue
+            self.store.set(key, measurement)
+            try:
+                await asyncio.to_thread(self.store.save)
+            except OSError as e:
+                log(f'Couldn\'t save {self.store.path}: {e}')
+            log(f'Measured {key} at {measurement.integrated} LUFS.', verbose=True)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def audio_filter(self, key: str, target: float) -> str:
+        """The FFmpeg filter that brings a track to `target` LUFS"""
+        measurement = self.store.get(key)
+        if measurement is None:
+            return FALLBACK_FILTER
+        return f'volume={measurement.gain(target):.2f}dB'
@@ -0,0 +1,178 @@
+import asyncio
+import sys
+import time
+from collections import deque
+
+import discord
+
+# Local files
+import customlog
+
+last_logtime = time.time()
+
+def log(msg: str, verbose=False):
+    global last_logtime
+    customlog.newlog(msg=msg, last_logtime=last_logtime,
+                     called_from=sys._getframe().f_back.f_code.co_name, verbose=verbose)
+    last_logtime = time.time()
+
+# Discord doesn't publish exact numbers, but message sends, edits and deletes in one channel
+# start getting rate limited at around 5 every 5 seconds
+CHANNEL_WINDOW = 5.0
+CHANNEL_LIMIT = 5
+# Deletes wait until at least this many calls are free, so they never hold up an edit or send...
+DELETE_RESERVE = 2
+# ...but go through anyway once they've waited this long
+DELETE_MAX_DELAY = 30.0
+
+class ChannelBudget:
+    """Estimates how close a channel is to being rate limited from the calls made in it recently"""
+    def __init__(self):
+        self.calls: deque[float] = deque()
+        self.pending_deletes: deque[tuple[discord.Message, float]] = deque()
+        self.delete_task: asyncio.Task|None = None
+        self.total_calls = 0
+        self.coalesced = 0
+
+    def _trim(self):
+        cutoff = time.monotonic() - CHANNEL_WINDOW
+        while self.calls and self.calls[0] <= cutoff:
+            self.calls.popleft()
+
+    @property
+    def headroom(self) -> int:
+        """Calls that can still be made in this window before hitting the estimated limit"""
+        self._trim()
+        return max(CHANNEL_LIMIT - len(self.calls), 0)
+
+    def record(self):
+        self.calls.append(time.monotonic())
+        self.total_calls += 1
+
+    def wait_time(self, reserve: int=0) -> float:
+        """Seconds until there's more than `reserve` headroom"""
+        self._trim()
+        over = len(self.calls) - (CHANNEL_LIMIT - 1 - reserve)
+        if over <= 0:
+            return 0.0
+        return self.calls[over - 1] + CHANNEL_WINDOW - time.monotonic()
+
+class StatusMessage:
+    """A single message showing the latest status of a request
+
+    Updates are debounced: the first one after a quiet period is sent straight away, and any made
+    within `edit_interval` of it are coalesced so only the newest is sent. Edits also wait for the channel's
+    estimated headroom, so a burst of updates becomes one edit instead of several rate-limited ones.
+    """
+    def __init__(self, manager: 'MessageManager', message: discord.Message):
+        self.manager = manager
+        self.message = message
+        self.deleted = False
+        self._pending: discord.Embed|None = None
+        self._flusher: asyncio.Task|None = None
+        self._last_edit = 0.0
+
+    def update(self, embed: discord.Embed):
+        """Replaces the message's embed, as soon as the edit interval and rate limits allow"""
+        if self.deleted:
+            return
+        if self._pending is not None:
+            self.manager.budget(self.message.channel.id).coalesced += 1
+        self._pending = embed
+        if self._flusher is None or self._flusher.done():
+            self._flusher = self.manager.create_task(self._flush())
+
+    async def _flush(self):
+        budget = self.manager.budget(self.message.channel.id)
+        while self._pending is not None and not self.deleted:
+            # Newer updates can come in while waiting, so check again after sleeping instead of sending right away
+            delay = max(self._last_edit + self.manager.edit_interval - time.monotonic(), budget.wait_time())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            embed, self._pending = self._pending, None
+            budget.record()
+            self._last_edit = time.monotonic()
+            try:
+                await self.message.edit(embed=embed)
+            except discord.HTTPException as e:
+                log(f'Failed to edit status message: {e}', verbose=True)
+                return
+
+    def delete(self):
+        """Drops any update that hasn't been sent yet, and deletes the message at low priority"""
+        if self.deleted:
+            return
+        self.deleted = True
+        self._pending = None
+        self.manager.delete_later(self.message)
+
+class MessageManager:
+    """Sends status messages and deletes in a way that stays under each channel's rate limits
+
+    Sends made anywhere else should be reported with `record()` so the estimates include them.
+    """
+    def __init__(self, edit_interval: float=1.0):
+        self.edit_interval = edit_interval
+        self.channels: dict[int, ChannelBudget] = {}
+        # Strong references, so running flushes and deletes aren't garbage collected
+        self._tasks: set[asyncio.Task] = set()
+
+    def budget(self, channel_id: int) -> ChannelBudget:
+        if channel_id not in self.channels:
+            self.channels[channel_id] = ChannelBudget()
+        return self.channels[channel_id]
+
+    def record(self, channel_id: int):
+        """Counts a call made in a channel outside of the manager"""
+        self.budget(channel_id).record()
+
+    def create_task(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def status(self, destination: discord.abc.Messageable, embed: discord.Embed) -> StatusMessage:
+        """Sends a new status message; the send itself isn't debounced, since something should show up right away"""
+        return StatusMessage(self, await destination.send(embed=embed))
+
+    def delete_later(self, message: discord.Message|None):
+        """Deletes a message once the channel has room to spare, or after `DELETE_MAX_DELAY` seconds at most"""
+        if message is None:
+            return
+        budget = self.budget(message.channel.id)
+        if any(queued.id == message.id for queued, _ in budget.pending_deletes):
+            return
+        budget.pending_deletes.append((message, time.monotonic()))
+        if budget.delete_task is None or budget.delete_task.done():
+            budget.delete_task = self.create_task(self._run_deletes(budget))
+
+    async def _run_deletes(self, budget: ChannelBudget):
+        while budget.pending_deletes:
+            message, queued_at = budget.pending_deletes[0]
+            delay = min(budget.wait_time(DELETE_RESERVE), queued_at + DELETE_MAX_DELAY - time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            budget.pending_deletes.popleft()
+            budget.record()
+            try:
+                await message.delete()
+            except discord.NotFound:
+                pass
+            except discord.HTTPException as e:
+                log(f'Failed to delete message: {e}', verbose=True)
+
+    def stats(self) -> dict[int, dict[str, int]]:
+        """Returns the estimated headroom and pending work of every channel used since startup"""
+        return {
+            channel_id: {
+                'headroom': budget.headroom,
+                'recent_calls': len(budget.calls),
+                'pending_deletes': len(budget.pending_deletes),
+                'total_calls': budget.total_calls,
+                'coalesced': budget.coalesced,
+            }
+            for channel_id, budget in self.channels.items()
+        }
@@ -0,0 +1,217 @@
+"""Counters, gauges and histograms for the bot's own numbers, served in Prometheus' text format
+
+Metrics are created from `registry`, where they're defined, and can be updated from any thread:
+
+    commands_run = metrics.registry.counter('vimusbot_commands_total', 'Commands run', ['command'])
+    commands_run.inc(command='play')
+"""
+import math
+import sys
+import threading
+import time
+from typing import Callable
+
+# Local files
+import customlog
+
+last_logtime = time.time()
+
+def log(msg: str, verbose=False):
+    global last_logtime
+    customlog.newlog(msg=msg, last_logtime=last_logtime,
+                     called_from=sys._getframe().f_back.f_code.co_name, verbose=verbose)
+    last_logtime = time.time()
+
+# Upper bounds, in seconds, for histograms that don't give their own
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (f'{name}="{str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')}"' for name, value in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, description: str, labels: list[str]|None=None):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels or ())
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} takes the labels {self.labels}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        """Every (name, labels, value) line this metric currently has"""
+        raise NotImplementedError
+
+class Counter(Metric):
+    """A number that only goes up, like commands run or bytes downloaded"""
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str, labels: list[str]|None=None):
+        super().__init__(name, description, labels)
+        # Without labels there's only one value, so it can show as 0 from the start instead of being missing
+        self._values: dict[tuple[str, ...], float] = {} if self.labels else {(): 0}
+
+    def inc(self, amount: float=1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(zip(self.labels, key)), value) for key, value in self._values.items()]
+
+class Gauge(Metric):
+    """A number that goes up and down, like connected voice clients
+
+    Gauges given a `function` work it out whenever they're read instead of being set; it returns either
+    a single number, or a dictionary of numbers keyed by label value tuples.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, description: str, labels: list[str]|None=None,
+        function: Callable[[], float|dict[tuple[str, ...], float]]|None=None):
+        super().__init__(name, description, labels)
+        self.function = function
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.function is not None:
+            values = self.function()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [(self.name, dict(zip(self.labels, key)), value) for key, value in values.items()]
+
+class Histogram(Metric):
+    """Counts observations (like how long something took) into buckets, along with their total and count"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: list[str]|None=None, buckets: tuple[float, ...]=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: dict[tuple[str, ...], list[int]] = {}
+        self._sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0]*len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sums[key] = self._sums.get(key, 0) + value
+
+    def time(self, **labels: str) -> 'Timer':
+        """Observes how long a `with` block takes"""
+        return Timer(self, labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, counts in self._counts.items():
+                labels = dict(zip(self.labels, key))
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f'{self.name}_bucket', labels | {'le': format_value(bound)}, count))
+                samples.append((f'{self.name}_sum', labels, self._sums[key]))
+                samples.append((f'{self.name}_count', labels, counts[-1]))
+        return samples
+
+class Timer:
+    def __init__(self, histogram: Histogram, labels: dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class Registry:
+    """Every metric this process reports
+
+    - `constant_labels` (dict): Added to every line, e.g. to tell apart processes running different shards
+    """
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+        self.constant_labels: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                # Modules can be imported twice (e.g. as __main__ and by name), so the same definition is allowed
+                if type(existing) is not type(metric) or existing.labels != metric.labels:
+                    raise ValueError(f'A different metric named {metric.name} already exists')
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, description: str, labels: list[str]|None=None) -> Counter:
+        return self._add(Counter(name, description, labels))
+
+    def gauge(self, name: str, description: str, labels: list[str]|None=None,
+        function: Callable[[], float|dict[tuple[str, ...], float]]|None=None) -> Gauge:
+        return self._add(Gauge(name, description, labels, function))
+
+    def histogram(self, name: str, description: str, labels: list[str]|None=None,
+        buckets: tuple[float, ...]=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, description, labels, buckets))
+
+    def render(self) -> str:
+        """Every metric in Prometheus' text exposition format"""
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # One broken gauge function shouldn't take the whole page down with it
+                log(f'Couldn\'t read {metric.name}: {e}', verbose=True)
+                continue
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in samples:
+                lines.append(f'{name}{format_labels(self.constant_labels | labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+async def serve(host: str, port: int, registry: Registry=registry):
+    """Serves `registry` at http://host:port/metrics; returns an `aiohttp.web.AppRunner` that stops it when cleaned up"""
+    # Only needed by the process serving the endpoint, not by everything that records metrics (like worker processes)
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log(f'Serving metrics at http://{host}:{port}/metrics')
+    return runner
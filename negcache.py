@@ -0,0 +1,138 @@
+"""Remembers failed lookups for a while, so the same broken link or hopeless search isn't looked up from scratch
+every time someone asks for it again
+
+How long a failure is remembered depends on what kind it was: a removed or private video won't come back, while a
+network error could be gone by the next try, so those are only remembered long enough to absorb repeated requests.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+# Local files
+import customlog
+import metrics
+
+last_logtime = time.time()
+
+def log(msg: str, verbose=False):
+    global last_logtime
+    customlog.newlog(msg=msg, last_logtime=last_logtime,
+                     called_from=sys._getframe().f_back.f_code.co_name, verbose=verbose)
+    last_logtime = time.time()
+
+# Kinds of failure
+# Removed, private, or invalid; it won't start working again
+PERMANENT = 'permanent'
+# Blocked in this country, age restricted, or members-only; could change, but rarely does
+RESTRICTED = 'restricted'
+# Nothing (or nothing definite) was found for a search or Spotify track
+NO_MATCH = 'no-match'
+# Network errors, timeouts, and rate limits
+TRANSIENT = 'transient'
+
+# However long it's configured to be, a transient failure is never remembered for longer than this many seconds
+MAX_TRANSIENT_TTL = 60.0
+CACHE_SIZE = 5000
+
+# Lowercase pieces of error messages, checked in this order; anything unrecognised counts as transient
+MESSAGE_KINDS = [
+    (RESTRICTED, ('not available in your country', 'geo restrict', 'geo-restrict', 'sign in to confirm your age',
+        'age-restricted', 'members-only', 'join this channel', 'premium')),
+    (PERMANENT, ('private video', 'video unavailable', 'has been removed', 'unsupported url', 'is not a valid url',
+        'does not exist', 'not found', 'http error 404', 'http error 410', 'invalid id', 'no video formats')),
+]
+
+negative_cache_hits = metrics.registry.counter('vimusbot_negative_cache_hits_total',
+    'Lookups answered by the negative cache instead of being run again', ['kind'])
+
+def classify(error: BaseException) -> str:
+    """Which kind of failure an error stands for"""
+    status = getattr(error, 'http_status', None)
+    if status in (400, 404):
+        # From spotipy, for a link to something that doesn't exist
+        return PERMANENT
+    message = str(error).lower()
+    for kind, pieces in MESSAGE_KINDS:
+        if any(piece in message for piece in pieces):
+            return kind
+    return TRANSIENT
+
+def failure_of(operation: str, result: Any) -> tuple[str, BaseException|None]|None:
+    """For lookups that return their failures instead of raising them: what kind of failure a result is, and its error,
+    or None if it's a success"""
+    if isinstance(result, tuple) and len(result) == 2:
+        if isinstance(result[0], str) and result[0] == 'unsure':
+            # spyt() found nothing definite
+            return NO_MATCH, None
+        if result[0] is None and isinstance(result[1], BaseException):
+            # The (None, error) returned by the Spotify functions and duration_from_url()/title_from_url()
+            return classify(result[1]), result[1]
+        if result == (None, None) and operation == 'search_ytmusic_text':
+            return NO_MATCH, None
+    if result is None and operation == 'search_ytmusic_album':
+        return NO_MATCH, None
+    return None
+
+@dataclass(frozen=True)
+class Failure:
+    kind: str
+    expires: float
+    # Either the error it raised, or the result it returned
+    error: BaseException|None
+    result: Any
+
+class NegativeCache:
+    """Failed lookups by operation and arguments, each kept for as long as its kind of failure is configured for
+
+    - `ttls` (dict): Seconds to remember each kind of failure for; a kind that's missing or 0 isn't remembered
+    """
+    def __init__(self, ttls: dict[str, float]):
+        self.ttls = ttls
+        self.failures: OrderedDict[tuple, Failure] = OrderedDict()
+        # Lookups are run from the resolution scheduler's threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(operation: str, args: tuple, kwargs: dict) -> tuple|None:
+        key = (operation, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # Lists (like a playlist of Spotify tracks) aren't worth remembering anyway
+            return None
+        return key
+
+    def ttl(self, kind: str) -> float:
+        ttl = self.ttls.get(kind, 0)
+        return min(ttl, MAX_TRANSIENT_TTL) if kind == TRANSIENT else ttl
+
+    def get(self, key: tuple|None) -> Failure|None:
+        if key is None:
+            return None
+        with self._lock:
+            failure = self.failures.get(key)
+            if failure is None:
+                return None
+            if failure.expires <= time.monotonic():
+                del self.failures[key]
+                return None
+        negative_cache_hits.inc(kind=failure.kind)
+        return failure
+
+    def remember(self, key: tuple|None, kind: str, error: BaseException|None=None, result: Any=None):
+        ttl = self.ttl(kind)
+        if key is None or ttl <= 0:
+            return
+        with self._lock:
+            self.failures[key] = Failure(kind, time.monotonic() + ttl, error, result)
+            self.failures.move_to_end(key)
+            while len(self.failures) > CACHE_SIZE:
+                self.failures.popitem(last=False)
+        log(f'{key[0]}{key[1]} failed ({kind}); remembering that for {ttl}s.', verbose=True)
+
+    def clear(self):
+        with self._lock:
+            self.failures.clear()
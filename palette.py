@@ -1,20 +1,14 @@
 import colorama
-import yaml
-from benedict import benedict
 from colorama import Back, Fore, Style
 
-colorama.init(autoreset=True)
-
-with open('config_default.yml', 'r') as f:
-    config_default = benedict(yaml.safe_load(f))
+import settings
 
-with open('config.yml', 'r') as f:
-    config = benedict(yaml.safe_load(f))
+colorama.init(autoreset=True)
 
-NO_COLOR: bool = config.get('logging-options.colors.no-color', config_default['logging-options.colors.no-color'])
+NO_COLOR: bool = settings.current().no_color
 
 def get_color_config(key: str):
-    return config.get(f'logging-options.colors.{key}', config_default[f'logging-options.colors.{key}'])
+    return settings.current().colors[key]
 
 class Palette:
     def __init__(self):
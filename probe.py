@@ -0,0 +1,247 @@
+"""Finds the duration and title of direct links to audio files, without downloading them or blocking the event loop
+
+MP3 and Ogg (Vorbis or Opus) files are read with HTTP range requests for just their first and last few kilobytes;
+anything else, or anything those can't make sense of, is handed to `ffprobe`, run as an async subprocess.
+Results are cached by URL along with the file's ETag or Last-Modified header, so a changed file is probed again.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.parse
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import aiohttp
+import regex as re
+
+# Local files
+import customlog
+
+last_logtime = time.time()
+
+def log(msg: str, verbose=False):
+    global last_logtime
+    customlog.newlog(msg=msg, last_logtime=last_logtime,
+                     called_from=sys._getframe().f_back.f_code.co_name, verbose=verbose)
+    last_logtime = time.time()
+
+# Links ending in these are treated as direct links to a file rather than a page for yt-dlp to read
+DIRECT_EXTENSIONS = ('.mp3', '.ogg', '.oga', '.opus', '.flac', '.wav', '.m4a', '.aac', '.mka', '.webm', '.mp4')
+# Seconds any one probe (the HTTP requests, or ffprobe) can take before it's given up on
+TIMEOUT = 10.0
+# How much of the start and end of a file is read; enough for ID3 tags without cover art and an Ogg page
+HEADER_BYTES = 64*1024
+CACHE_SIZE = 1000
+
+@dataclass(frozen=True)
+class ProbeResult:
+    duration: float|None
+    title: str|None
+
+# By (URL, ETag or Last-Modified)
+cache: OrderedDict[tuple[str, str], ProbeResult] = OrderedDict()
+
+def is_direct_file(url: str) -> bool:
+    return urllib.parse.urlparse(url).path.lower().endswith(DIRECT_EXTENSIONS)
+
+def title_from_path(url: str) -> str:
+    """The file's name without its extension, as a fallback title"""
+    name = os.path.basename(urllib.parse.unquote(urllib.parse.urlparse(url).path))
+    return os.path.splitext(name)[0] or url
+
+# MP3
+
+MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+def syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+def id3_title(head: bytes) -> tuple[int, str|None]:
+    """Returns where the ID3v2 tag at the start of a file ends, and the title in it if there is one"""
+    if head[:3] != b'ID3' or len(head) < 10:
+        return 0, None
+    version, flags = head[3], head[5]
+    end = 10 + syncsafe(head[6:10]) + (10 if flags & 0x10 else 0)
+    if version not in (3, 4):
+        return end, None
+
+    position = 10
+    if flags & 0x40:
+        # Extended header; its size includes itself in v2.4, but not in v2.3
+        extended = syncsafe(head[10:14]) if version == 4 else int.from_bytes(head[10:14], 'big') + 4
+        position += extended
+    while position + 10 <= min(end, len(head)):
+        frame_id = head[position:position+4]
+        size = syncsafe(head[position+4:position+8]) if version == 4 else int.from_bytes(head[position+4:position+8], 'big')
+        if frame_id == b'\x00\x00\x00\x00' or size <= 0:
+            break
+        if frame_id == b'TIT2':
+            content = head[position+10:position+10+size]
+            if len(content) < size:
+                break
+            encoding = ['latin-1', 'utf-16', 'utf-16-be', 'utf-8'][content[0]] if content[0] < 4 else 'latin-1'
+            return end, content[1:].decode(encoding, errors='replace').strip('\x00').strip() or None
+        position += 10 + size
+    return end, None
+
+def parse_mp3(head: bytes, size: int|None) -> ProbeResult:
+    """Works out an MP3's duration from its Xing/VBRI header, or from its bitrate and `size` if it's constant"""
+    start, title = id3_title(head)
+    position = head.find(b'\xff', start)
+    while position != -1 and position + 4 <= len(head):
+        b1, b2, b3 = head[position+1], head[position+2], head[position+3]
+        version, layer = (b1 >> 3) & 3, (b1 >> 1) & 3
+        bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 3
+        # Only layer III (MP3) frames, and nothing that's just a stray 0xFF byte
+        if (b1 & 0xE0) == 0xE0 and version != 1 and layer == 1 and bitrate_index not in (0, 15) and rate_index != 3:
+            bitrate = MP3_BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+            sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+            samples_per_frame = 1152 if version == 3 else 576
+            mono = (b3 >> 6) == 3
+            side_info = (17 if mono else 32) if version == 3 else (9 if mono else 17)
+
+            xing = position + 4 + side_info
+            if head[xing:xing+4] in (b'Xing', b'Info') and int.from_bytes(head[xing+4:xing+8], 'big') & 1:
+                frames = int.from_bytes(head[xing+8:xing+12], 'big')
+                return ProbeResult(frames * samples_per_frame / sample_rate, title)
+            vbri = position + 4 + 32
+            if head[vbri:vbri+4] == b'VBRI':
+                frames = int.from_bytes(head[vbri+14:vbri+18], 'big')
+                return ProbeResult(frames * samples_per_frame / sample_rate, title)
+            if size is not None:
+                return ProbeResult((size - position) * 8 / bitrate, title)
+            return ProbeResult(None, title)
+        position = head.find(b'\xff', position + 1)
+    return ProbeResult(None, title)
+
+# Ogg
+
+def parse_ogg(head: bytes, tail: bytes) -> ProbeResult:
+    """Works out an Ogg Vorbis or Opus file's duration from the granule position of its last page"""
+    if head[:4] != b'OggS' or len(head) < 28:
+        return ProbeResult(None, None)
+    packet = head[27 + head[26]:]
+    if packet[:7] == b'\x01vorbis':
+        sample_rate, pre_skip = int.from_bytes(packet[12:16], 'little'), 0
+    elif packet[:8] == b'OpusHead':
+        # Opus always counts granules at 48 kHz, starting after a number of priming samples
+        sample_rate, pre_skip = 48000, int.from_bytes(packet[10:12], 'little')
+    else:
+        return ProbeResult(None, None)
+
+    title = None
+    # Vorbis comments are "KEY=value" strings, each preceded by its length
+    if match := re.search(rb'(?i)title=', head):
+        length = int.from_bytes(head[match.start()-4:match.start()], 'little')
+        if 6 < length < 1024:
+            title = head[match.end():match.start()+length].decode('utf-8', errors='replace') or None
+
+    last_page = tail.rfind(b'OggS')
+    if last_page == -1 or last_page + 14 > len(tail) or sample_rate <= 0:
+        return ProbeResult(None, title)
+    granule = int.from_bytes(tail[last_page+6:last_page+14], 'little', signed=True)
+    return ProbeResult((granule - pre_skip) / sample_rate if granule > 0 else None, title)
+
+# ffprobe
+
+async def ffprobe(target: str, timeout: float=TIMEOUT) -> ProbeResult|None:
+    """Runs ffprobe on a URL or file; returns None if it failed, took too long, or isn't installed"""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            'ffprobe', '-v', 'quiet', '-show_entries', 'format=duration:format_tags=title', '-of', 'json', target,
+            stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+    except FileNotFoundError:
+        log('ffprobe was not found; make sure FFmpeg is installed and on PATH.')
+        return None
+    try:
+        output, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except TimeoutError:
+        process.kill()
+        await process.wait()
+        log(f'ffprobe took more than {timeout}s on {target}; giving up.', verbose=True)
+        return None
+    try:
+        info = json.loads(output).get('format', {})
+    except json.JSONDecodeError:
+        return None
+    duration = info.get('duration')
+    return ProbeResult(float(duration) if duration not in (None, 'N/A') else None, info.get('tags', {}).get('title'))
+
+# HTTP
+
+async def read_range(session: aiohttp.ClientSession, url: str, byte_range: str) -> tuple[bytes, aiohttp.ClientResponse]:
+    async with session.get(url, headers={'Range': f'bytes={byte_range}'}) as response:
+        response.raise_for_status()
+        # Servers that ignore Range send the whole file, so only the start of it is read
+        return await response.content.read(HEADER_BYTES), response
+
+async def probe(url: str, timeout: float=TIMEOUT) -> ProbeResult|None:
+    """Finds a direct link's duration and title; returns None if it couldn't be reached
+
+    The duration is None if it couldn't be worked out; the title falls back on the file's name. Some servers (like
+    presigned S3 links) refuse HEAD requests, in which case everything comes from the first ranged GET instead.
+    """
+    validator = ''
+    result = None
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+            try:
+                async with session.head(url, allow_redirects=True) as response:
+                    response.raise_for_status()
+                    headers = response.headers
+            except aiohttp.ClientError as e:
+                log(f'HEAD request for {url} failed, reading it with a GET instead: {e}', verbose=True)
+                headers = None
+            if headers is not None:
+                validator = headers.get('ETag') or headers.get('Last-Modified') or ''
+                if validator and (url, validator) in cache:
+                    cache.move_to_end((url, validator))
+                    log(f'Probe of {url} is cached.', verbose=True)
+                    return cache[(url, validator)]
+
+            head, response = await read_range(session, url, f'0-{HEADER_BYTES - 1}')
+            if headers is None:
+                validator = response.headers.get('ETag') or response.headers.get('Last-Modified') or ''
+            # A partial response's Content-Length is only the length of that part
+            lengths = headers if headers is not None else response.headers if response.status == 200 else {}
+            size = int(lengths['Content-Length']) if lengths.get('Content-Length', '').isdigit() else None
+            if size is None and '/' in response.headers.get('Content-Range', ''):
+                total = response.headers['Content-Range'].rpartition('/')[2]
+                size = int(total) if total.isdigit() else None
+
+            if head[:4] == b'OggS':
+                if size is not None and size > HEADER_BYTES and response.status == 206:
+                    tail, _ = await read_range(session, url, f'-{HEADER_BYTES}')
+                else:
+                    tail = head
+                result = parse_ogg(head, tail)
+            elif head[:3] == b'ID3' or head[:1] == b'\xff':
+                result = parse_mp3(head, size)
+            else:
+                result = ProbeResult(None, None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        log(f'Couldn\'t read {url}: {e}', verbose=True)
+
+    if result is None:
+        # Still worth a try, since ffprobe makes its own requests
+        result = await ffprobe(url, timeout)
+        if result is None:
+            log(f'Couldn\'t probe {url}.', verbose=True)
+            return None
+    if result.duration is None:
+        # Any other format, or one that didn't look like it should
+        result = await ffprobe(url, timeout) or result
+    result = ProbeResult(result.duration, result.title or title_from_path(url))
+
+    # Without either header there's no telling whether the file has changed since
+    if validator:
+        cache[(url, validator)] = result
+        while len(cache) > CACHE_SIZE:
+            cache.popitem(last=False)
+    return result
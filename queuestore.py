@@ -0,0 +1,210 @@
+"""Keeps every server's queue, and what's playing, in a SQLite database so a restart carries on where it left off
+
+Each change to a queue is added to a journal as it's made. Every so often the journal is folded into a snapshot of
+each queue (`QueueStore.compact()`), and a queue is read back from its snapshot plus anything journaled since the
+first time it's needed after starting up. Entries are stored as they were queued, with their titles and durations,
+so nothing has to be looked up again to restore them.
+"""
+import json
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable
+
+# Local files
+import customlog
+
+last_logtime = time.time()
+
+def log(msg: str, verbose=False):
+    global last_logtime
+    customlog.newlog(msg=msg, last_logtime=last_logtime,
+                     called_from=sys._getframe().f_back.f_code.co_name, verbose=verbose)
+    last_logtime = time.time()
+
+QUEUE_FILE = 'queues.db'
+# The journal is folded into the snapshots once it has this many changes in it
+COMPACT_AFTER = 1000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshot (guild_id INTEGER, position INTEGER, entry TEXT, PRIMARY KEY (guild_id, position));
+CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, op TEXT, args TEXT);
+CREATE TABLE IF NOT EXISTS playing (guild_id INTEGER PRIMARY KEY, entry TEXT, position REAL,
+    voice_channel_id INTEGER, text_channel_id INTEGER, filename TEXT, info TEXT);
+'''
+
+@dataclass(frozen=True)
+class Playing:
+    """What was playing in a server, and how far into it, as of the last time it was saved"""
+    guild_id: int
+    entry: dict
+    position: float
+    voice_channel_id: int
+    text_channel_id: int
+    # The downloaded file and its info, so it can be played again without downloading it
+    filename: str|None
+    info: dict|None
+
+def apply(entries: list, op: str, args: list) -> list:
+    """Applies a journaled change to a queue's entries"""
+    if op == 'insert':
+        index, inserted = args
+        entries[index:index] = inserted
+    elif op == 'delete':
+        start, stop = args
+        del entries[start:stop]
+    elif op == 'replace':
+        start, stop, replacement = args
+        entries[start:stop] = replacement
+    elif op == 'clear':
+        entries = []
+    else:
+        raise ValueError(f'Unknown queue operation "{op}"')
+    return entries
+
+class QueueStore:
+    def __init__(self, path: str=QUEUE_FILE):
+        self.path = path
+        # Only ever used from the event loop's thread
+        self.db = sqlite3.connect(path, isolation_level=None)
+        # With a write-ahead log, each change is one quick append, and only a crash of the whole machine can lose
+        # the last few; more than one process (when sharded) can also use the same file
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        self.journaled = self.db.execute('SELECT COUNT(*) FROM journal').fetchone()[0]
+
+    def record(self, guild_id: int, op: str, *args: Any):
+        self.db.execute('INSERT INTO journal (guild_id, op, args) VALUES (?, ?, ?)', (guild_id, op, json.dumps(args)))
+        self.journaled += 1
+
+    def _replay(self, guild_id: int) -> list[dict]:
+        entries = [json.loads(entry) for entry, in
+            self.db.execute('SELECT entry FROM snapshot WHERE guild_id = ? ORDER BY position', (guild_id,))]
+        for op, args in self.db.execute('SELECT op, args FROM journal WHERE guild_id = ? ORDER BY seq', (guild_id,)):
+            entries = apply(entries, op, json.loads(args))
+        return entries
+
+    def load(self, guild_id: int) -> list[dict]:
+        """A server's queue entries, as they were after the last change made to them"""
+        return self._replay(guild_id)
+
+    def compact(self):
+        """Folds the journal into each server's snapshot"""
+        start = time.perf_counter()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            guilds = [guild_id for guild_id, in self.db.execute('SELECT DISTINCT guild_id FROM journal')]
+            for guild_id in guilds:
+                entries = self._replay(guild_id)
+                self.db.execute('DELETE FROM snapshot WHERE guild_id = ?', (guild_id,))
+                self.db.executemany('INSERT INTO snapshot (guild_id, position, entry) VALUES (?, ?, ?)',
+                    ((guild_id, position, json.dumps(entry)) for position, entry in enumerate(entries)))
+            self.db.execute('DELETE FROM journal')
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        log(f'Compacted {self.journaled} queue changes across {len(guilds)} server(s) in {round(time.perf_counter() - start, 3)}s.', verbose=True)
+        self.journaled = 0
+
+    def set_playing(self, playing: Playing):
+        self.db.execute('INSERT OR REPLACE INTO playing VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (playing.guild_id, json.dumps(playing.entry), playing.position, playing.voice_channel_id,
+            playing.text_channel_id, playing.filename, json.dumps(playing.info)))
+
+    def update_position(self, guild_id: int, position: float):
+        self.db.execute('UPDATE playing SET position = ? WHERE guild_id = ?', (position, guild_id))
+
+    def clear_playing(self, guild_id: int):
+        self.db.execute('DELETE FROM playing WHERE guild_id = ?', (guild_id,))
+
+    def playing(self) -> list[Playing]:
+        return [Playing(guild_id, json.loads(entry), position, voice_channel_id, text_channel_id, filename, json.loads(info))
+            for guild_id, entry, position, voice_channel_id, text_channel_id, filename, info
+            in self.db.execute('SELECT * FROM playing')]
+
+class JournaledList(list):
+    """A server's queue, which records every change made to it in a `QueueStore`
+
+    Entries are turned into something JSON can store with `encode`.
+    """
+    def __init__(self, entries: Iterable, store: QueueStore, guild_id: int, encode: Callable[[Any], dict]):
+        super().__init__(entries)
+        self.store = store
+        self.guild_id = guild_id
+        self.encode = encode
+
+    def _record(self, op: str, *args: Any):
+        self.store.record(self.guild_id, op, *args)
+
+    def _record_all(self, length_before: int):
+        # For changes that don't map onto a single slice, like sorting
+        self._record('replace', 0, length_before, [self.encode(entry) for entry in self])
+
+    def append(self, entry):
+        self._record('insert', len(self), [self.encode(entry)])
+        super().append(entry)
+
+    def extend(self, entries: Iterable):
+        entries = list(entries)
+        self._record('insert', len(self), [self.encode(entry) for entry in entries])
+        super().extend(entries)
+
+    def __iadd__(self, entries: Iterable):
+        self.extend(entries)
+        return self
+
+    def insert(self, index: int, entry):
+        # Same as list.insert(), which clamps out of range indexes instead of raising
+        index = slice(index, index).indices(len(self))[0]
+        self._record('insert', index, [self.encode(entry)])
+        super().insert(index, entry)
+
+    def pop(self, index: int=-1):
+        index = range(len(self))[index]
+        self._record('delete', index, index + 1)
+        return super().pop(index)
+
+    def remove(self, entry):
+        self.pop(self.index(entry))
+
+    def clear(self):
+        self._record('clear')
+        super().clear()
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, slice):
+            index = range(len(self))[key]
+            self._record('replace', index, index + 1, [self.encode(value)])
+            return super().__setitem__(index, value)
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            length = len(self)
+            super().__setitem__(key, value)
+            return self._record_all(length)
+        value = list(value)
+        self._record('replace', start, max(stop, start), [self.encode(entry) for entry in value])
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        if not isinstance(key, slice):
+            self.pop(key)
+            return
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            length = len(self)
+            super().__delitem__(key)
+            return self._record_all(length)
+        self._record('delete', start, max(stop, start))
+        super().__delitem__(key)
+
+    def sort(self, *args, **kwargs):
+        length = len(self)
+        super().sort(*args, **kwargs)
+        self._record_all(length)
+
+    def reverse(self):
+        super().reverse()
+        self._record_all(len(self))
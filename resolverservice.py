@@ -0,0 +1,255 @@
+"""Runs lookups (Spotify matching, YouTube Music searches, URL metadata) for the bot in separate processes
+
+Start this with `python resolverservice.py`, and turn on `resolver-service.enabled` in the bot's config. It can run
+on another machine too; copy resolver_key.txt over, and point the bot's `resolver-service.address` at it.
+"""
+import os
+
+if __name__ == '__main__':
+    # Read by customlog, so the service and its worker processes (which inherit this) get their own log file
+    os.environ.setdefault('VIMUSBOT_LOG_TAG', 'resolver service')
+
+import functools
+import secrets
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import AuthenticationError, Client, Connection, Listener
+from typing import Any
+
+import colorama
+
+# Local files
+import customlog
+import negcache
+import settings
+import spoofy
+import workerpool
+from palette import Palette
+from workerpool import Request, Response
+
+colorama.init(autoreset=True)
+plt = Palette()
+
+last_logtime = time.time()
+
+def log(msg: str, verbose=False):
+    global last_logtime
+    customlog.newlog(msg=msg, last_logtime=last_logtime,
+                     called_from=sys._getframe().f_back.f_code.co_name, verbose=verbose)
+    last_logtime = time.time()
+
+# Shared secret the bot and service authenticate each other with; created by whichever starts first
+KEY_FILE = 'resolver_key.txt'
+# After the service can't be reached, lookups run in the bot process for this long before trying it again
+RECONNECT_DELAY = 30.0
+
+# spoofy functions that can be run by the service; their arguments and results have to be picklable
+OPERATIONS = frozenset({
+    'analyze_track',
+    'duration_from_url',
+    'playback_info',
+    'playlist_entries',
+    'search_ytmusic_album',
+    'search_ytmusic_text',
+    'spotify_album',
+    'spotify_playlist',
+    'spotify_track',
+    'spyt',
+    'title_from_url',
+    'video_info',
+    'ytmusic_album_from_url',
+})
+
+class RemoteError(Exception):
+    """Stands in for an error from the service that couldn't be sent back as it was"""
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(':')
+    return host, int(port)
+
+def load_key() -> bytes:
+    """Reads the shared key from `KEY_FILE`, creating it first if it doesn't exist yet"""
+    if not os.path.isfile(KEY_FILE):
+        with open(KEY_FILE, 'w') as f:
+            f.write(secrets.token_hex(32))
+    with open(KEY_FILE, 'r') as f:
+        return f.read().strip().encode()
+
+class ResolverService:
+    """Accepts lookups from any number of bot processes, and runs them in a pool of worker processes"""
+    def __init__(self, address: str, workers: int):
+        self.address = parse_address(address)
+        self.workers = max(workers, 1)
+        self._pool = self._new_pool()
+        self._pool_lock = threading.Lock()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # Each worker creates its API clients up front, rather than during its first lookup
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=spoofy.warm_clients)
+
+    def submit(self, request: Request) -> Future:
+        with self._pool_lock:
+            try:
+                return self._pool.submit(workerpool.run_picklable_request, request)
+            except BrokenProcessPool:
+                log(f'{plt.warn}A worker process died; starting a new pool.')
+                self._pool = self._new_pool()
+                return self._pool.submit(workerpool.run_picklable_request, request)
+
+    def serve(self):
+        with Listener(self.address, authkey=load_key()) as listener:
+            log(f'Listening on {self.address[0]}:{self.address[1]} with {self.workers} worker processes.')
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, OSError) as e:
+                    log(f'{plt.warn}Refused a connection: {e}')
+                    continue
+                log(f'Accepted a connection from {listener.last_accepted}.', verbose=True)
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn: Connection):
+        """Answers one connection's requests, one at a time; each bot keeps a connection open per lookup in flight"""
+        with conn:
+            while True:
+                try:
+                    request: Request = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                if request.operation not in OPERATIONS:
+                    response = Response(error=RemoteError(f'Unknown operation "{request.operation}"'))
+                else:
+                    try:
+                        response = self.submit(request).result()
+                    except BrokenProcessPool:
+                        response = Response(error=RemoteError(f'The worker process running {request.operation}() died.'))
+                    except Exception as e:
+                        # e.g. a result that couldn't be pickled on its way back from the worker
+                        response = Response(error=workerpool.picklable_error(e))
+
+                try:
+                    conn.send_bytes(workerpool.dump_response(response))
+                except (EOFError, OSError):
+                    return
+
+class ResolverClient:
+    """Runs lookups through the resolver service if one is configured, or in this process otherwise
+
+    Operations from `OPERATIONS` are called like methods, e.g. `lookups.spyt(url)`. Each call blocks until it's done,
+    so they're meant to be run through the resolution scheduler like any other lookup. If the service can't be
+    reached, lookups fall back to running locally until it can be again.
+
+    Locally means in `pool`'s worker processes if one is given, or in this process otherwise. With a `negative_cache`,
+    a lookup that failed recently fails again straight away instead of being run.
+    """
+    def __init__(self, address: str|None=None, timeout: float=60.0, pool: workerpool.WorkerPool|None=None,
+        negative_cache: negcache.NegativeCache|None=None):
+        self.address = parse_address(address) if address else None
+        self.timeout = timeout
+        self.pool = pool
+        self.negative_cache = negative_cache
+        self._authkey = load_key() if address else None
+        self._idle: list[Connection] = []
+        self._lock = threading.Lock()
+        self._unavailable_until = 0.0
+        self.remote_calls = 0
+        self.local_calls = 0
+
+    def __getattr__(self, name: str):
+        if name not in OPERATIONS:
+            raise AttributeError(f'{name} is not a resolver operation')
+        return functools.partial(self.call, name)
+
+    @property
+    def remote(self) -> bool:
+        """Whether lookups are currently being sent to the service"""
+        return self.address is not None and time.monotonic() >= self._unavailable_until
+
+    def _connect(self) -> Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return Client(self.address, authkey=self._authkey)
+
+    def _fall_back(self, error: Exception):
+        if self.remote:
+            log(f'{plt.warn}Resolver service at {self.address[0]}:{self.address[1]} can\'t be reached ({error}); '+
+                f'running lookups in this process for the next {RECONNECT_DELAY}s.')
+        self._unavailable_until = time.monotonic() + RECONNECT_DELAY
+        # Any other open connections most likely went down with it
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle.clear()
+
+    def local(self, name: str, *args, **kwargs) -> Any:
+        """Runs an operation locally even if there's a service, for things that need to happen on this machine (like downloads)"""
+        self.local_calls += 1
+        request = Request(name, args, kwargs)
+        if self.pool is not None:
+            return self.pool.run(request)
+        return workerpool.run_request(request).result()
+
+    def call(self, name: str, *args, **kwargs) -> Any:
+        if self.negative_cache is None:
+            return self._call(name, *args, **kwargs)
+
+        key = self.negative_cache.key(name, args, kwargs)
+        failure = self.negative_cache.get(key)
+        if failure is not None:
+            log(f'{name}{args} failed recently ({failure.kind}); not trying it again yet.', verbose=True)
+            if failure.error is not None and failure.result is None:
+                raise failure.error.with_traceback(None)
+            return failure.result
+
+        try:
+            result = self._call(name, *args, **kwargs)
+        except Exception as e:
+            self.negative_cache.remember(key, negcache.classify(e), error=e)
+            raise
+        failed = negcache.failure_of(name, result)
+        if failed is not None:
+            self.negative_cache.remember(key, failed[0], error=failed[1], result=result)
+        return result
+
+    def _call(self, name: str, *args, **kwargs) -> Any:
+        if not self.remote:
+            return self.local(name, *args, **kwargs)
+
+        try:
+            conn = self._connect()
+            conn.send(Request(name, args, kwargs))
+            answered = conn.poll(self.timeout)
+        except (AuthenticationError, OSError, EOFError) as e:
+            self._fall_back(e)
+            return self.local(name, *args, **kwargs)
+
+        if not answered:
+            # The answer would still arrive on this connection later, so it can't be used again
+            conn.close()
+            raise TimeoutError(f'The resolver service took more than {self.timeout}s to run {name}().')
+
+        try:
+            response: Response = conn.recv()
+        except (OSError, EOFError) as e:
+            conn.close()
+            self._fall_back(e)
+            return self.local(name, *args, **kwargs)
+
+        with self._lock:
+            self._idle.append(conn)
+        self.remote_calls += 1
+        return response.result()
+
+if __name__ == '__main__':
+    # Imported by name, so anything sent to the bot (like RemoteError) is found under the same module there
+    import resolverservice
+    cfg = settings.current()
+    try:
+        resolverservice.ResolverService(cfg.resolver_service_address, cfg.resolver_service_workers).serve()
+    except KeyboardInterrupt:
+        log('Stopping...')
@@ -0,0 +1,229 @@
+import asyncio
+import functools
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+# Local files
+import customlog
+
+last_logtime = time.time()
+
+def log(msg: str, verbose=False):
+    global last_logtime
+    customlog.newlog(msg=msg, last_logtime=last_logtime,
+                     called_from=sys._getframe().f_back.f_code.co_name, verbose=verbose)
+    last_logtime = time.time()
+
+class SchedulerBusy(Exception):
+    """Raised when a job is refused because the backlog is too deep"""
+
+class Job:
+    def __init__(self, guild_id: int, func: Callable, cost: int, interactive: bool, future: asyncio.Future):
+        self.guild_id = guild_id
+        self.func = func
+        self.cost = cost
+        self.interactive = interactive
+        self.future = future
+        self.submitted = time.monotonic()
+
+class GuildQueue:
+    def __init__(self, weight: int=1):
+        self.interactive: deque[Job] = deque()
+        self.bulk: deque[Job] = deque()
+        self.running_interactive = 0
+        self.running_bulk = 0
+        self.deficit = 0
+        self.weight = weight
+
+    @property
+    def backlog(self) -> int:
+        return len(self.interactive) + len(self.bulk)
+
+    @property
+    def idle(self) -> bool:
+        return self.backlog == 0 and self.running_interactive == 0 and self.running_bulk == 0
+
+class ResolutionScheduler:
+    """Runs blocking resolution jobs (metadata extraction, Spotify matching, etc.) in a shared thread pool,
+    sharing it fairly between guilds
+
+    Interactive jobs (single tracks, text searches) are always picked before bulk jobs (playlists, albums),
+    and bulk jobs are picked from each guild in turn using deficit round-robin, so one guild's huge
+    playlist can't hold up everyone else.
+
+    - `workers` (int): Total number of jobs that can run at once
+    - `guild_concurrency` (int): Jobs of each kind (interactive/bulk) a single guild can run at once
+    - `reserved_interactive` (int): Workers that bulk jobs are never allowed to occupy
+    - `max_guild_backlog` (int): Queued jobs a single guild can have before new ones are refused
+    - `max_backlog` (int): Queued jobs across all guilds before new bulk jobs are refused
+    - `quantum` (int): Cost credited to a guild's deficit each time it is visited
+    """
+    def __init__(self, workers: int=4, guild_concurrency: int=2, reserved_interactive: int=1,
+                 max_guild_backlog: int=25, max_backlog: int=100, quantum: int=1):
+        self.workers = max(workers, 1)
+        self.quantum = max(quantum, 1)
+
+        self.guilds: dict[int, GuildQueue] = {}
+        self.weights: dict[int, int] = {}
+        self.running = 0
+        self.running_bulk = 0
+        self._rotation: deque[int] = deque()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='resolver')
+        self.set_limits(guild_concurrency, reserved_interactive, max_guild_backlog, max_backlog)
+
+    def set_limits(self, guild_concurrency: int, reserved_interactive: int, max_guild_backlog: int, max_backlog: int):
+        """Changes the per-guild and backlog limits; jobs already running are left alone"""
+        self.guild_concurrency = max(guild_concurrency, 1)
+        # At least one worker has to be left for bulk jobs or they would never run
+        self.reserved_interactive = min(max(reserved_interactive, 0), self.workers - 1)
+        self.max_guild_backlog = max_guild_backlog
+        self.max_backlog = max_backlog
+        # Raised limits may let waiting jobs start now
+        self._dispatch()
+
+    def set_weight(self, guild_id: int, weight: int):
+        """Gives a guild a larger (or smaller) share of bulk capacity; the default weight is 1"""
+        self.weights[guild_id] = max(weight, 1)
+        if guild_id in self.guilds:
+            self.guilds[guild_id].weight = self.weights[guild_id]
+
+    @property
+    def backlog(self) -> int:
+        return sum(gq.backlog for gq in self.guilds.values())
+
+    async def run(self, guild_id: int, func: Callable, *args, interactive: bool=False, cost: int=1, **kwargs) -> Any:
+        """Queues `func(*args, **kwargs)` for the given guild and waits for its result
+
+        Raises `SchedulerBusy` if the job was refused by admission control.
+        """
+        gq = self.guilds.get(guild_id)
+        if gq is None:
+            gq = self.guilds[guild_id] = GuildQueue(self.weights.get(guild_id, 1))
+
+        if interactive:
+            if len(gq.interactive) >= self.max_guild_backlog:
+                log(f'Refusing interactive job for guild {guild_id}; {len(gq.interactive)} already waiting.', verbose=True)
+                self._prune(guild_id)
+                raise SchedulerBusy
+        elif gq.backlog >= self.max_guild_backlog or self.backlog >= self.max_backlog:
+            log(f'Refusing bulk job for guild {guild_id}; guild backlog is {gq.backlog}, total is {self.backlog}.', verbose=True)
+            self._prune(guild_id)
+            raise SchedulerBusy
+
+        job = Job(guild_id, functools.partial(func, *args, **kwargs), cost, interactive, asyncio.get_running_loop().create_future())
+        if interactive:
+            gq.interactive.append(job)
+        else:
+            gq.bulk.append(job)
+            if guild_id not in self._rotation:
+                self._rotation.append(guild_id)
+
+        self._dispatch()
+        try:
+            return await job.future
+        finally:
+            # Only still queued if the caller was cancelled before the job started
+            for waiting in (gq.interactive, gq.bulk):
+                if job in waiting:
+                    waiting.remove(job)
+            self._prune(guild_id)
+
+    def _prune(self, guild_id: int):
+        # Drop a guild's queue once it has nothing left to do
+        gq = self.guilds.get(guild_id)
+        if gq is not None and gq.idle:
+            del self.guilds[guild_id]
+
+    def _dispatch(self):
+        while self.running < self.workers:
+            job = self._next_interactive() or self._next_bulk()
+            if job is None:
+                break
+            self._start(job)
+
+    def _next_interactive(self) -> Job|None:
+        # Oldest waiting interactive job from a guild that is under its cap
+        best: GuildQueue|None = None
+        for gq in self.guilds.values():
+            if not gq.interactive or gq.running_interactive >= self.guild_concurrency:
+                continue
+            if best is None or gq.interactive[0].submitted < best.interactive[0].submitted:
+                best = gq
+        return best.interactive.popleft() if best is not None else None
+
+    def _next_bulk(self) -> Job|None:
+        if self.running_bulk >= self.workers - self.reserved_interactive:
+            return None
+
+        # Deficit round-robin; each full pass over the rotation credits every guild one more quantum,
+        # so expensive jobs are eventually reached without starving cheaper ones elsewhere
+        for _ in range(len(self._rotation) * 2):
+            guild_id = self._rotation[0]
+            gq = self.guilds.get(guild_id)
+            if gq is None or not gq.bulk:
+                self._rotation.popleft()
+                if gq is not None:
+                    gq.deficit = 0
+                if not self._rotation:
+                    return None
+                continue
+            if gq.running_bulk >= self.guild_concurrency:
+                self._rotation.rotate(-1)
+                continue
+
+            if gq.deficit < gq.bulk[0].cost:
+                gq.deficit += self.quantum * gq.weight
+            if gq.deficit >= gq.bulk[0].cost:
+                job = gq.bulk.popleft()
+                gq.deficit -= job.cost
+                if not gq.bulk or gq.deficit < gq.bulk[0].cost:
+                    self._rotation.rotate(-1)
+                return job
+            self._rotation.rotate(-1)
+        return None
+
+    def _start(self, job: Job):
+        gq = self.guilds[job.guild_id]
+        self.running += 1
+        if job.interactive:
+            gq.running_interactive += 1
+        else:
+            gq.running_bulk += 1
+            self.running_bulk += 1
+
+        loop = job.future.get_loop()
+        task = loop.run_in_executor(self._executor, job.func)
+        task.add_done_callback(lambda t: self._finish(job, t))
+
+    def _finish(self, job: Job, task: asyncio.Future):
+        gq = self.guilds.get(job.guild_id)
+        self.running -= 1
+        if job.interactive:
+            gq.running_interactive -= 1
+        else:
+            gq.running_bulk -= 1
+            self.running_bulk -= 1
+
+        if not job.future.cancelled():
+            if task.exception() is not None:
+                job.future.set_exception(task.exception())
+            else:
+                job.future.set_result(task.result())
+        self._prune(job.guild_id)
+        self._dispatch()
+
+    def stats(self) -> dict[int, dict[str, int]]:
+        """Returns the queued and running job counts of every guild with pending work"""
+        return {
+            guild_id: {
+                'queued_interactive': len(gq.interactive),
+                'queued_bulk': len(gq.bulk),
+                'running_interactive': gq.running_interactive,
+                'running_bulk': gq.running_bulk,
+                'weight': gq.weight,
+            }
+            for guild_id, gq in self.guilds.items()
+        }
@@ -0,0 +1,176 @@
+import os
+from dataclasses import dataclass, field, fields
+from threading import Lock
+from types import MappingProxyType
+from typing import Any, Callable, Mapping
+
+import yaml
+from benedict import benedict
+
+CONFIG_DEFAULT_PATH = 'config_default.yml'
+CONFIG_PATH = 'config.yml'
+
+def setting(key: str, restart: bool=False) -> Any:
+    """Declares a `Config` field read from the given keypath
+
+    `restart` marks settings that are only read at startup, so changing them needs a restart to take effect.
+    """
+    return field(metadata={'key': key, 'restart': restart})
+
+@dataclass(frozen=True)
+class Config:
+    """A read-only snapshot of every config value, with anything left out of config.yml taken from config_default.yml"""
+    embed_color                : str     = setting('embed-color')
+    public                     : bool    = setting('public', restart=True)
+    token_file                 : str     = setting('token-file', restart=True)
+    public_prefix              : str     = setting('prefixes.public', restart=True)
+    dev_prefix                 : str     = setting('prefixes.developer', restart=True)
+    prefix_commands            : bool    = setting('prefix-commands', restart=True)
+    lean_mode                  : bool    = setting('lean-mode', restart=True)
+    message_cache_size         : int     = setting('message-cache-size', restart=True)
+    sharding_enabled           : bool    = setting('sharding.enabled', restart=True)
+    shard_count                : int     = setting('sharding.shard-count', restart=True)
+    shard_range                : str     = setting('sharding.shard-range', restart=True)
+    shard_processes            : int     = setting('sharding.processes', restart=True)
+    vote_to_skip               : bool    = setting('vote-to-skip.enabled')
+    skip_votes_type            : str     = setting('vote-to-skip.threshold-type')
+    skip_votes_percentage      : int     = setting('vote-to-skip.threshold-percentage')
+    skip_votes_exact           : int     = setting('vote-to-skip.threshold-exact')
+    show_users_in_queue        : bool    = setting('show-users-in-queue')
+    use_url_cache              : bool    = setting('use-url-cache')
+    cleanup_extensions         : tuple   = setting('auto-remove')
+    allow_spotify_playlists    : bool    = setting('allow-spotify-playlists')
+    spotify_playlist_limit     : int     = setting('spotify-playlist-limit')
+    force_no_match             : bool    = setting('force-no-match')
+    use_top_match              : bool    = setting('use-top-match')
+    duration_limit             : float   = setting('duration-limit')
+    maximum_urls               : int     = setting('maximum-urls')
+    url_concurrency            : int     = setting('url-concurrency')
+    progressive_queueing       : bool    = setting('progressive-queueing')
+    playlist_window            : int     = setting('playlist-window')
+    playlist_lookahead         : int     = setting('playlist-lookahead')
+    resolver_workers           : int     = setting('resolution-scheduler.workers', restart=True)
+    resolver_guild_concurrency : int     = setting('resolution-scheduler.guild-concurrency')
+    resolver_reserved_workers  : int     = setting('resolution-scheduler.reserved-interactive-workers')
+    resolver_max_guild_backlog : int     = setting('resolution-scheduler.max-guild-backlog')
+    resolver_max_backlog       : int     = setting('resolution-scheduler.max-backlog')
+    resolver_service_enabled   : bool    = setting('resolver-service.enabled', restart=True)
+    resolver_service_address   : str     = setting('resolver-service.address', restart=True)
+    resolver_service_workers   : int     = setting('resolver-service.workers', restart=True)
+    resolver_service_timeout   : float   = setting('resolver-service.timeout')
+    execution_mode             : str     = setting('execution.mode', restart=True)
+    execution_workers          : int     = setting('execution.workers', restart=True)
+    execution_timeout          : float   = setting('execution.timeout')
+    metrics_enabled            : bool    = setting('metrics.enabled', restart=True)
+    metrics_address            : str     = setting('metrics.address', restart=True)
+    startup_budget_ready       : float   = setting('startup-budget.ready')
+    startup_budget_import      : float   = setting('startup-budget.import')
+    config_watch_interval      : float   = setting('config-watch-interval', restart=True)
+    status_update_interval     : float   = setting('status-update-interval')
+    loop_lag_threshold         : float   = setting('loop-lag-threshold')
+    prewarm_seconds            : float   = setting('prewarm-seconds')
+    download_target_bitrate    : int     = setting('download-profile.target-bitrate')
+    download_max_filesize      : float   = setting('download-profile.max-filesize')
+    download_fragments         : int     = setting('download-profile.concurrent-fragments')
+    loudness_enabled           : bool    = setting('loudness-normalization.enabled')
+    loudness_target            : float   = setting('loudness-normalization.target')
+    persistent_queues          : bool    = setting('persistent-queues', restart=True)
+    negative_cache_enabled     : bool    = setting('negative-cache.enabled')
+    negative_cache_permanent   : float   = setting('negative-cache.permanent')
+    negative_cache_restricted  : float   = setting('negative-cache.restricted')
+    negative_cache_no_match    : float   = setting('negative-cache.no-match')
+    negative_cache_transient   : float   = setting('negative-cache.transient')
+    inactivity_timeout         : float   = setting('inactivity-timeout')
+    aliases                    : Mapping = setting('aliases', restart=True)
+    disabled_commands          : tuple   = setting('command-blacklist')
+    show_console_logs          : Mapping = setting('logging-options.show-console-logs')
+    show_verbose_logs          : bool    = setting('logging-options.show-verbose-logs')
+    log_blacklist              : tuple   = setting('logging-options.ignore-logs-from')
+    no_color                   : bool    = setting('logging-options.colors.no-color', restart=True)
+    colors                     : Mapping = setting('logging-options.colors', restart=True)
+
+# What each annotation accepts from YAML; ints are fine anywhere a float is expected
+_accepted_types: dict[type, tuple[type, ...]] = {
+    bool: (bool,),
+    int: (int,),
+    float: (int, float),
+    str: (str,),
+    tuple: (list,),
+    Mapping: (dict,),
+}
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+def _read_yaml(path: str) -> dict:
+    with open(path, 'r') as f:
+        return yaml.safe_load(f) or {}
+
+def load() -> Config:
+    """Builds a new snapshot from the config files; raises `ValueError` if a value is the wrong type"""
+    merged = benedict(_read_yaml(CONFIG_DEFAULT_PATH))
+    # Deep merge, so config.yml only needs the keys that are actually being changed
+    merged.merge(_read_yaml(CONFIG_PATH))
+
+    values = {}
+    for f in fields(Config):
+        key: str = f.metadata['key']
+        value = merged[key]
+        # bool is a subclass of int, so it has to be ruled out separately
+        if not isinstance(value, _accepted_types[f.type]) or (f.type is not bool and isinstance(value, bool)):
+            raise ValueError(f'"{key}" should be {f.type.__name__}, not {type(value).__name__} ({value!r})')
+        values[f.name] = _freeze(value)
+    return Config(**values)
+
+_current: Config = load()
+_config_mtime: float = os.path.getmtime(CONFIG_PATH)
+_subscribers: list[Callable[[Config, Config, set[str]], None]] = []
+_reload_lock = Lock()
+
+def current() -> Config:
+    """The config snapshot currently in use; hold on to it instead of calling this repeatedly if values need to agree"""
+    return _current
+
+def subscribe(callback: Callable[[Config, Config, set[str]], None]):
+    """Registers `callback(old, new, changed)` to be called after each reload that changed something,
+    where `changed` is the set of field names that differ"""
+    _subscribers.append(callback)
+
+def config_file_changed() -> bool:
+    """Whether config.yml has been modified since it was last loaded"""
+    try:
+        return os.path.getmtime(CONFIG_PATH) != _config_mtime
+    except FileNotFoundError:
+        return False
+
+def reload() -> set[str]:
+    """Reads the config files again and swaps in the new snapshot, then notifies subscribers
+
+    Returns the names of the fields that changed. If the new config is invalid, the error is raised and the current snapshot is kept.
+    """
+    global _current, _config_mtime
+    with _reload_lock:
+        # Recorded first, so a broken file isn't retried until it's saved again
+        _config_mtime = os.path.getmtime(CONFIG_PATH)
+        new = load()
+        old = _current
+        changed = {f.name for f in fields(Config) if getattr(old, f.name) != getattr(new, f.name)}
+        if not changed:
+            return changed
+        _current = new
+
+    for callback in _subscribers:
+        callback(old, new, changed)
+    return changed
+
+def keypaths(names: set[str]) -> list[str]:
+    """Returns the config keypaths of the given field names, in the order they're declared"""
+    return [f.metadata['key'] for f in fields(Config) if f.name in names]
+
+def needs_restart(changed: set[str]) -> list[str]:
+    """Returns the keypaths of changed settings that only take effect after a restart"""
+    return [f.metadata['key'] for f in fields(Config) if f.name in changed and f.metadata['restart']]
@@ -0,0 +1,64 @@
+import argparse
+
+import requests
+
+def parse_args(argv: list[str]|None=None) -> argparse.Namespace:
+    """Reads the options `launcher.py` starts each bot process with; anything else on the command line is ignored"""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--shards', default=None,
+        help='Shards this process runs, e.g. "0-3"; overrides sharding.shard-range')
+    parser.add_argument('--shard-count', type=int, default=0,
+        help='Total shards across every process; overrides sharding.shard-count')
+    parser.add_argument('--no-console', action='store_true',
+        help="Don't read console commands; used when stdin belongs to the launcher")
+    return parser.parse_known_args(argv)[0]
+
+options = parse_args()
+
+def parse_range(text: str) -> list[int]:
+    """Turns a shard range like "0-3" or "0-3,8,10-11" into a sorted list of shard IDs; blank gives an empty list
+
+    Raises `ValueError` if it can't be read.
+    """
+    ids = set()
+    for part in text.replace(' ', '').split(','):
+        if part == '':
+            continue
+        first, _, last = part.partition('-')
+        first, last = int(first), int(last or first)
+        if first < 0 or last < first:
+            raise ValueError(f'Invalid shard range "{part}"')
+        ids.update(range(first, last + 1))
+    return sorted(ids)
+
+def format_range(ids: list[int]) -> str:
+    """The reverse of `parse_range()`"""
+    parts = []
+    for shard_id in sorted(ids):
+        if parts and parts[-1][1] == shard_id - 1:
+            parts[-1][1] = shard_id
+        else:
+            parts.append([shard_id, shard_id])
+    return ','.join(str(first) if first == last else f'{first}-{last}' for first, last in parts)
+
+def split(ids: list[int], processes: int) -> list[list[int]]:
+    """Splits shard IDs into at most `processes` consecutive groups of nearly equal size"""
+    processes = max(1, min(processes, len(ids)))
+    size, extra = divmod(len(ids), processes)
+    groups = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(ids[start:end])
+        start = end
+    return groups
+
+def recommended_shard_count(token: str) -> int:
+    """Asks Discord how many shards it recommends for this bot"""
+    response = requests.get('https://discord.com/api/v10/gateway/bot', headers={'Authorization': f'Bot {token}'}, timeout=10)
+    response.raise_for_status()
+    return response.json()['shards']
+
+def log_tag() -> str:
+    """Identifies this process in logs and log file names when it only runs some of the shards"""
+    return f'shards {options.shards}' if options.shards else ''
@@ -3,24 +3,28 @@ import os
 import sys
 import time
 import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from inspect import currentframe, getframeinfo
+from threading import Lock
+from typing import Any, Callable, Iterator
 
 import colorama
 import pytube
 import regex as re
 import sclib
+import sclib.sync
 import spotipy
-import yaml
 import yt_dlp
-from benedict import benedict
 from colorama import Back, Fore, Style
 from fuzzywuzzy import fuzz
 from spotipy.oauth2 import SpotifyClientCredentials
-from ytmusicapi import YTMusic
 
 # Local files
 import customlog
+import metrics
 from palette import Palette
+import settings
 
 _here = os.path.basename(__file__)
 
@@ -40,16 +44,30 @@ def log_line():
     cf = currentframe()
     print('@ LINE ', cf.f_back.f_lineno)
 
-# Parse config from YAML
-with open('config_default.yml','r') as f:
-    config_default = benedict(yaml.safe_load(f))
-
-with open('config.yml','r') as f:
-    config = benedict(yaml.safe_load(f))
+FORCE_NO_MATCH         : bool = settings.current().force_no_match
+SPOTIFY_PLAYLIST_LIMIT : int  = settings.current().spotify_playlist_limit
+DURATION_LIMIT         : int  = settings.current().duration_limit
+
+DOWNLOAD_TARGET_BITRATE : int   = settings.current().download_target_bitrate
+DOWNLOAD_MAX_FILESIZE   : float = settings.current().download_max_filesize
+DOWNLOAD_FRAGMENTS      : int   = settings.current().download_fragments
+
+def apply_config(old: settings.Config, new: settings.Config, changed: set[str]):
+    global FORCE_NO_MATCH, SPOTIFY_PLAYLIST_LIMIT, DURATION_LIMIT
+    global DOWNLOAD_TARGET_BITRATE, DOWNLOAD_MAX_FILESIZE, DOWNLOAD_FRAGMENTS
+    FORCE_NO_MATCH = new.force_no_match
+    SPOTIFY_PLAYLIST_LIMIT = new.spotify_playlist_limit
+    DURATION_LIMIT = new.duration_limit
+    DOWNLOAD_TARGET_BITRATE = new.download_target_bitrate
+    DOWNLOAD_MAX_FILESIZE = new.download_max_filesize
+    DOWNLOAD_FRAGMENTS = new.download_fragments
+    if changed & {'download_target_bitrate', 'download_max_filesize', 'download_fragments'}:
+        with download_clients_lock:
+            download_clients.clear()
+    if 'force_no_match' in changed and FORCE_NO_MATCH:
+        log(f'{plt.warn}NOTICE: force_no_match is set to True.')
 
-FORCE_NO_MATCH         : bool = config.get('force-no-match', config_default['force-no-match'])
-SPOTIFY_PLAYLIST_LIMIT : int  = config.get('spotify-playlist-limit', config_default['spotify-playlist-limit'])
-DURATION_LIMIT         : int  = config.get('duration-limit', config_default['duration-limit'])
+settings.subscribe(apply_config)
 
 # Useful to point this out if left on accidentally
 if FORCE_NO_MATCH:
@@ -71,25 +89,116 @@ ytdl_format_options = {
     'source_address': '0.0.0.0',  # bind to ipv4 since ipv6 addresses cause issues sometimes
 }
 
-ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
+class LazyClient:
+    """Stands in for an API client until it's first used, so startup doesn't wait on clients that may not be needed yet
+
+    Attribute access is passed through to the real client, which is created by `factory` on first use.
+    """
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self._factory = factory
+        self._instance = None
+        self._lock = Lock()
+
+    @property
+    def instance(self) -> Any:
+        """The real client, created if it hasn't been yet"""
+        if self._instance is None:
+            # Clients get used from resolver threads, so make sure only one of them creates it
+            with self._lock:
+                if self._instance is None:
+                    start = time.perf_counter()
+                    self._instance = self._factory()
+                    log(f'Created {self.name} client in {round(time.perf_counter() - start, 3)}s.', verbose=True)
+        return self._instance
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.instance, name)
+
+def _youtube_music_client():
+    # ytmusicapi is only needed once something is searched for, so it isn't imported until then
+    from ytmusicapi import YTMusic
+    return YTMusic()
+
+def _spotify_client() -> spotipy.Spotify:
+    with open('spotify_config.json', 'r') as f:
+        scred = json.loads(f.read())['spotify']
+
+    client_credentials_manager = SpotifyClientCredentials(
+        client_id=scred['client_id'],
+        client_secret=scred['client_secret']
+    )
+    return spotipy.Spotify(client_credentials_manager = client_credentials_manager)
 
 # API Objects
-
-# Connect to youtube music API
-ytmusic = YTMusic()
-
-# Connect to spotify API
-with open('spotify_config.json', 'r') as f:
-    scred = json.loads(f.read())['spotify']
-
-client_credentials_manager = SpotifyClientCredentials(
-    client_id=scred['client_id'],
-    client_secret=scred['client_secret']
-)
-sp = spotipy.Spotify(client_credentials_manager = client_credentials_manager)
-
-# Connect to soundcloud API
-sc = sclib.SoundcloudAPI()
+ytdl = LazyClient('yt-dlp', lambda: yt_dlp.YoutubeDL(ytdl_format_options))
+ytmusic = LazyClient('YouTube Music', _youtube_music_client)
+sp = LazyClient('Spotify', _spotify_client)
+sc = LazyClient('SoundCloud', sclib.SoundcloudAPI)
+
+# The Spotify client isn't created until it's needed, so point out a missing config now rather than on the first Spotify link
+if not os.path.isfile('spotify_config.json'):
+    log(f'{plt.warn}spotify_config.json was not found; Spotify links will not work until it is created.')
+
+def warm_clients(*extra: LazyClient):
+    """Creates any clients that haven't been used yet; meant to be run in the background once the bot is ready"""
+    for client in (ytdl, ytmusic, sp, sc, *extra):
+        try:
+            client.instance
+        except Exception as e:
+            log(f'{plt.warn}Couldn\'t create {client.name} client: {e}')
+
+# yt-dlp clients for downloading at each bitrate, since the format is picked when the client is created
+download_clients: dict[int, yt_dlp.YoutubeDL] = {}
+download_clients_lock = Lock()
+
+def download_format(bitrate: int, max_filesize: float) -> str:
+    """Builds a yt-dlp format selector for audio at or under `bitrate` kbps (any bitrate if 0) and `max_filesize` MB
+
+    Opus is what Discord sends anyway, so it's preferred, then any audio-only format, then the smallest audio at any
+    bitrate, and only then the smallest format that has video, for sites that don't offer audio on its own.
+    """
+    size = f'[filesize<?{max_filesize}M][filesize_approx<?{max_filesize}M]' if max_filesize > 0 else ''
+    capped = f'[abr<=?{bitrate}]' if bitrate > 0 else ''
+    return '/'.join([
+        f'bestaudio[acodec=opus]{capped}{size}',
+        f'bestaudio[vcodec=none]{capped}{size}',
+        f'worstaudio[vcodec=none]{size}',
+        f'worst[acodec!=none]{size}',
+        'worst',
+    ])
+
+def download_client(bitrate: int) -> yt_dlp.YoutubeDL:
+    """Returns a yt-dlp client that downloads with the current download profile, aiming for `bitrate` kbps"""
+    if DOWNLOAD_TARGET_BITRATE > 0:
+        bitrate = DOWNLOAD_TARGET_BITRATE
+    with download_clients_lock:
+        if bitrate not in download_clients:
+            download_clients[bitrate] = yt_dlp.YoutubeDL(ytdl_format_options | {
+                'format': download_format(bitrate, DOWNLOAD_MAX_FILESIZE),
+                'concurrent_fragment_downloads': max(DOWNLOAD_FRAGMENTS, 1),
+            })
+        return download_clients[bitrate]
+
+# Hydrated SoundCloud tracks by ID, so sets that share tracks (or get queued twice) don't request them again
+soundcloud_track_cache: OrderedDict[int, sclib.Track] = OrderedDict()
+SOUNDCLOUD_TRACK_CACHE_SIZE = 5000
+# How many batches of track info to request at once while reading a set
+SOUNDCLOUD_BATCHES_IN_FLIGHT = 4
+
+# Counted in whichever process runs the lookup, so in "process" execution mode or with a resolver service
+# these stay at zero in the bot's own metrics
+isrc_searches = metrics.registry.counter('vimusbot_isrc_searches_total',
+    'ISRC searches for Spotify tracks, by whether one of the results matched', ['result'])
+ytmusic_matches = metrics.registry.counter('vimusbot_ytmusic_matches_total',
+    'How search_ytmusic() found its result: isrc, song, video, fast, or unsure (the user is asked to choose)', ['result'])
+pytube_fallbacks = metrics.registry.counter('vimusbot_pytube_fallbacks_total',
+    'Times pytube failed and yt-dlp was used instead', ['operation'])
+
+# YouTube Music albums by browseId, and the browseIds found for Spotify UPCs and album playlist IDs
+ytmusic_album_cache: dict[str, dict] = {}
+upc_browse_ids: dict[str, str] = {}
+playlist_browse_ids: dict[str, str] = {}
 
 # For analyze()
 keytable = {
@@ -192,6 +301,7 @@ def pytube_track_data(pytube_object: pytube.YouTube) -> dict:
         pytube_object.bypass_age_gate()
         description_list = pytube_object.description.split('\n')
     except Exception as e:
+        pytube_fallbacks.inc(operation='description')
         log(f'pytube description retrieval failed; using ytdl...', verbose=True)
         log(f'Cause of the above: {e}')
         description_list = ytdl.extract_info(pytube_object.watch_url)['description'].split('\n')
@@ -230,15 +340,81 @@ def search_ytmusic_text(query: str) -> tuple:
 
     return top_song, top_video
 
-def search_ytmusic_album(title: str, artist: str, year: str, upc: str=None) -> str|None:
+def get_ytmusic_album(browse_id: str) -> dict:
+    """Retrieves an album's info and its track list from YTMusic in one request, caching the result by browseId"""
+    if browse_id in ytmusic_album_cache:
+        log(f'Album {browse_id} already stored.', verbose=True)
+        return ytmusic_album_cache[browse_id]
+
+    album = ytmusic.get_album(browse_id)
+    album_artist = album['artists'][0]['name'] if album.get('artists') else ''
+    tracks = []
+    for track in album['tracks']:
+        # Region-locked or removed tracks have no videoId
+        if not track.get('videoId') or not track.get('isAvailable', True):
+            continue
+        tracks.append({
+            'title': track['title'],
+            'artist': track['artists'][0]['name'] if track.get('artists') else album_artist,
+            'album': album['title'],
+            'url': 'https://www.youtube.com/watch?v='+track['videoId'],
+            'duration': track.get('duration_seconds') or 0,
+        })
+
+    result = {
+        'title': album['title'],
+        'artist': album_artist,
+        'year': album.get('year'),
+        'browseId': browse_id,
+        'audioPlaylistId': album.get('audioPlaylistId'),
+        'tracks': tracks,
+    }
+    ytmusic_album_cache[browse_id] = result
+    if result['audioPlaylistId']:
+        playlist_browse_ids[result['audioPlaylistId']] = browse_id
+    return result
+
+def is_ytmusic_album_url(url: str) -> bool:
+    # Album playlist IDs always start with OLAK5uy_, whether on youtube.com or music.youtube.com
+    return re.search(r'(list=OLAK5uy_|music\.youtube\.com/browse/MPRE)', url) is not None
+
+def ytmusic_album_from_url(url: str) -> dict|None:
+    """Returns the album from `get_ytmusic_album()` for a YouTube Music album link, or None if it isn't one"""
+    if match := re.search(r'/browse/(MPRE[\w-]+)', url):
+        browse_id = match.group(1)
+    elif match := re.search(r'list=(OLAK5uy_[\w-]+)', url):
+        playlist_id = match.group(1)
+        try:
+            browse_id = playlist_browse_ids.get(playlist_id) or ytmusic.get_album_browse_id(playlist_id)
+        except Exception as e:
+            log(f'Failed to find album for playlist {playlist_id}: {e}')
+            return None
+    else:
+        return None
+
+    if browse_id is None:
+        return None
+    try:
+        return get_ytmusic_album(browse_id)
+    except Exception as e:
+        log(f'Failed to retrieve album {browse_id}: {e}')
+        return None
+
+def search_ytmusic_album(title: str, artist: str, year: str, upc: str=None) -> dict|None:
+    """Finds the closest YTMusic match for an album, and returns it from `get_ytmusic_album()`"""
     if FORCE_NO_MATCH:
         log(f'{plt.warn}force_no_match is set to True.'); return None
 
+    if upc is not None and upc in upc_browse_ids:
+        log(f'Album with UPC {upc} already matched.', verbose=True)
+        return get_ytmusic_album(upc_browse_ids[upc])
+
     query = f'{title} {artist} {year}'
     
     log('Starting album search...', verbose=True)
     check = re.compile(r'(\(feat\..*\))|(\(.*Remaster.*\))')
 
+    browse_id = None
     album_results = ytmusic.search(query=query, limit=5, filter='albums')
     for yt in album_results:
         title_match = fuzz.ratio(check.sub('', title), check.sub('', yt['title'])) > 75
@@ -246,19 +422,27 @@ def search_ytmusic_album(title: str, artist: str, year: str, upc: str=None) -> s
         year_match = fuzz.ratio(year, yt['year']) > 75
         if title_match + artist_match + year_match >= 2:
             log('Match found.', verbose=True)
-            return 'https://www.youtube.com/playlist?list='+ytmusic.get_album(yt['browseId'])['audioPlaylistId']
-    
-    song_results = ytmusic.search(query=query,limit=5,filter='songs')
-    for yt in song_results:
-        title_match = fuzz.ratio(check.sub('', title), check.sub('', yt['album']['name'])) > 75
-        artist_match = fuzz.ratio(artist, yt['artists'][0]['name']) > 75
-        year_match = fuzz.ratio(year, yt['year']) > 75
-        if title_match + artist_match + year_match >= 2:
-            log('Match found.', verbose=True)
-            return 'https://www.youtube.com/playlist?list='+ytmusic.get_album(yt['album']['id'])['audioPlaylistId']
-    
-    log('No match found.', verbose=True)
-    return None
+            browse_id = yt['browseId']
+            break
+
+    if browse_id is None:
+        song_results = ytmusic.search(query=query,limit=5,filter='songs')
+        for yt in song_results:
+            title_match = fuzz.ratio(check.sub('', title), check.sub('', yt['album']['name'])) > 75
+            artist_match = fuzz.ratio(artist, yt['artists'][0]['name']) > 75
+            year_match = fuzz.ratio(year, yt['year']) > 75
+            if title_match + artist_match + year_match >= 2:
+                log('Match found.', verbose=True)
+                browse_id = yt['album']['id']
+                break
+
+    if browse_id is None:
+        log('No match found.', verbose=True)
+        return None
+
+    if upc is not None:
+        upc_browse_ids[upc] = browse_id
+    return get_ytmusic_album(browse_id)
 
 # Trim ytmusic song data down to what's relevant to us
 def trim_track_data(data: dict|object, album: str='', is_pytube_object: bool=False) -> dict:
@@ -294,8 +478,11 @@ def search_ytmusic(title: str, artist: str, album: str, isrc: str=None, limit: i
         for song in isrc_matches:
             if fuzz.ratio(song.title, reference['title']) > 75:
                 log('Found an ISRC match.', verbose=True)
+                isrc_searches.inc(result='match')
+                ytmusic_matches.inc(result='isrc')
                 return trim_track_data(song, is_pytube_object=True)
             
+        isrc_searches.inc(result='miss')
         log('No ISRC match found, falling back on text search.')
 
     log(f'Trying query \"{query}\" with a limit of {limit}')
@@ -311,6 +498,7 @@ def search_ytmusic(title: str, artist: str, album: str, isrc: str=None, limit: i
     if fast_search:
         log('fast_search is True.', verbose=True)
         log('Returning match.', verbose=True)
+        ytmusic_matches.inc(result='fast')
         return trim_track_data(song_results[0])
 
     log('Checking for exact match...')
@@ -319,6 +507,7 @@ def search_ytmusic(title: str, artist: str, album: str, isrc: str=None, limit: i
 
     # Check for matches
     match = None
+    match_kind = 'song'
     def match_found() -> bool:
         return match != None if not FORCE_NO_MATCH else False
 
@@ -342,6 +531,7 @@ def search_ytmusic(title: str, artist: str, album: str, isrc: str=None, limit: i
             if is_matching(reference, song, ignore_artist=True, ignore_album=True):
                 log('Video match found.')
                 match = song
+                match_kind = 'video'
                 break
     
     if not match_found():
@@ -354,6 +544,7 @@ def search_ytmusic(title: str, artist: str, album: str, isrc: str=None, limit: i
     if match_found():
         # Return match
         log('Returning match.', verbose=True)
+        ytmusic_matches.inc(result=match_kind)
         return trim_track_data(match)
     else:
         log('Creating results dictionary...', verbose=True)
@@ -371,12 +562,67 @@ def search_ytmusic(title: str, artist: str, album: str, isrc: str=None, limit: i
         # Ask for confirmation if no exact match found
         if unsure:
             log('Returning as unsure.')
+            ytmusic_matches.inc(result='unsure')
             return 'unsure', results
 
 # SoundCloud
+def cache_soundcloud_track(track: sclib.Track):
+    soundcloud_track_cache[track.id] = track
+    soundcloud_track_cache.move_to_end(track.id)
+    while len(soundcloud_track_cache) > SOUNDCLOUD_TRACK_CACHE_SIZE:
+        soundcloud_track_cache.popitem(last=False)
+
+def soundcloud_playlist_reader(url: str) -> Iterator[sclib.Track]:
+    """Yields the tracks of a SoundCloud set in order, as soon as each one is available
+
+    Resolving a set only returns full info for its first few tracks, and IDs for the rest. Rather than
+    waiting for every track like `sc.resolve()` does, the missing ones are requested in batches
+    (several at once), and each track is yielded as soon as the batch it's in comes back.
+    """
+    if not sc.client_id:
+        sc.get_credentials()
+
+    obj = sclib.sync.get_obj_from(sclib.SoundcloudAPI.RESOLVE_URL.format(url=url, client_id=sc.client_id))
+    if not obj or obj.get('kind') not in ['playlist', 'system-playlist']:
+        # Same as what sc.resolve() would end up raising
+        raise TypeError(f'{url} did not resolve to a SoundCloud set.')
+
+    track_ids = [track['id'] for track in obj['tracks']]
+    for track in obj['tracks']:
+        if 'title' in track:
+            cache_soundcloud_track(sclib.Track(obj=track, client=sc.instance))
+
+    missing = [track_id for track_id in track_ids if track_id not in soundcloud_track_cache]
+    batch_size = sc.TRACK_API_MAX_REQUEST_SIZE
+    batches = [missing[i:i+batch_size] for i in range(0, len(missing), batch_size)]
+    batch_of = {track_id: i // batch_size for i, track_id in enumerate(missing)}
+    log(f'{len(track_ids)} tracks in set, {len(missing)} need to be requested in {len(batches)} batches.', verbose=True)
+
+    def hydrate(batch: list[int]) -> list[sclib.Track]:
+        return [sclib.Track(obj=track, client=sc.instance) for track in sc.get_tracks(*batch)]
+
+    with ThreadPoolExecutor(max_workers=SOUNDCLOUD_BATCHES_IN_FLIGHT) as executor:
+        requested: dict[int, Future] = {}
+        received: set[int] = set()
+        for track_id in track_ids:
+            if track_id in batch_of and batch_of[track_id] not in received:
+                # Keep the next few batches requested ahead of the one being waited on
+                index = batch_of[track_id]
+                for i in range(index, min(index + SOUNDCLOUD_BATCHES_IN_FLIGHT, len(batches))):
+                    if i not in requested:
+                        requested[i] = executor.submit(hydrate, batches[i])
+                for track in requested[index].result():
+                    cache_soundcloud_track(track)
+                received.add(index)
+
+            if track_id in soundcloud_track_cache:
+                yield soundcloud_track_cache[track_id]
+            else:
+                # Private or removed tracks are left out of the response
+                log(f'SoundCloud track {track_id} could not be retrieved; skipping.', verbose=True)
+
 def soundcloud_playlist(url: str) -> list:
-    playlist = sc.resolve(url).tracks
-    return playlist
+    return list(soundcloud_playlist_reader(url))
 
 # Spotify
 def get_uri(url: str) -> str:
@@ -474,4 +720,90 @@ def spyt(url: str, limit: int=20, **kwargs) -> dict|tuple:
     if isinstance(result, tuple) and result[0] == 'unsure':
         log('Returning as unsure.')
         return result
-    return result
\ No newline at end of file
+    return result
+
+
+# Any URL
+def duration_from_url(url: str) -> int|float|tuple:
+    """Automatically detects the source of a given URL, and returns its extracted duration."""
+    log(f'Getting length of \'{url}\'...', verbose=True)
+    if 'youtube.com' in url:
+        try:
+            return pytube.YouTube(url).length
+        except Exception as e:
+            pytube_fallbacks.inc(operation='duration')
+            log(f'pytube couldn\'t retrieve video length: "{traceback.format_exception(e)[-1]}"; Trying yt-dlp...', verbose=True)
+            # Continues after this block so this isn't duplicated
+    elif 'soundcloud.com' in url:
+        try:
+            result = sc.resolve(url).duration
+        except TypeError as e:
+            log(f'Failed to retrieve Soundcloud track: {e}')
+            return None, e
+        return round(result / 1000)
+    elif 'open.spotify.com' in url:
+        result = spotify_track(url)
+        if isinstance(result, tuple):
+            log(f'Failed to retrieve Spotify track: {result[1]}')
+            return None, result[1]
+        return result['duration']
+
+    # yt-dlp should handle most other URLs
+    try:
+        info_dict = ytdl.extract_info(url, download=False)
+    except yt_dlp.utils.DownloadError as e:
+        log(f'Failed to retrieve video length: {e}')
+        return None, e
+    return info_dict.get('duration', 0)
+
+
+def title_from_url(url: str) -> str|tuple:
+    """Automatically detects the source of a given URL, and returns its extracted title."""
+    log(f'Getting title of \'{url}\'...', verbose=True)
+    if 'youtube.com' in url:
+        try:
+            return pytube.YouTube(url).title
+        except Exception as e:
+            pytube_fallbacks.inc(operation='title')
+            log(f'pytube encountered "{traceback.format_exception(e)[-1]}" during title retrieval. Falling back on yt-dlp.', verbose=True)
+            # Continues after this block so this isn't duplicated
+    elif 'soundcloud.com' in url:
+        return sc.resolve(url).title
+    elif 'open.spotify.com' in url:
+        return spotify_track(url)['title']
+
+    # yt-dlp should handle most other URLs
+    try:
+        info_dict = ytdl.extract_info(url, download=False)
+    except yt_dlp.utils.DownloadError as e:
+        log(f'Failed to retrieve title: {e}')
+        return None, e
+    return info_dict.get('title', None)
+
+
+def playback_info(url: str, download: bool, bitrate: int=0) -> dict:
+    """Extracts a video's info for playback, downloading it too if `download` is set
+
+    The format is picked by the download profile, aiming for `bitrate` kbps (usually the voice channel's).
+    The info is sanitized so it can be sent between processes.
+    """
+    client = download_client(bitrate)
+    return client.sanitize_info(client.extract_info(url, download=download))
+
+
+def video_info(url: str) -> dict:
+    """Returns the URL, title, and duration of a single ytdl-compatible video; raises `DownloadError` if it's unavailable"""
+    info = ytdl.extract_info(url, download=False)
+    return {'url': info['webpage_url'], 'title': info['title'], 'duration': info.get('duration', 0)}
+
+
+def playlist_entries(url: str) -> list[dict]:
+    """Returns the URL, title, and duration of every entry in a SoundCloud or ytdl-compatible playlist
+
+    Raises `TypeError` for a SoundCloud URL that isn't a set, or `DownloadError` if yt-dlp can't read it.
+    """
+    if 'soundcloud.com' in url:
+        return [{'url': track.permalink_url, 'title': track.title, 'duration': round(track.duration/1000)}
+            for track in soundcloud_playlist(url)]
+    info = ytdl.extract_info(url, download=False)
+    return [{'url': entry['url'], 'title': entry['title'], 'duration': entry.get('duration', 0)} for entry in info['entries']]
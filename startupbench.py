@@ -0,0 +1,57 @@
+"""Measures how long bot.py takes to load, and exits with an error if it's over the "startup-budget.import" config value
+
+Each run imports bot.py in a fresh interpreter, without logging in, and reads the startup timeline it records.
+Like running the bot itself, this replaces vimusbot.log, so don't run it in the same folder as a running bot.
+
+Usage: python startupbench.py [runs] [budget in seconds]
+"""
+import json
+import statistics
+import subprocess
+import sys
+
+from palette import Palette
+import settings
+
+plt = Palette()
+
+MARKER = 'STARTUP_TIMELINE '
+
+def measure() -> list[tuple[str, float]]:
+    """Imports bot.py in a new process and returns its startup timeline"""
+    code = f'import json, bot; print({MARKER!r} + json.dumps(bot.startup_timeline))'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    for line in reversed(result.stdout.splitlines()):
+        if line.startswith(MARKER):
+            return [tuple(step) for step in json.loads(line.removeprefix(MARKER))]
+    print(result.stdout)
+    print(result.stderr)
+    raise RuntimeError(f'bot.py did not finish loading (exit code {result.returncode})')
+
+def main() -> int:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    budget = float(sys.argv[2]) if len(sys.argv) > 2 else settings.current().startup_budget_import
+
+    timelines = []
+    for i in range(runs):
+        timeline = measure()
+        timelines.append(timeline)
+        print(f'Run {i + 1}: ' + ' | '.join(f'{step} {round(elapsed, 3)}s' for step, elapsed in timeline))
+
+    # Steps are the same every run, so the median of each one can be lined up
+    print('\nMedian per step:')
+    previous = 0.0
+    for n, (step, _) in enumerate(timelines[0]):
+        elapsed = statistics.median(timeline[n][1] for timeline in timelines)
+        print(f'  {step:<16} {round(elapsed, 3):>7}s  (+{round(elapsed - previous, 3)}s)')
+        previous = elapsed
+
+    total = statistics.median(timeline[-1][1] for timeline in timelines)
+    if budget and total > budget:
+        print(f'{plt.error}Loading took {round(total, 3)}s, over the budget of {budget}s.')
+        return 1
+    print(f'{plt.lime}Loading took {round(total, 3)}s' + (f', within the budget of {budget}s.' if budget else '.'))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
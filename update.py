@@ -1,5 +1,7 @@
+import json
 import os
 import shutil
+import time
 import urllib.request
 from pathlib import Path
 from zipfile import ZipFile
@@ -22,6 +24,29 @@ def check() -> tuple[bool, dict]:
 
     return current == latest_tag, {'current': current, 'latest': latest}
 
+# Where check_cached() keeps the last release it saw
+CHECK_CACHE_FILE = 'update_check.json'
+
+def check_cached(max_age: int=6*60*60) -> tuple[bool, dict]:
+    """Same as `check()`, but reuses the last known release if it was checked less than `max_age` seconds ago"""
+    with open('version.txt', 'r') as f:
+        current: str = f.read().strip()
+
+    try:
+        with open(CHECK_CACHE_FILE, 'r') as f:
+            cached = json.load(f)
+        if time.time() - cached['checked'] < max_age:
+            latest: dict = cached['latest']
+            # Compared again in case version.txt changed since then
+            return current == latest['tag_name'].strip(), {'current': current, 'latest': latest}
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+
+    result = check()
+    with open(CHECK_CACHE_FILE, 'w') as f:
+        json.dump({'checked': time.time(), 'latest': result[1]['latest']}, f)
+    return result
+
 def main() -> None:
     print('Checking...')
 
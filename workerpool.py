@@ -0,0 +1,233 @@
+"""Warm worker processes for CPU-heavy lookups and downloads
+
+Each worker is a separate Python process that keeps its own yt-dlp, YouTube Music, Spotify and SoundCloud clients,
+and runs `spoofy` functions sent to it over its stdin/stdout. A worker that takes longer than the timeout is killed
+and replaced, so a stuck extraction can't tie it up for good.
+"""
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO
+
+# Local files
+import customlog
+
+last_logtime = time.time()
+
+def log(msg: str, verbose=False):
+    global last_logtime
+    customlog.newlog(msg=msg, last_logtime=last_logtime,
+                     called_from=sys._getframe().f_back.f_code.co_name, verbose=verbose)
+    last_logtime = time.time()
+
+# How long a new worker gets to import everything and say it's ready
+STARTUP_TIMEOUT = 60.0
+
+@dataclass(frozen=True)
+class Request:
+    """A call to a `spoofy` function, sent to a worker process or the resolver service"""
+    operation: str
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+
+@dataclass(frozen=True)
+class Response:
+    """The result of a `Request`; `error` is set instead of `value` if it raised"""
+    value: Any = None
+    error: BaseException|None = None
+    elapsed: float = 0.0
+
+    def result(self) -> Any:
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+class WorkerError(Exception):
+    """Raised when a worker dies while running a request, or its error couldn't be sent back as it was"""
+
+def run_request(request: Request) -> Response:
+    """Runs a request in this process"""
+    # Only imported when something is actually run, so the bot doesn't need it just to send requests elsewhere
+    import spoofy
+    start = time.perf_counter()
+    try:
+        value = getattr(spoofy, request.operation)(*request.args, **request.kwargs)
+    except Exception as e:
+        return Response(error=e, elapsed=time.perf_counter() - start)
+    return Response(value=value, elapsed=time.perf_counter() - start)
+
+def picklable_error(error: BaseException) -> BaseException:
+    """Returns `error` if it can be pickled, or else a copy of the same type without what stops it (like yt-dlp's
+    `DownloadError`, which keeps the traceback of what caused it), so it can still be caught by its type elsewhere
+
+    Falls back on a `WorkerError` describing it if it can't be copied either.
+    """
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        pass
+    try:
+        copy = type(error)(str(error))
+        pickle.loads(pickle.dumps(copy))
+        return copy
+    except Exception:
+        return WorkerError(f'{type(error).__name__}: {error}')
+
+def picklable_response(response: Response) -> Response:
+    if response.error is None:
+        return response
+    return Response(error=picklable_error(response.error), elapsed=response.elapsed)
+
+def run_picklable_request(request: Request) -> Response:
+    """Runs a request in this process, for a response that's sent to another one"""
+    return picklable_response(run_request(request))
+
+def dump_response(response: Response) -> bytes:
+    """Pickles a response, replacing an error that can't be pickled with one that can"""
+    response = picklable_response(response)
+    try:
+        return pickle.dumps(response)
+    except Exception as e:
+        # The value itself can't be pickled
+        return pickle.dumps(Response(error=WorkerError(f'{type(e).__name__}: {e}'), elapsed=response.elapsed))
+
+def serve():
+    """Runs requests from stdin until it's closed; started by `Worker`, not meant to be run directly"""
+    requests_in: BinaryIO = sys.stdin.buffer
+    # Responses get stdout to themselves; anything printed (like logs) goes to stderr instead
+    responses_out: BinaryIO = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    import spoofy
+    spoofy.warm_clients()
+    responses_out.write(dump_response(Response(value='ready')))
+    responses_out.flush()
+
+    while True:
+        try:
+            request: Request = pickle.load(requests_in)
+        except EOFError:
+            # The bot has exited or replaced this worker
+            return
+        responses_out.write(dump_response(run_request(request)))
+        responses_out.flush()
+
+class Worker:
+    def __init__(self, number: int):
+        self.number = number
+        env = os.environ.copy()
+        # Each worker logs to its own file, named after whatever the bot process logs to
+        env[customlog.LOG_TAG_VARIABLE] = f'{customlog.tag} worker {number}'.strip()
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        self.started = time.time()
+        self.requests = 0
+        self.timed_out = False
+
+    def send(self, request: Request):
+        pickle.dump(request, self.process.stdin)
+        self.process.stdin.flush()
+
+    def receive(self, timeout: float) -> Response:
+        """Waits for the next response, killing the process if it takes longer than `timeout` seconds"""
+        timer = threading.Timer(timeout, self.kill, kwargs={'timed_out': True})
+        timer.start()
+        try:
+            return pickle.load(self.process.stdout)
+        finally:
+            timer.cancel()
+
+    def kill(self, timed_out: bool=False):
+        self.timed_out = timed_out
+        self.process.kill()
+
+class WorkerPool:
+    """A fixed number of warm worker processes, shared by every thread that runs requests
+
+    - `workers` (int): How many worker processes to keep running
+    - `timeout` (float): Seconds a request can take before its worker is killed and replaced
+    """
+    def __init__(self, workers: int=2, timeout: float=120.0):
+        self.workers = max(workers, 1)
+        self.timeout = timeout
+        self._idle: queue.Queue[Worker] = queue.Queue()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self.alive = 0
+        self.replaced = 0
+        self.timeouts = 0
+
+    def start(self):
+        """Starts every worker and waits for them to be ready; called automatically by the first request"""
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            workers = [Worker(n) for n in range(1, self.workers + 1)]
+            self.alive = len(workers)
+        for worker in workers:
+            self._ready(worker)
+
+    def _ready(self, worker: Worker):
+        try:
+            worker.receive(STARTUP_TIMEOUT)
+        except (EOFError, OSError, pickle.UnpicklingError) as e:
+            # Left out of the pool rather than retried, so a broken setup doesn't restart workers forever
+            self.alive -= 1
+            log(f'Worker {worker.number} failed to start ({e or "exited"}); {self.alive} worker(s) left.')
+            return
+        log(f'Worker {worker.number} is ready (PID {worker.process.pid}).', verbose=True)
+        self._idle.put(worker)
+
+    def _replace(self, worker: Worker):
+        worker.kill()
+        self.replaced += 1
+        # Started in the background, so the request that failed doesn't also wait for its replacement
+        threading.Thread(target=self._ready, args=(Worker(worker.number),), daemon=True).start()
+
+    def _checkout(self) -> Worker|None:
+        while self.alive > 0:
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                continue
+        return None
+
+    def run(self, request: Request) -> Any:
+        """Runs a request in the next free worker and returns its result, raising anything it raised
+
+        Raises `TimeoutError` if it took too long, or `WorkerError` if the worker died.
+        """
+        self.start()
+        worker = self._checkout()
+        if worker is None:
+            # Every worker failed to start, but lookups should still work
+            return run_request(request).result()
+        try:
+            worker.send(request)
+            response = worker.receive(self.timeout)
+        except (EOFError, OSError, pickle.UnpicklingError):
+            timed_out = worker.timed_out
+            self._replace(worker)
+            if timed_out:
+                self.timeouts += 1
+                raise TimeoutError(f'{request.operation}() took more than {self.timeout}s; its worker was replaced.')
+            raise WorkerError(f'The worker running {request.operation}() exited unexpectedly; it was replaced.')
+
+        worker.requests += 1
+        self._idle.put(worker)
+        return response.result()
+
+    def stats(self) -> dict[str, int]:
+        return {'workers': self.workers, 'idle': self._idle.qsize(), 'replaced': self.replaced, 'timeouts': self.timeouts}
+
+if __name__ == '__main__':
+    # Imported by name, so responses are pickled as workerpool.Response rather than __main__.Response
+    import workerpool
+    workerpool.serve()